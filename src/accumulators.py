@@ -0,0 +1,321 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+import numpy as np
+
+class Moments:
+    """Mergeable count, mean and sum of squared deviations (M2) of several variables, per key.
+
+    Records are added by batches with vectorized operations. Batches and accumulators are
+    merged with the pairwise update of Chan et al., which stays accurate where the sum
+    of squares formula suffers from cancellation.
+    """
+    def __init__(self, n_vars):
+        """
+        Parameters
+        ----------
+        n_vars : integer
+                 Number of variables of a record.
+        """
+        self.n_vars = n_vars
+        # key -> row of the arrays
+        self.index = {}
+        self.count = np.zeros(0)
+        self.mean = np.zeros((0, n_vars))
+        self.M2 = np.zeros((0, n_vars))
+
+    def _rows(self, keys):
+        """Give the rows of the keys, rows of new keys are added."""
+        rows = np.empty(len(keys), dtype=np.int64)
+        new = 0
+        for i, key in enumerate(keys):
+            row = self.index.get(key)
+            if row is None:
+                row = self.index[key] = len(self.index)
+                new += 1
+            rows[i] = row
+        if new:
+            self.count = np.concatenate((self.count, np.zeros(new)))
+            self.mean = np.concatenate((self.mean, np.zeros((new, self.n_vars))))
+            self.M2 = np.concatenate((self.M2, np.zeros((new, self.n_vars))))
+        return rows
+
+    def _merge_rows(self, rows, count, mean, M2):
+        """Merge partial results into the given rows."""
+        count_a = self.count[rows]
+        total = count_a + count
+        delta = mean - self.mean[rows]
+        weight = (count / total)[:, np.newaxis]
+        self.mean[rows] += delta * weight
+        self.M2[rows] += M2 + delta**2 * (count_a * weight[:, 0])[:, np.newaxis]
+        self.count[rows] = total
+
+    def add(self, keys, values):
+        """Add a batch of records.
+
+        Parameters
+        ----------
+        keys : array-like (n,) or (n, k)
+               Integer key of every record, keys of several columns are stored as tuples.
+
+        values : array-like (n, n_vars)
+                 Variables of every record.
+        """
+        keys = np.asarray(keys)
+        values = np.asarray(values, dtype=np.float64).reshape(len(keys), self.n_vars)
+        if not len(keys):
+            return self
+        if keys.ndim == 1:
+            unique, inverse = np.unique(keys, return_inverse=True)
+            unique = unique.tolist()
+        else:
+            unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+            unique = [tuple(key) for key in unique.tolist()]
+        inverse = inverse.reshape(-1)
+        count = np.bincount(inverse, minlength=len(unique)).astype(np.float64)
+        mean = np.empty((len(unique), self.n_vars))
+        M2 = np.empty((len(unique), self.n_vars))
+        for j in range(self.n_vars):
+            mean[:, j] = np.bincount(inverse, weights=values[:, j], minlength=len(unique)) / count
+            deviation = values[:, j] - mean[inverse, j]
+            M2[:, j] = np.bincount(inverse, weights=deviation**2, minlength=len(unique))
+        self._merge_rows(self._rows(unique), count, mean, M2)
+        return self
+
+    def add_moments(self, keys, count, mean, M2):
+        """Add partial results computed elsewhere, one per key.
+
+        Parameters
+        ----------
+        keys : list
+               Keys of the partial results, all different.
+
+        count : array-like (n,)
+                Number of records of every key.
+
+        mean, M2 : array-like (n, n_vars)
+                   Mean and sum of squared deviations of the variables of every key.
+        """
+        count = np.asarray(count, dtype=np.float64)
+        kept = count > 0
+        if kept.any():
+            rows = self._rows([key for key, keep in zip(keys, kept.tolist()) if keep])
+            self._merge_rows(rows, count[kept], np.asarray(mean, dtype=np.float64)[kept], np.asarray(M2, dtype=np.float64)[kept])
+        return self
+
+    def merge(self, other):
+        """Merge another accumulator into this one and return this one."""
+        if other.index:
+            keys = list(other.index)
+            other_rows = np.fromiter(other.index.values(), dtype=np.int64, count=len(keys))
+            self._merge_rows(self._rows(keys), other.count[other_rows], other.mean[other_rows], other.M2[other_rows])
+        return self
+
+    def regroup(self, key):
+        """Merge the results of the keys which share a new key into a new accumulator.
+
+        Parameters
+        ----------
+        key : function
+              Give the new key of a key.
+        """
+        acc = Moments(self.n_vars)
+        for old_key, row in self.index.items():
+            rows = acc._rows([key(old_key)])
+            acc._merge_rows(rows, self.count[row:row+1], self.mean[row:row+1], self.M2[row:row+1])
+        return acc
+
+    def items(self):
+        """Iterate over (key, (count, mean, M2)), mean and M2 are arrays of n_vars values."""
+        for key, row in self.index.items():
+            yield key, (self.count[row], self.mean[row], self.M2[row])
+
+    def __len__(self):
+        return len(self.index)
+
+class KLL:
+    """Mergeable quantile sketch of Karnin, Lang and Liberty for one variable, in bounded memory.
+
+    Items of level h stand for 2**h values. Capacities shrink by 2/3 from the top level down, to
+    at least MIN_CAPACITY items. When the sketch holds more items than the sum of the capacities,
+    the lowest level over its capacity is sorted and every other item, from a random start, is
+    promoted to the next level. The sketch keeps at most about 3*k items, and MIN_CAPACITY more
+    per level for a small k, and the rank error of a quantile is about 1.7/k.
+    """
+    # Smallest capacity of a level
+    MIN_CAPACITY = 8
+
+    def __init__(self, k=200):
+        """
+        Parameters
+        ----------
+        k : integer
+            Capacity of the top level, trades accuracy for memory.
+        """
+        self.k = k
+        self.n = 0
+        self.levels = [np.zeros(0)]
+
+    def _capacity(self, level):
+        return max(self.MIN_CAPACITY, int(np.ceil(self.k * (2 / 3) ** (len(self.levels) - level - 1))))
+
+    def _compress(self):
+        while len(self) > sum(self._capacity(level) for level in range(len(self.levels))):
+            level = next(level for level, items in enumerate(self.levels) if len(items) >= self._capacity(level))
+            if level + 1 == len(self.levels):
+                self.levels.append(np.zeros(0))
+            items = np.sort(self.levels[level])
+            # An odd item stays at its level, the start of the promoted items is random so that they are unbiased
+            odd = len(items) % 2
+            self.levels[level] = items[:odd]
+            self.levels[level + 1] = np.concatenate((self.levels[level + 1], items[odd + random.getrandbits(1)::2]))
+
+    def update(self, values):
+        """Add values to the sketch."""
+        values = np.asarray(values, dtype=np.float64).reshape(-1)
+        if len(values):
+            self.n += len(values)
+            self.levels[0] = np.concatenate((self.levels[0], values))
+            self._compress()
+        return self
+
+    def merge(self, other):
+        """Merge another sketch into this one and return this one."""
+        if other.n:
+            while len(self.levels) < len(other.levels):
+                self.levels.append(np.zeros(0))
+            for level, items in enumerate(other.levels):
+                self.levels[level] = np.concatenate((self.levels[level], items))
+            self.n += other.n
+            self._compress()
+        return self
+
+    def quantiles(self, q):
+        """Give the approximate quantiles of the values, NaN if the sketch is empty.
+
+        Parameters
+        ----------
+        q : array-like
+            Quantiles between 0 and 1.
+        """
+        q = np.asarray(q, dtype=np.float64)
+        if not self.n:
+            return np.full(q.shape, np.nan)
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2.0**level) for level, items in enumerate(self.levels)])
+        order = np.argsort(items, kind="stable")
+        cumulated = np.cumsum(weights[order])
+        ranks = np.searchsorted(cumulated, q * cumulated[-1], side="left")
+        return items[order][np.minimum(ranks, len(items) - 1)]
+
+    def __len__(self):
+        """Number of items kept."""
+        return sum(len(items) for items in self.levels)
+
+class Quantiles:
+    """Mergeable quantile sketches (see KLL) of several variables, per key.
+
+    Same interface as Moments: records are added by batches and accumulators are merged or regrouped.
+    """
+    def __init__(self, n_vars, k=200):
+        """
+        Parameters
+        ----------
+        n_vars : integer
+                 Number of variables of a record.
+
+        k : integer
+            Accuracy of the sketches, see KLL.
+        """
+        self.n_vars = n_vars
+        self.k = k
+        # key -> list of n_vars sketches
+        self.sketches = {}
+
+    def _sketches(self, key):
+        sketches = self.sketches.get(key)
+        if sketches is None:
+            sketches = self.sketches[key] = [KLL(self.k) for _ in range(self.n_vars)]
+        return sketches
+
+    def add(self, keys, values):
+        """Add a batch of records, see Moments.add."""
+        keys = np.asarray(keys)
+        values = np.asarray(values, dtype=np.float64).reshape(len(keys), self.n_vars)
+        if not len(keys):
+            return self
+        if keys.ndim == 1:
+            unique, inverse = np.unique(keys, return_inverse=True)
+            unique = unique.tolist()
+        else:
+            unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+            unique = [tuple(key) for key in unique.tolist()]
+        inverse = inverse.reshape(-1)
+        # Records sorted by key, then cut at every change of key
+        order = np.argsort(inverse, kind="stable")
+        bounds = np.cumsum(np.bincount(inverse, minlength=len(unique)))[:-1]
+        for key, rows in zip(unique, np.split(order, bounds)):
+            for sketch, column in zip(self._sketches(key), values[rows].T):
+                sketch.update(column)
+        return self
+
+    def merge(self, other):
+        """Merge another accumulator into this one and return this one."""
+        for key, sketches in other.sketches.items():
+            for sketch, other_sketch in zip(self._sketches(key), sketches):
+                sketch.merge(other_sketch)
+        return self
+
+    def regroup(self, key):
+        """Merge the sketches of the keys which share a new key into a new accumulator, see Moments.regroup."""
+        acc = Quantiles(self.n_vars, self.k)
+        for old_key, sketches in self.sketches.items():
+            for sketch, other_sketch in zip(acc._sketches(key(old_key)), sketches):
+                sketch.merge(other_sketch)
+        return acc
+
+    def quantiles(self, q):
+        """Iterate over (key, quantiles), quantiles is an array (len(q), n_vars)."""
+        for key, sketches in self.sketches.items():
+            yield key, np.column_stack([sketch.quantiles(q) for sketch in sketches])
+
+    def to_arrays(self):
+        """Give the sketches as flat arrays, to store them with np.savez, see from_arrays."""
+        keys, counts, items, owners, levels = [], [], [], [], []
+        for i, (key, sketches) in enumerate(self.sketches.items()):
+            keys.append(key)
+            for j, sketch in enumerate(sketches):
+                counts.append(sketch.n)
+                for level, level_items in enumerate(sketch.levels):
+                    items.append(level_items)
+                    owners.append(np.full(len(level_items), i * self.n_vars + j))
+                    levels.append(np.full(len(level_items), level))
+        concatenate = lambda arrays, dtype: np.concatenate(arrays).astype(dtype) if arrays else np.zeros(0, dtype=dtype)
+        return {
+            "keys": np.array(keys, dtype=np.int64),
+            "counts": np.array(counts, dtype=np.int64),
+            "items": concatenate(items, np.float64),
+            "owners": concatenate(owners, np.int64),
+            "levels": concatenate(levels, np.int64),
+        }
+
+    @classmethod
+    def from_arrays(cls, n_vars, k, arrays):
+        """Build an accumulator from the arrays given by to_arrays."""
+        acc = cls(n_vars, k)
+        # Items sorted by sketch, then cut at every change of sketch
+        order = np.argsort(arrays["owners"], kind="stable")
+        bounds = np.searchsorted(arrays["owners"][order], np.arange(1, len(arrays["counts"])))
+        owned = np.split(order, bounds)
+        for i, key in enumerate(arrays["keys"].tolist()):
+            sketches = acc._sketches(tuple(key) if isinstance(key, list) else key)
+            for j, sketch in enumerate(sketches):
+                rows = owned[i * n_vars + j]
+                items, levels = arrays["items"][rows], arrays["levels"][rows]
+                sketch.n = int(arrays["counts"][i * n_vars + j])
+                sketch.levels = [items[levels == level] for level in range(int(levels.max()) + 1 if len(levels) else 1)]
+        return acc
+
+    def __len__(self):
+        return len(self.sketches)
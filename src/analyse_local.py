@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""Run the analyses of analyse_spark on one machine, without Spark.
+
+The flights files are cut into byte ranges (see flight_data.file_splits), a file with a fresh
+columnar cache is memory-mapped instead. Every unit is parsed, cleaned and reduced into partial
+results by a pool of worker processes, only the partial results come back to the calling process:
+the memory used is about one unit and one batch per worker, whatever the size of the files.
+
+The functions take the paths of the flights files instead of a RDD and return what the functions
+of the same name of analyse_spark return. check_parity compares both engines on the same files.
+"""
+
+import os
+import itertools
+import concurrent.futures
+
+import numpy as np
+
+import metrics
+import flight_data
+from flight_data import PlaneRegistry, get_plane_registry, file_splits, is_cache_fresh, _cache_size, _read_cache_batches, _split_batches, _init_worker
+from accumulators import Moments, Quantiles
+from grouping import AGE_GROUPS, YearBins
+from analyses import (
+    QUANTILES, SKETCH_K, ANALYSES, clean_mask, _group_moments, _group_quantiles, _comp_mean_std,
+    _delay_dataframes, _quantile_dataframes, _scan_batches, _merge_partials, _analyses_of_partials,
+)
+
+# Size in bytes of the byte ranges of the files reduced by one worker
+SPLIT_BYTES = 64 * 2**20
+
+# Maximum number of flights parsed and reduced at once
+BATCH_SIZE = 100000
+
+#
+# Scan of the flights files
+#
+def _units(fnames, use_cache, cache_dir, split_size):
+    """Cut files into (filename, start, stop) byte ranges, start and stop are None for a file read from its cache."""
+    units = []
+    for fname in fnames:
+        if use_cache and is_cache_fresh(fname, cache_dir):
+            units.append((fname, None, None))
+        else:
+            units.extend(file_splits(fname, split_size))
+    return units
+
+def _clean_batches(unit, Plane, batch_size, cache_dir):
+    """Give the clean FlightBatch of a unit, see analyse_spark.get_D_clean."""
+    filename, start, stop = unit
+    if start is None:
+        batches = _read_cache_batches(filename, Plane, batch_size, cache_dir)
+    else:
+        batches = _split_batches(filename, start, stop, Plane, batch_size)
+    for batch in batches:
+        mask = clean_mask(batch)
+        if mask.all():
+            yield batch
+        elif mask.any():
+            yield batch[mask]
+
+def _reduce_unit(unit, reduce, args, batch_size, cache_dir):
+    """Reduce the clean flights of a unit in a worker process, the plane registry was sent by _init_worker."""
+    return reduce(_clean_batches(unit, flight_data._WORKER_PLANE, batch_size, cache_dir), *args)
+
+def scan(fnames, reduce, args, merge, initial, Plane=None, processes=None, use_cache=True, cache_dir=None,
+         split_size=SPLIT_BYTES, batch_size=BATCH_SIZE):
+    """Reduce the clean flights of files with a pool of worker processes.
+
+    Parameters
+    ----------
+    fnames : iterable
+             Paths of the flights files.
+
+    reduce : function
+             reduce(batches, *args) gives the partial result of the clean FlightBatch of a unit. It must
+             be a function of a module, so that worker processes can receive it.
+
+    merge : function
+            merge(x, y) merges the partial result y into x and returns x.
+
+    initial : object
+              Empty partial result, the partial results of the units are merged into it in order.
+
+    Plane : PlaneRegistry or dict
+            Links tail numbers to delivery years. The shared registry is used if not given.
+
+    processes : integer
+                Number of worker processes, one per unit up to the number of processors if not
+                given. The units are reduced by the calling process when it is 1.
+
+    use_cache : boolean
+                Read the columnar cache of a file instead of the file when the cache is fresh.
+
+    cache_dir : string
+                Directory of the columnar caches, see flight_data.build_cache.
+
+    split_size : integer
+                 Size in bytes of the byte ranges of the files reduced by one worker.
+
+    batch_size : integer
+                 Maximum number of flights parsed and reduced at once.
+    """
+    if Plane is None:
+        Plane = get_plane_registry()
+    elif not isinstance(Plane, PlaneRegistry):
+        Plane = PlaneRegistry(Plane)
+    units = _units(fnames, use_cache, cache_dir, split_size)
+    if metrics.ENABLED:
+        for filename, start, stop in units:
+            size = _cache_size(filename, cache_dir) if start is None else stop - start
+            metrics.count("bytes_read", size, source="cache" if start is None else "csv", engine="local")
+    if processes is None:
+        processes = min(len(units), os.cpu_count() or 1)
+    result = initial
+    if processes <= 1:
+        for unit in units:
+            result = merge(result, reduce(_clean_batches(unit, Plane, batch_size, cache_dir), *args))
+        return result
+    with concurrent.futures.ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(Plane,)) as pool:
+        partials = pool.map(
+            _reduce_unit, units, itertools.repeat(reduce), itertools.repeat(args), itertools.repeat(batch_size), itertools.repeat(cache_dir)
+        )
+        for partial in partials:
+            result = merge(result, partial)
+    return result
+
+#
+# Analyses, see the functions of the same name of analyse_spark
+#
+# options are the keyword arguments of scan.
+#
+@metrics.timed("local_delay_per_group")
+def delay_per_group(fnames, grouping, **options):
+    """Compute mean and standard deviation of arrival and departure delay per group and year.
+
+    Parameters
+    ----------
+    fnames : iterable
+             Paths of the flights files.
+
+    grouping : object
+               Assign flights of a FlightBatch to groups, see grouping.Bins and grouping.YearBins.
+    """
+    moments = scan(fnames, _group_moments, (grouping,), Moments.merge, Moments(2), **options)
+    return _delay_dataframes([_comp_mean_std(data) for data in moments.items()], grouping.nb_groups)
+
+@metrics.timed("local_delay_quantiles_per_group")
+def delay_quantiles_per_group(fnames, grouping, q=QUANTILES, k=SKETCH_K, **options):
+    """Compute approximate quantiles of arrival and departure delay per group and year, see analyse_spark.delay_quantiles_per_group."""
+    sketches = scan(fnames, _group_quantiles, (grouping, k), Quantiles.merge, Quantiles(2, k), **options)
+    return _quantile_dataframes(list(sketches.quantiles(q)), grouping.nb_groups, q)
+
+def avg_delay_per_age_group(fnames, **options):
+    """Compute mean and standard deviation of arrival and departure delay for different age categories and years."""
+    return delay_per_group(fnames, AGE_GROUPS, **options)
+
+def delay_quantiles_per_age_group(fnames, q=QUANTILES, k=SKETCH_K, **options):
+    """Compute approximate quantiles of arrival and departure delay for different age categories and years."""
+    return delay_quantiles_per_group(fnames, AGE_GROUPS, q, k, **options)
+
+def avg_age_plane_year(fnames, **options):
+    """Compute the middle age of planes which flew over a year per year."""
+    return run_analyses(fnames, ("avg_age_plane_year",), **options)["avg_age_plane_year"]
+
+def delay_over_avg_age_year(fnames, avg_age, **options):
+    """Compute means and standard deviations for two groups of planes : plane older than the middle age and younger for different years."""
+    return delay_per_group(fnames, YearBins.over_mean("plane_age", avg_age), **options)
+
+@metrics.timed("local_run_analyses")
+def run_analyses(fnames, analyses=tuple(ANALYSES), q=QUANTILES, k=SKETCH_K, **options):
+    """Run several analyses with a single scan of the files, see analyse_spark.run_analyses.
+
+    Return
+    ------
+    results : dict
+              Links every analysis to what the function of the same name returns.
+    """
+    partials = {partial for analysis in analyses for partial in ANALYSES[analysis]}
+    delays, planes, quantiles = scan(fnames, _scan_batches, (partials, k), _merge_partials, (Moments(2), {}, Quantiles(2, k)), **options)
+    return _analyses_of_partials(delays, planes, quantiles, analyses, q)
+
+#
+# Parity with the Spark engine
+#
+# Accuracy of the sketches of check_parity: they keep every delay, so that the quantiles of both
+# engines are exact and can be compared. Sketches merged in another order keep other items otherwise.
+PARITY_K = 2**31
+
+# Largest relative difference accepted, the moments only differ by the order of the additions
+PARITY_RTOL = 1e-9
+
+def difference(x, y):
+    """Give the largest difference between two results of an analysis, relative to y or absolute under 1.
+
+    It is infinite when the columns or the missing values of the results differ.
+    """
+    if isinstance(x, tuple):
+        return max(difference(u, v) for u, v in zip(x, y))
+    if hasattr(x, "columns"):
+        if list(x.columns) != list(y.columns):
+            return np.inf
+        x, y = x.to_numpy(float), y.to_numpy(float)
+    else:
+        # Rows of avg_age_plane_year are years in any order
+        x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+        x, y = (values[np.argsort(values[:, 0])] if values.ndim == 2 and len(values) else values for values in (x, y))
+    if x.shape != y.shape or (np.isnan(x) != np.isnan(y)).any():
+        return np.inf
+    known = ~np.isnan(y)
+    if not known.any():
+        return 0.0
+    return float(np.max(np.abs(x[known] - y[known]) / np.maximum(np.abs(y[known]), 1)))
+
+def check_parity(fnames, sc=None, Plane=None, analyses=tuple(ANALYSES), **options):
+    """Run analyses with the local engine and with Spark on the same files and compare their results.
+
+    Parameters
+    ----------
+    fnames : list
+             Paths of the flights files, reachable from the Spark executors.
+
+    sc : SparkContext
+         Context of the Spark run, a new one if not given.
+
+    options :
+              Keyword arguments of scan for the local run.
+
+    The quantile sketches keep every delay (see PARITY_K): parity is checked on a sample of the
+    data, one or two years.
+
+    Return
+    ------
+    differences : dict
+                  Links every analysis to (difference, ok): the difference of the results, see
+                  difference, and whether it is within PARITY_RTOL.
+    """
+    import analyse_spark
+    fnames = list(fnames)
+    local = run_analyses(fnames, analyses, k=PARITY_K, Plane=Plane, **options)
+    sc, D = analyse_spark.get_RDD_from_flight_data(fnames, sc=sc, Plane=Plane, batches=True)
+    spark = analyse_spark.run_analyses(D, analyses, k=PARITY_K)
+    differences = {}
+    for analysis in analyses:
+        value = difference(local[analysis], spark[analysis])
+        differences[analysis] = (value, value <= PARITY_RTOL)
+    return differences
@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""Analyses of the flights shared by the Spark and local engines.
+
+Partitions of FlightBatch are reduced into partial results, moments and quantile sketches per
+group and year, which are merged and turned into the DataFrames of the analyses. Nothing here
+depends on the engine which reads and distributes the flights.
+"""
+
+import numpy as np
+import pandas as pd
+
+from accumulators import Moments, Quantiles
+from grouping import AGE_GROUPS
+from report import Chart
+
+# Quantiles of the delays given by the quantile analyses, and accuracy of their sketches (see accumulators.KLL)
+QUANTILES = (0.5, 0.9, 0.99)
+SKETCH_K = 200
+
+#
+# Reductions of FlightBatch per group and year
+#
+def clean_mask(batch, includeCancelledFlights=False):
+    """Give the boolean array of the flights of a FlightBatch kept by analyse_spark.get_D_clean."""
+    # A missing cancelled is true, as 'NA' in get_D_clean
+    cancelled = batch.cancelled | ~batch.valid("cancelled")
+    mask = ~cancelled
+    for name in ("year", "month", "day_month", "day_week", "hour", "plane_age", "ArrDelay", "DepDelay"):
+        mask &= batch.valid(name)
+    if includeCancelledFlights:
+        mask |= cancelled
+    return mask
+
+def _group_moments(batches, grouping):
+    """Reduce arrival and departure delays of a partition of FlightBatch per (group, year)."""
+    acc = Moments(2)
+    for batch in batches:
+        acc.add(np.column_stack((grouping.groups(batch), batch.year)), np.column_stack((batch.ArrDelay, batch.DepDelay)))
+    return acc
+
+def _group_quantiles(batches, grouping, k):
+    """Sketch arrival and departure delays of a partition of FlightBatch per (group, year)."""
+    acc = Quantiles(2, k)
+    for batch in batches:
+        acc.add(np.column_stack((grouping.groups(batch), batch.year)), np.column_stack((batch.ArrDelay, batch.DepDelay)))
+    return acc
+
+#
+# DataFrames of the results
+#
+def _comp_mean_std(data):
+    """Compute mean and standard deviation from the moments of arrival and departure delays."""
+    key, (count, (mean_ArrDelay, mean_DepDelay), (M2_ArrDelay, M2_DepDelay)) = data
+    std_ArrDelay = np.sqrt(M2_ArrDelay/count)
+    std_DepDelay = np.sqrt(M2_DepDelay/count)
+    return key, (mean_ArrDelay, std_ArrDelay, mean_DepDelay, std_DepDelay, count)
+
+def _delay_dataframes(delay_group, nb_groups):
+    """Build arrival and departure delays DataFrames with mean, count and std columns per year and one row per group.
+
+    Parameters
+    ----------
+    delay_group : list
+                  ((group, year), (mean_ArrDelay, std_ArrDelay, mean_DepDelay, std_DepDelay, count_group)) tuples.
+
+    nb_groups : integer
+                Number of groups.
+    """
+    years = np.array([year for ((group, year), (mean_ArrDelay, std_ArrDelay, mean_DepDelay, std_DepDelay, count_group)) in delay_group])
+    years = np.unique(years)
+
+    dico_ArrDelay = {}
+    dico_DepDelay = {}
+    for year in years:
+        dico_ArrDelay[f"mean-{year}"] = np.zeros(nb_groups)
+        dico_DepDelay[f"mean-{year}"] = np.zeros(nb_groups)
+        dico_ArrDelay[f"count-{year}"] = np.zeros(nb_groups)
+        dico_DepDelay[f"count-{year}"] = np.zeros(nb_groups)
+        dico_ArrDelay[f"std-{year}"] = np.zeros(nb_groups)
+        dico_DepDelay[f"std-{year}"] = np.zeros(nb_groups)
+
+    df_ArrDelay = pd.DataFrame(data=dico_ArrDelay)
+    df_DepDelay = pd.DataFrame(data=dico_DepDelay)
+    for ((group, year), (mean_ArrDelay, std_ArrDelay, mean_DepDelay, std_DepDelay, count_group)) in delay_group:
+        df_ArrDelay.loc[group, f"mean-{year}"] = mean_ArrDelay
+        df_ArrDelay.loc[group, f"count-{year}"] = count_group
+        df_ArrDelay.loc[group, f"std-{year}"] = std_ArrDelay
+
+        df_DepDelay.loc[group, f"mean-{year}"] = mean_DepDelay
+        df_DepDelay.loc[group, f"count-{year}"] = count_group
+        df_DepDelay.loc[group, f"std-{year}"] = std_DepDelay
+
+    return df_ArrDelay, df_DepDelay
+
+def _quantile_dataframes(quantile_group, nb_groups, q):
+    """Build arrival and departure delays DataFrames with one column per quantile and year and one row per group.
+
+    Parameters
+    ----------
+    quantile_group : list
+                     ((group, year), quantiles) tuples, quantiles is an array (len(q), 2) of arrival and departure delays.
+
+    nb_groups : integer
+                Number of groups.
+
+    q : array-like
+        Quantiles between 0 and 1, the column of quantile 0.9 of 2007 is "p90-2007".
+    """
+    years = np.unique([year for ((group, year), quantiles) in quantile_group])
+    columns = [f"p{100*quantile:g}-{year}" for year in years for quantile in q]
+    df_ArrDelay = pd.DataFrame(data=np.full((nb_groups, len(columns)), np.nan), columns=columns)
+    df_DepDelay = pd.DataFrame(data=np.full((nb_groups, len(columns)), np.nan), columns=columns)
+    for ((group, year), quantiles) in quantile_group:
+        for quantile, (arr, dep) in zip(q, quantiles):
+            df_ArrDelay.loc[group, f"p{100*quantile:g}-{year}"] = arr
+            df_DepDelay.loc[group, f"p{100*quantile:g}-{year}"] = dep
+    return df_ArrDelay, df_DepDelay
+
+#
+# Several analyses in one scan
+#
+# Every analysis is derived from partial results computed in the same scan of the data: the
+# moments and the quantile sketches of the delays per (year, plane age) and the age of every
+# plane which flew per year.
+# Plane ages are integers, so the age groups and the groups over the middle age of the year
+# are unions of (year, plane age) keys and do not need another scan once the middle age is known.
+#
+ANALYSES = {
+    # analysis -> partial results it needs
+    "avg_delay_per_age_group": ("delays",),
+    "avg_age_plane_year": ("planes",),
+    "delay_over_avg_age_year": ("delays", "planes"),
+    "delay_quantiles_per_age_group": ("quantiles",),
+}
+
+def _scan_batches(batches, partials, k):
+    """Compute the partial results of a partition of FlightBatch."""
+    delays = Moments(2)
+    planes = {}
+    quantiles = Quantiles(2, k)
+    for batch in batches:
+        keys = np.column_stack((batch.year, batch.plane_age))
+        values = np.column_stack((batch.ArrDelay, batch.DepDelay))
+        if "delays" in partials:
+            delays.add(keys, values)
+        if "planes" in partials:
+            planes.update(zip(zip(batch.tailnum.tolist(), batch.year.tolist()), batch.plane_age.tolist()))
+        if "quantiles" in partials:
+            quantiles.add(keys, values)
+    return delays, planes, quantiles
+
+def _merge_partials(x, y):
+    x[0].merge(y[0])
+    x[1].update(y[1])
+    x[2].merge(y[2])
+    return x
+
+def _analyses_of_partials(delays, planes, quantiles, analyses, q=QUANTILES, years=None):
+    """Derive analyses from the partial results, only for the given years if years is not None."""
+    if years is not None:
+        keys = [key for key in delays.index if key[0] in years]
+        rows = [delays.index[key] for key in keys]
+        delays = Moments(2).add_moments(keys, delays.count[rows], delays.mean[rows], delays.M2[rows])
+        planes = {key: age for key, age in planes.items() if key[1] in years}
+        kept = Quantiles(2, quantiles.k)
+        kept.sketches = {key: sketches for key, sketches in quantiles.sketches.items() if key[0] in years}
+        quantiles = kept
+
+    results = {}
+    partials = {partial for analysis in analyses for partial in ANALYSES[analysis]}
+    if "planes" in partials:
+        ages = Moments(1)
+        if planes:
+            ages.add(np.array([year for (tailnum, year) in planes]), np.array(list(planes.values())))
+        avg_age = np.array([(year, mean[0], count) for year, (count, mean, M2) in ages.items()])
+        if "avg_age_plane_year" in analyses:
+            results["avg_age_plane_year"] = avg_age
+    if "avg_delay_per_age_group" in analyses:
+        by_group = delays.regroup(lambda key: (int(np.searchsorted(AGE_GROUPS.bounds, key[1])), key[0]))
+        results["avg_delay_per_age_group"] = _delay_dataframes([_comp_mean_std(data) for data in by_group.items()], 6)
+    if "delay_over_avg_age_year" in analyses:
+        mean_age = {year: mean for (year, mean, count) in avg_age}
+        by_group = delays.regroup(lambda key: (1 if key[1] > mean_age[key[0]] else 0, key[0]))
+        results["delay_over_avg_age_year"] = _delay_dataframes([_comp_mean_std(data) for data in by_group.items()], 2)
+    if "delay_quantiles_per_age_group" in analyses:
+        by_group = quantiles.regroup(lambda key: (int(np.searchsorted(AGE_GROUPS.bounds, key[1])), key[0]))
+        results["delay_quantiles_per_age_group"] = _quantile_dataframes(list(by_group.quantiles(q)), 6, q)
+    return results
+
+#
+# Charts of the delays per age of plane of one year, see report.render
+#
+# Labels of the age groups of AGE_GROUPS
+AGE_LABELS = ('0-5 ans', '5-10 ans', '10-15 ans', '15-20 ans', '20-25 ans', '+25 ans')
+
+def _draw_mean_delays(figure, labels, title, xlabel, mean_ArrDelay, mean_DepDelay, std_ArrDelay=None, std_DepDelay=None):
+    """Draw the barplot of the means of arrival and departure delays per group, with their standard deviations if given."""
+    x = np.arange(len(labels))
+    width = 0.35
+    ax = figure.add_subplot(111)
+    ax.bar(x - width/2, mean_ArrDelay, width, label='Arrival', yerr=std_ArrDelay)
+    ax.bar(x + width/2, mean_DepDelay, width, label='Departure', yerr=std_DepDelay)
+    ax.set_xticks(x)
+    ax.set_xticklabels(labels)
+    ax.legend()
+    ax.set_title(title)
+    ax.set_xlabel(xlabel, fontsize=12)
+    ax.set_ylabel('Average arrival and departure delay', fontsize=12)
+
+def _draw_std_delays(figure, labels, mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay):
+    """Draw the errorbar plots of arrival and departure delays per age category."""
+    x = np.arange(len(labels))
+    for position, delay, mean, std in ((121, 'arrival', mean_ArrDelay, std_ArrDelay), (122, 'departure', mean_DepDelay, std_DepDelay)):
+        ax = figure.add_subplot(position)
+        ax.errorbar(x, mean, yerr=std)
+        ax.set_xticks(x)
+        ax.set_xticklabels(labels)
+        ax.set_xlabel('Age categories', fontsize=12)
+        ax.set_ylabel(f'Average {delay} delay', fontsize=12)
+        ax.set_title(f'Average {delay} delays and standard deviation per category')
+
+def charts_one_year(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay):
+    """Give the charts of analyse_spark.view_results_one_year."""
+    delays = tuple(np.asarray(values, dtype=float) for values in (mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay))
+    return [
+        Chart('avg_delay.png', _draw_mean_delays,
+              (AGE_LABELS, 'Average arrival and departure delay per age category', 'Age categories') + delays[:2], (10, 5)),
+        Chart('avg_std_delay_categ.png', _draw_std_delays, (AGE_LABELS,) + delays, (15, 5)),
+    ]
+
+def charts_delay_over_avg_one_year(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay):
+    """Give the chart of analyse_spark.view_delay_over_avg_one_year."""
+    delays = tuple(np.asarray(values, dtype=float) for values in (mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay))
+    labels = ('Planes =< Average age', 'Planes > Average age')
+    return [Chart('avg_delay_over_avg.png', _draw_mean_delays, (labels, 'Average arrival and departure delay', 'Categories') + delays, (10, 5))]
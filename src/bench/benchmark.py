@@ -0,0 +1,316 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the read, ingest and analyse stages on a synthetic dataset, see generate_data.
+
+Spark runs locally and Cassandra is replaced by the in-process session of fake_cassandra, so that
+the benchmark runs on a laptop. Every stage reports its throughput, the peak resident memory of
+the process while it runs and the percentiles of the latency of its units: batches for the
+readers, runs for Spark and statements for Cassandra.
+
+Usage, with src, src/spark and src/cassandra in PYTHONPATH :
+    python benchmark.py [--directory DIR] [--flights 200000] [--json results.json] [--baseline results.json]
+"""
+
+import os
+import sys
+import json
+import time
+import datetime
+import argparse
+import tempfile
+import threading
+import itertools
+
+import numpy as np
+
+import metrics
+import flight_data
+from generate_data import generate_dataset
+import fake_cassandra
+
+STAGES = (
+    "read_csvs",
+    "read_csvs_batches",
+    "get_RDD_from_flight_data",
+    "run_analyses",
+    "insert_datastream",
+    "bulk_insert_datastream",
+    "bulk_insert_datastream_batches",
+    "get_flights_of_hours",
+    "get_hour_flights_between_dates",
+    "time_cube_between_dates",
+)
+
+# Number of flights of a unit of latency of read_csvs
+LATENCY_ROWS = 10000
+
+class PeakRSS:
+    """Sample the resident memory of the process in a thread to give its peak during a stage."""
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @staticmethod
+    def current():
+        """Resident memory of the process in bytes."""
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except OSError:
+            import resource
+            # Peak of the whole process where /proc is not available, in kB on Linux and bytes on macOS
+            rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            return rss if sys.platform == "darwin" else rss * 1024
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.peak = max(self.peak, self.current())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak = self.current()
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, self.current())
+
+def measure(stage, run):
+    """Run a stage and give its measures.
+
+    Parameters
+    ----------
+    stage : string
+            Name of the stage.
+
+    run : function
+          Run the stage and give the number of rows processed and the latencies of its units in seconds.
+    """
+    with PeakRSS() as rss:
+        cpu = time.process_time()
+        start = time.perf_counter()
+        rows, latencies = run()
+        seconds = time.perf_counter() - start
+        cpu = time.process_time() - cpu
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99]) * 1000 if len(latencies) else (np.nan,) * 3
+    return {
+        "stage": stage,
+        "rows": rows,
+        "seconds": seconds,
+        "cpu_seconds": cpu,
+        "rows_per_s": rows / seconds if seconds else np.nan,
+        "peak_rss_mb": rss.peak / 2**20,
+        "latency_p50_ms": float(p50),
+        "latency_p90_ms": float(p90),
+        "latency_p99_ms": float(p99),
+    }
+
+def _timed(iterable, size):
+    """Iterate over iterable and give the duration of every chunk of size items in latencies."""
+    latencies = []
+    def items():
+        start = time.perf_counter()
+        for i, item in enumerate(iterable, 1):
+            yield item
+            if i % size == 0:
+                now = time.perf_counter()
+                latencies.append(now - start)
+                start = now
+    return items(), latencies
+
+#
+# Stages
+#
+class Bench:
+    """Dataset and state shared by the stages: the Spark context and the stand-in session."""
+    def __init__(self, fnames, plane_data, insert_rows=100000, spark_runs=3, latency=0.0, insert_batch_size=20):
+        self.fnames = fnames
+        self.Plane = flight_data.get_plane_registry(plane_data)
+        self.insert_rows = insert_rows
+        self.spark_runs = spark_runs
+        self.latency = latency
+        self.insert_batch_size = insert_batch_size
+        self.session = fake_cassandra.Session(latency=latency)
+        self._sc = None
+        self._dates = None
+
+    def sc(self):
+        if self._sc is None:
+            import pyspark
+            self._sc = pyspark.SparkContext(conf=pyspark.SparkConf().setMaster("local[*]").setAppName("flights-bench"))
+        return self._sc
+
+    def read_csvs(self):
+        flights, latencies = _timed(flight_data.read_csvs(self.fnames, Plane=self.Plane, use_cache=False), LATENCY_ROWS)
+        return sum(1 for flight in flights), latencies
+
+    def read_csvs_batches(self):
+        latencies = []
+        rows = 0
+        start = time.perf_counter()
+        for batch in flight_data.read_csvs_batches(self.fnames, Plane=self.Plane, use_cache=False):
+            rows += len(batch)
+            now = time.perf_counter()
+            latencies.append(now - start)
+            start = now
+        return rows, latencies
+
+    def get_RDD_from_flight_data(self):
+        from get_rdd import get_RDD_from_flight_data
+        latencies = []
+        for run in range(self.spark_runs):
+            start = time.perf_counter()
+            sc, D = get_RDD_from_flight_data(self.fnames, sc=self.sc(), Plane=self.Plane)
+            rows = D.count()
+            latencies.append(time.perf_counter() - start)
+        return rows * self.spark_runs, latencies
+
+    def run_analyses(self):
+        import analyse_spark
+        latencies = []
+        sc, D = analyse_spark.get_RDD_from_flight_data(self.fnames, sc=self.sc(), Plane=self.Plane, batches=True)
+        D = analyse_spark.compact_RDD(D)
+        rows = sum(D.map(len).collect())
+        for run in range(self.spark_runs):
+            start = time.perf_counter()
+            analyse_spark.run_analyses(D)
+            latencies.append(time.perf_counter() - start)
+        D.unpersist()
+        return rows * self.spark_runs, latencies
+
+    def _flights(self, limit=None):
+        return flight_data.read_csvs(self.fnames, limit, Plane=self.Plane, use_cache=False)
+
+    def insert_datastream(self):
+        import feed_cassandra
+        session = fake_cassandra.Session(latency=self.latency)
+        flights = list(self._flights(self.insert_rows))
+        feed_cassandra.InsertFlight(day_cache=None, session=session).insert_datastream(flights)
+        return len(flights), session.latencies
+
+    def bulk_insert_datastream(self):
+        import feed_cassandra
+        flights = list(self._flights())
+        self._dates = sorted({(f.year, f.month, f.day_month) for f in flights if f.year != 'NA'})
+        start = len(self.session.latencies)
+        stats = feed_cassandra.InsertFlight(day_cache=None, session=self.session).bulk_insert_datastream(flights, report_every=None)
+        return stats["rows"], self.session.latencies[start:]
+
+    def bulk_insert_datastream_batches(self):
+        """bulk_insert_datastream with rows of the same partition grouped in unlogged batches of insert_batch_size rows."""
+        import feed_cassandra
+        session = fake_cassandra.Session(latency=self.latency)
+        flights = list(self._flights())
+        stats = feed_cassandra.InsertFlight(day_cache=None, session=session).bulk_insert_datastream(
+            flights, batch_size=self.insert_batch_size, report_every=None
+        )
+        return stats["rows"], session.latencies
+
+    def _range(self):
+        """First and last days of the flights inserted by bulk_insert_datastream."""
+        if self._dates is None:
+            self.bulk_insert_datastream()
+        first, last = self._dates[0], self._dates[-1]
+        return datetime.datetime(*first), datetime.datetime(*last) + datetime.timedelta(days=1)
+
+    def get_flights_of_hours(self):
+        import analyse_cassandra
+        dt1, dt2 = self._range()
+        hours = (dt1 + datetime.timedelta(hours=hour) for hour in range(int((dt2 - dt1).total_seconds()) // 3600))
+        start = len(self.session.latencies)
+        rows = sum(1 for flight in analyse_cassandra.GetFlight(session=self.session).get_flights_of_hours(hours))
+        return rows, self.session.latencies[start:]
+
+    def get_hour_flights_between_dates(self):
+        import analyse_cassandra
+        dt1, dt2 = self._range()
+        getter = analyse_cassandra.GetFlight(session=self.session)
+        start = len(self.session.latencies)
+        rows = sum(1 for hour in range(24) for flight in getter.get_hour_flights_between_dates(dt1, dt2, hour))
+        return rows, self.session.latencies[start:]
+
+    def time_cube_between_dates(self):
+        import analyse_cassandra
+        dt1, dt2 = self._range()
+        start = len(self.session.latencies)
+        cube = analyse_cassandra.time_cube_between_dates(dt1, dt2, getter=analyse_cassandra.GetFlight(session=self.session))
+        return int(cube.count.sum()), self.session.latencies[start:]
+
+    def run(self, stages=STAGES):
+        """Run stages in order and give their measures, a stage which fails is reported and skipped."""
+        results = []
+        for stage in stages:
+            try:
+                results.append(measure(stage, getattr(self, stage)))
+            except ImportError as exception:
+                print(f"Exception : {stage} skipped, {exception}")
+        return results
+
+#
+# Reports
+#
+def print_results(results):
+    columns = ("rows", "seconds", "rows_per_s", "peak_rss_mb", "latency_p50_ms", "latency_p90_ms", "latency_p99_ms")
+    print(f"{'stage':32}" + "".join(f"{column:>16}" for column in columns))
+    for result in results:
+        print(f"{result['stage']:32}" + "".join(f"{result[column]:>16.6g}" for column in columns))
+
+def regressions(results, baseline, tolerance=0.25):
+    """Give the stages whose throughput dropped by more than tolerance compared to a baseline.
+
+    Parameters
+    ----------
+    results, baseline : list
+                        Measures given by Bench.run, baseline was written by a previous run.
+
+    tolerance : float
+                Accepted relative drop of rows per second.
+    """
+    before = {result["stage"]: result["rows_per_s"] for result in baseline}
+    return [
+        (result["stage"], before[result["stage"]], result["rows_per_s"])
+        for result in results
+        if result["stage"] in before and result["rows_per_s"] < (1 - tolerance) * before[result["stage"]]
+    ]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the read, ingest and analyse stages on a synthetic dataset.")
+    parser.add_argument("--directory", help="directory of the dataset, generated if it does not contain it, a temporary one if not given")
+    parser.add_argument("--years", type=int, nargs="+", default=[2007])
+    parser.add_argument("--flights", type=int, default=200000, help="number of flights per year")
+    parser.add_argument("--planes", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--stages", nargs="+", default=list(STAGES), choices=STAGES)
+    parser.add_argument("--insert-rows", type=int, default=100000, help="number of flights inserted by insert_datastream")
+    parser.add_argument("--insert-batch-size", type=int, default=20, help="rows of a batch of bulk_insert_datastream_batches")
+    parser.add_argument("--spark-runs", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.0, help="round trip in seconds of the stand-in Cassandra session")
+    parser.add_argument("--json", help="write the measures in this file")
+    parser.add_argument("--baseline", help="measures of a previous run, stages slower by more than --tolerance fail the benchmark")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--metrics", help="enable the instrumentation and export its metrics in this file, see metrics")
+    parser.add_argument("--metrics-format", default="json", choices=("json", "prometheus"))
+    args = parser.parse_args()
+    if args.metrics:
+        metrics.enable(args.metrics, args.metrics_format)
+
+    directory = args.directory or tempfile.mkdtemp(prefix="flights-bench-")
+    fnames = [os.path.join(directory, f"{year}.csv") for year in args.years]
+    plane_data = os.path.join(directory, "plane-data.csv")
+    if not all(os.path.exists(fname) for fname in itertools.chain(fnames, [plane_data])):
+        fnames, plane_data = generate_dataset(directory, args.years, args.flights, args.planes, args.seed)
+
+    results = Bench(fnames, plane_data, args.insert_rows, args.spark_runs, args.latency, args.insert_batch_size).run(args.stages)
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=1)
+    if args.baseline:
+        with open(args.baseline) as f:
+            slower = regressions(results, json.load(f), args.tolerance)
+        for stage, before, after in slower:
+            print(f"Exception : {stage} regressed from {before:.6g} to {after:.6g} rows/s")
+        sys.exit(1 if slower else 0)
@@ -0,0 +1,284 @@
+# -*- coding: utf-8 -*-
+"""In-process stand-in of a Cassandra session, to run InsertFlight and GetFlight without a cluster.
+
+Tables are read from cassandra_table.cql. Only the statements of feed_cassandra and analyse_cassandra
+are understood: INSERT of literal or bound values, UPDATE of counters and SELECT with equalities on
+the partition key, alone or grouped in a BatchStatement (see Session.unlogged_batch).
+"""
+
+import os
+import re
+import time
+import threading
+import itertools
+import collections
+import concurrent.futures
+
+TABLES_CQL = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "cassandra", "cassandra_table.cql")
+
+Table = collections.namedtuple("Table", ["columns", "partition_key", "clustering", "counters"])
+
+def read_tables(filename=TABLES_CQL):
+    """Give the tables created by a CQL file.
+
+    Return
+    ------
+    tables : dict
+             Links the name of every table to its Table.
+    """
+    with open(filename) as f:
+        cql = re.sub(r"--[^\n]*", "", f.read())
+    tables = {}
+    for name, body in re.findall(r"CREATE TABLE\s+(\w+)\s*\((.*?)\)\s*;", cql, re.S | re.I):
+        key = re.search(r"primary key\s*\(\s*\((.*?)\)\s*(?:,(.*))?\)\s*$", body.strip(), re.S | re.I)
+        definitions = [line.strip().rstrip(",").split() for line in body[:key.start()].strip().split("\n") if line.strip()]
+        tables[name] = Table(
+            columns=tuple(column for column, kind in definitions),
+            partition_key=tuple(column.strip() for column in key.group(1).split(",")),
+            clustering=tuple(column.strip() for column in (key.group(2) or "").split(",") if column.strip()),
+            counters=tuple(column for column, kind in definitions if kind.lower() == "counter"),
+        )
+    return tables
+
+# Placeholder of a bound value in a parsed statement
+_BIND = object()
+
+def _literal(token):
+    token = token.strip()
+    if token == "?":
+        return _BIND
+    if token.startswith("'"):
+        return token[1:-1].replace("''", "'")
+    if token.lower() == "null":
+        return None
+    if token.lower() in ("true", "false"):
+        return token.lower() == "true"
+    return float(token) if "." in token else int(token)
+
+def _values(text):
+    """Split a list of CQL literals or placeholders."""
+    return [_literal(token) for token in re.findall(r"'(?:[^']|'')*'|[^,\s]+", text)]
+
+def _equalities(where):
+    """Give the columns and values of "column=value AND ..." conditions."""
+    columns, values = [], []
+    for condition in re.split(r"\s+AND\s+", where.strip(), flags=re.I):
+        column, value = condition.split("=")
+        columns.append(column.strip())
+        values.append(_literal(value))
+    return columns, values
+
+def parse(query):
+    """Parse a statement into (kind, table, columns, values, other columns).
+
+    values holds the literals and placeholders of the statement: the inserted values, the
+    counter increments followed by the WHERE values, or the WHERE values of a SELECT.
+    """
+    query = " ".join(query.split()).rstrip("; ")
+    match = re.match(r"INSERT INTO (\w+) ?\((.*?)\) ?VALUES ?\((.*)\)$", query, re.I)
+    if match:
+        columns = [column.strip() for column in match.group(2).split(",")]
+        return "insert", match.group(1), columns, _values(match.group(3)), ()
+    match = re.match(r"UPDATE (\w+) SET (.*) WHERE (.*)$", query, re.I)
+    if match:
+        counters = []
+        increments = []
+        for assignment in match.group(2).split(","):
+            counter, value = re.match(r"\s*(\w+)\s*=\s*\w+\s*\+\s*(\S+)\s*$", assignment).groups()
+            counters.append(counter)
+            increments.append(_literal(value))
+        columns, values = _equalities(match.group(3))
+        return "update", match.group(1), columns, increments + values, tuple(counters)
+    match = re.match(r"SELECT (.*?) FROM (\w+)(?: WHERE (.*))?$", query, re.I)
+    if match:
+        columns, values = _equalities(match.group(3)) if match.group(3) else ([], [])
+        selected = tuple(column.strip() for column in match.group(1).split(","))
+        return "select", match.group(2), columns, values, selected
+    raise ValueError(f"Statement not supported by the stand-in: {query}")
+
+class PreparedStatement:
+    _ids = itertools.count()
+
+    def __init__(self, query):
+        self.query_string = query
+        self.query_id = next(self._ids)
+        self.parsed = parse(query)
+
+    def bind(self, values):
+        return BoundStatement(self, tuple(values))
+
+class BoundStatement:
+    def __init__(self, prepared_statement, values):
+        self.prepared_statement = prepared_statement
+        self.values = values
+
+class BatchStatement:
+    """Statements executed in one round trip, as cassandra.query.BatchStatement."""
+    def __init__(self):
+        self.statements = []
+
+    def add(self, statement, parameters=None):
+        self.statements.append((statement, parameters))
+
+class ResponseFuture:
+    """Result of execute_async.
+
+    result gives every row. The callbacks receive pages of fetch_size rows, the next page is given
+    only when start_fetching_next_page is called, as with the paging of the driver.
+    """
+    def __init__(self, future, fetch_size=None, executor=None):
+        self._future = future
+        self._fetch_size = fetch_size
+        self._executor = executor
+        # Rows not given to the callback yet and the callback
+        self._rows = None
+        self._callback = None
+        self.has_more_pages = False
+        # Number of pages given to the callback
+        self.pages_fetched = 0
+
+    def result(self):
+        return self._future.result()
+
+    def add_callbacks(self, callback, errback, callback_args=(), callback_kwargs=None, errback_args=(), errback_kwargs=None):
+        def done(future):
+            exception = future.exception()
+            if exception is not None:
+                errback(exception, *errback_args, **(errback_kwargs or {}))
+                return
+            self._rows = future.result()
+            self._callback = lambda rows: callback(rows, *callback_args, **(callback_kwargs or {}))
+            self._next_page()
+        self._future.add_done_callback(done)
+
+    def _next_page(self):
+        size = len(self._rows) if self._fetch_size is None else self._fetch_size
+        page, self._rows = self._rows[:size], self._rows[size:]
+        self.has_more_pages = bool(self._rows)
+        self.pages_fetched += 1
+        self._callback(page)
+
+    def start_fetching_next_page(self):
+        if not self.has_more_pages:
+            raise RuntimeError("No more pages")
+        if self._executor is not None:
+            self._executor.submit(self._next_page)
+        else:
+            self._next_page()
+
+class Session:
+    """In-memory Cassandra session, rows of a partition are kept by clustering key as in Cassandra."""
+    def __init__(self, tables=None, latency=0.0, workers=8, fetch_size=None):
+        """
+        Parameters
+        ----------
+        tables : dict
+                 Tables of the keyspace, read from cassandra_table.cql if not given.
+
+        latency : float
+                  Round trip in seconds added to every statement, executed by worker threads when it is not 0.
+
+        workers : integer
+                  Number of worker threads which execute asynchronous statements when latency is not 0.
+
+        fetch_size : integer
+                     Number of rows of a page given to the callbacks of execute_async, every row in one page if not given.
+        """
+        self.tables = read_tables() if tables is None else tables
+        # table -> partition key values -> clustering key values -> column -> value
+        self.data = {name: {} for name in self.tables}
+        self.latency = latency
+        self.fetch_size = fetch_size
+        # Futures of execute_async
+        self.futures = []
+        # Duration in seconds of every statement executed
+        self.latencies = []
+        self._lock = threading.Lock()
+        self._rows = {}
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers) if latency else None
+
+    def prepare(self, query):
+        return PreparedStatement(query)
+
+    def unlogged_batch(self, statements):
+        """Group statements in a batch, used by feed_cassandra.InsertFlight instead of the batches of the driver."""
+        batch = BatchStatement()
+        for statement in statements:
+            batch.add(statement)
+        return batch
+
+    def execute(self, statement, parameters=None):
+        start = time.perf_counter()
+        if self.latency:
+            time.sleep(self.latency)
+        try:
+            return self._execute(statement, parameters)
+        finally:
+            duration = time.perf_counter() - start
+            with self._lock:
+                self.latencies.append(duration)
+
+    def execute_async(self, statement, parameters=None):
+        if self._executor is not None:
+            future = self._executor.submit(self.execute, statement, parameters)
+        else:
+            future = concurrent.futures.Future()
+            try:
+                future.set_result(self.execute(statement, parameters))
+            except Exception as exception:
+                future.set_exception(exception)
+        response = ResponseFuture(future, self.fetch_size, self._executor)
+        if self.fetch_size is not None:
+            with self._lock:
+                self.futures.append(response)
+        return response
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown()
+
+    def _execute(self, statement, parameters):
+        if isinstance(statement, BatchStatement):
+            for member, member_parameters in statement.statements:
+                self._execute(member, member_parameters)
+            return []
+        if isinstance(statement, BoundStatement):
+            statement, parameters = statement.prepared_statement, statement.values
+        if isinstance(statement, PreparedStatement):
+            kind, table, columns, values, other = statement.parsed
+        elif isinstance(statement, str):
+            kind, table, columns, values, other = parse(statement)
+        else:
+            raise NotImplementedError(f"{type(statement).__name__} is not supported by the stand-in")
+        if parameters is not None:
+            parameters = iter(parameters)
+            values = [next(parameters) if value is _BIND else value for value in values]
+        schema = self.tables[table]
+        if kind == "insert":
+            row = dict(zip(columns, values))
+            with self._lock:
+                partition = self.data[table].setdefault(tuple(row[column] for column in schema.partition_key), {})
+                partition.setdefault(tuple(row[column] for column in schema.clustering), {}).update(row)
+            return []
+        if kind == "update":
+            increments, key = values[:len(other)], dict(zip(columns, values[len(other):]))
+            with self._lock:
+                partition = self.data[table].setdefault(tuple(key[column] for column in schema.partition_key), {})
+                row = partition.setdefault(tuple(key[column] for column in schema.clustering), dict(key))
+                for counter, increment in zip(other, increments):
+                    row[counter] = row.get(counter, 0) + increment
+            return []
+        key = dict(zip(columns, values))
+        if set(schema.partition_key) - set(key):
+            raise ValueError(f"The partition key of {table} is needed")
+        Row = self._rows.get(other)
+        if Row is None:
+            Row = self._rows[other] = collections.namedtuple("Row", other)
+        with self._lock:
+            partition = self.data[table].get(tuple(key[column] for column in schema.partition_key), {})
+            rows = [partition[clustering] for clustering in sorted(partition)]
+        return [
+            Row(*(row.get(column) for column in other))
+            for row in rows
+            if all(row.get(column) == value for column, value in key.items())
+        ]
@@ -0,0 +1,197 @@
+# -*- coding: utf-8 -*-
+"""Generate synthetic flights files in the format of the dataexpo 2009 data and the matching plane data file.
+
+Usage : python generate_data.py DIRECTORY [--years 2006 2007] [--flights 1000000] [--planes 5000] [--seed 0]
+"""
+
+import os
+import argparse
+import datetime
+
+import numpy as np
+import pandas as pd
+
+# Columns of the dataexpo flights files, in order
+FLIGHT_COLUMNS = (
+    "Year", "Month", "DayofMonth", "DayOfWeek", "DepTime", "CRSDepTime", "ArrTime", "CRSArrTime",
+    "UniqueCarrier", "FlightNum", "TailNum", "ActualElapsedTime", "CRSElapsedTime", "AirTime",
+    "ArrDelay", "DepDelay", "Origin", "Dest", "Distance", "TaxiIn", "TaxiOut", "Cancelled",
+    "CancellationCode", "Diverted", "CarrierDelay", "WeatherDelay", "NASDelay", "SecurityDelay",
+    "LateAircraftDelay",
+)
+
+# Columns of the plane data file, in order
+PLANE_COLUMNS = ("tailnum", "type", "manufacturer", "issue_date", "model", "status", "aircraft_type", "engine_type", "year")
+
+CARRIERS = ("WN", "AA", "MQ", "UA", "OO", "DL", "XE", "CO", "US", "EV", "NW", "FL", "YV", "B6", "OH", "9E", "AS", "F9", "HA", "AQ")
+AIRPORTS = ("ATL", "ORD", "DFW", "DEN", "LAX", "PHX", "IAH", "LAS", "DTW", "EWR", "MSP", "SLC", "SFO", "MCO", "JFK", "CLT", "BOS", "SEA", "LGA", "PHL")
+MANUFACTURERS = ("BOEING", "AIRBUS", "EMBRAER", "BOMBARDIER INC", "MCDONNELL DOUGLAS")
+
+# Rates observed in the 2007 file
+RATES = {
+    "cancelled": 0.022,
+    "diverted": 0.002,
+    # Tail numbers which are not in the plane data file, or "0"
+    "unknown_tailnum": 0.03,
+    # Planes without delivery year: empty rows and "None"
+    "plane_without_row": 0.05,
+    "plane_year_none": 0.08,
+}
+
+def _hhmm(minutes):
+    """Convert minutes since midnight into the hhmm integers of the files."""
+    minutes = np.mod(minutes, 24 * 60)
+    return minutes // 60 * 100 + minutes % 60
+
+def generate_plane_data(filename, nb_planes=5000, seed=0, rates=RATES):
+    """Write a plane data file and give the tail numbers it contains.
+
+    Parameters
+    ----------
+    filename : string
+               Path of the file to write.
+
+    nb_planes : integer
+                Number of planes.
+
+    seed : integer
+           Seed of the random generator, the same seed gives the same file.
+
+    rates : dict
+            Proportions of planes without row and without year, see RATES.
+    """
+    rng = np.random.default_rng(seed)
+    tailnums = np.array([f"N{i:05d}" for i in range(nb_planes)])
+    years = rng.integers(1960, 2008, nb_planes)
+    without_row = rng.random(nb_planes) < rates["plane_without_row"]
+    year_none = ~without_row & (rng.random(nb_planes) < rates["plane_year_none"])
+    with open(filename, "w") as f:
+        f.write(",".join(PLANE_COLUMNS) + "\n")
+        for i, tailnum in enumerate(tailnums):
+            if without_row[i]:
+                f.write(f"{tailnum}\n")
+                continue
+            year = "None" if year_none[i] else str(years[i])
+            manufacturer = MANUFACTURERS[i % len(MANUFACTURERS)]
+            f.write(f"{tailnum},Corporation,{manufacturer},01/01/{years[i]},{100 + i % 900},Valid,Fixed Wing Multi-Engine,Turbo-Fan,{year}\n")
+    return tailnums
+
+def _with_na(values, kept):
+    """Integer column written "NA" where kept is False."""
+    return pd.arrays.IntegerArray(np.asarray(values, dtype=np.int64), ~kept)
+
+def _flights_of_month(rng, year, month, nb_flights, tailnums, rates):
+    """Build a DataFrame of the flights of a month, sorted by day."""
+    nb_days = (datetime.date(year + month // 12, month % 12 + 1, 1) - datetime.date(year, month, 1)).days
+    day = np.sort(rng.integers(1, nb_days + 1, nb_flights))
+    day_week = np.array([datetime.date(year, month, d).isoweekday() for d in range(1, nb_days + 1)])[day - 1]
+    # Departures between 5:00 and 23:59, more in the morning and at the end of the afternoon
+    crs_dep = np.clip(np.where(rng.random(nb_flights) < 0.5, rng.normal(8.5 * 60, 90, nb_flights), rng.normal(17 * 60, 120, nb_flights)), 5 * 60, 24 * 60 - 1).astype(np.int64)
+    crs_elapsed = rng.integers(45, 360, nb_flights)
+    # Delays are skewed: most flights leave a few minutes early or on time, some leave hours late
+    dep_delay = np.round(np.where(rng.random(nb_flights) < 0.6, rng.normal(-3, 4, nb_flights), rng.exponential(35, nb_flights))).astype(np.int64)
+    arr_delay = dep_delay + np.round(rng.normal(-2, 12, nb_flights)).astype(np.int64)
+    taxi_in = rng.integers(2, 20, nb_flights)
+    taxi_out = rng.integers(5, 40, nb_flights)
+    elapsed = crs_elapsed + arr_delay - dep_delay
+    cancelled = rng.random(nb_flights) < rates["cancelled"]
+    diverted = ~cancelled & (rng.random(nb_flights) < rates["diverted"])
+    flown = ~cancelled & ~diverted
+
+    tailnum = tailnums[rng.integers(0, len(tailnums), nb_flights)].astype(object)
+    unknown = rng.random(nb_flights) < rates["unknown_tailnum"]
+    tailnum[unknown] = np.where(rng.random(unknown.sum()) < 0.5, "0", "N9" + pd.Series(rng.integers(0, 10**4, unknown.sum())).astype(str).str.zfill(4))
+    origin = rng.integers(0, len(AIRPORTS), nb_flights)
+    dest = (origin + rng.integers(1, len(AIRPORTS), nb_flights)) % len(AIRPORTS)
+    late = flown & (arr_delay >= 15)
+
+    return pd.DataFrame({
+        "Year": year,
+        "Month": month,
+        "DayofMonth": day,
+        "DayOfWeek": day_week,
+        "DepTime": _with_na(_hhmm(crs_dep + dep_delay), ~cancelled),
+        "CRSDepTime": _hhmm(crs_dep),
+        "ArrTime": _with_na(_hhmm(crs_dep + dep_delay + elapsed), flown),
+        "CRSArrTime": _hhmm(crs_dep + crs_elapsed),
+        "UniqueCarrier": np.array(CARRIERS)[rng.integers(0, len(CARRIERS), nb_flights)],
+        "FlightNum": rng.integers(1, 7000, nb_flights),
+        "TailNum": tailnum,
+        "ActualElapsedTime": _with_na(elapsed, flown),
+        "CRSElapsedTime": crs_elapsed,
+        "AirTime": _with_na(elapsed - taxi_in - taxi_out, flown),
+        "ArrDelay": _with_na(arr_delay, flown),
+        "DepDelay": _with_na(dep_delay, ~cancelled),
+        "Origin": np.array(AIRPORTS)[origin],
+        "Dest": np.array(AIRPORTS)[dest],
+        "Distance": crs_elapsed * 7,
+        "TaxiIn": _with_na(taxi_in, flown),
+        "TaxiOut": _with_na(taxi_out, ~cancelled),
+        "Cancelled": cancelled.astype(np.int64),
+        "CancellationCode": np.where(cancelled, np.array(["A", "B", "C", "D"])[rng.integers(0, 4, nb_flights)], ""),
+        "Diverted": diverted.astype(np.int64),
+        "CarrierDelay": _with_na(arr_delay // 3, late),
+        "WeatherDelay": _with_na(np.zeros(nb_flights, dtype=np.int64), late),
+        "NASDelay": _with_na(arr_delay - arr_delay // 3, late),
+        "SecurityDelay": _with_na(np.zeros(nb_flights, dtype=np.int64), late),
+        "LateAircraftDelay": _with_na(np.zeros(nb_flights, dtype=np.int64), late),
+    }, columns=FLIGHT_COLUMNS)
+
+def generate_flights(filename, year, nb_flights, tailnums, seed=0, rates=RATES):
+    """Write a flights file of one year, written month by month so that the memory used stays small.
+
+    Parameters
+    ----------
+    filename : string
+               Path of the file to write.
+
+    year : integer
+           Year of the flights.
+
+    nb_flights : integer
+                 Number of flights of the year.
+
+    tailnums : array-like
+               Tail numbers of the planes, as given by generate_plane_data.
+
+    seed : integer
+           Seed of the random generator, the same seed gives the same file.
+
+    rates : dict
+            Proportions of cancelled and diverted flights and of unknown tail numbers, see RATES.
+    """
+    rng = np.random.default_rng([seed, year])
+    per_month = np.bincount(rng.integers(0, 12, nb_flights), minlength=12)
+    with open(filename, "w") as f:
+        f.write(",".join(FLIGHT_COLUMNS) + "\n")
+        for month in range(1, 13):
+            _flights_of_month(rng, year, month, per_month[month - 1], tailnums, rates).to_csv(f, header=False, index=False, na_rep="NA")
+    return filename
+
+def generate_dataset(directory, years=(2007,), flights_per_year=1000000, nb_planes=5000, seed=0, rates=RATES):
+    """Write the plane data file and one flights file per year in a directory.
+
+    Return
+    ------
+    fnames : list
+             Paths of the flights files.
+
+    plane_data : string
+                 Path of the plane data file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    plane_data = os.path.join(directory, "plane-data.csv")
+    tailnums = generate_plane_data(plane_data, nb_planes, seed, rates)
+    fnames = [generate_flights(os.path.join(directory, f"{year}.csv"), year, flights_per_year, tailnums, seed, rates) for year in years]
+    return fnames, plane_data
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate synthetic flights files and the matching plane data file.")
+    parser.add_argument("directory")
+    parser.add_argument("--years", type=int, nargs="+", default=[2007])
+    parser.add_argument("--flights", type=int, default=1000000, help="number of flights per year")
+    parser.add_argument("--planes", type=int, default=5000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    fnames, plane_data = generate_dataset(args.directory, args.years, args.flights, args.planes, args.seed)
+    print("\n".join(fnames + [plane_data]))
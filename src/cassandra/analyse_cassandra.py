@@ -1,23 +1,110 @@
 # -*- coding: utf-8 -*-
 
+import time
+import queue
 import datetime
 import textwrap
-import functools
-import collections
 
 import numpy as np
-import matplotlib.pyplot as plt
 
+import metrics
 import feed_cassandra as feed
+from flight_data import Flight
+from accumulators import Moments, Quantiles
+from day_cache import PARTIAL_SHAPE
+from report import Chart, render
+
+SELECT_FLIGHTS_ONE_DAY_HOUR = textwrap.dedent(
+    """
+    SELECT
+        start_year,
+        start_month,
+        start_day_month,
+        start_day_week,
+        start_hour,
+        cancelled,
+        arr_delay,
+        dep_delay,
+        tailnum,
+        plane_age
+    FROM
+        flight_by_time
+    WHERE
+            start_year=?
+        AND
+            start_month=?
+        AND
+            start_day_month=?
+        AND
+            start_day_week=?
+        AND
+            start_hour=?
+    ;
+    """
+)
+
+SELECT_ROLLUP_ONE_MONTH = textwrap.dedent(
+    f"""
+    SELECT
+        start_year,
+        start_month,
+        start_day_month,
+        start_hour,
+        {", ".join(feed.ROLLUP_COUNTERS)}
+    FROM
+        delay_rollup_by_hour
+    WHERE
+            start_year=?
+        AND
+            start_month=?
+    ;
+    """
+)
+
+def _partition_key(dt):
+    """Give the values of the partition key of flight_by_time for the hour of a datetime."""
+    return (dt.year, dt.month, dt.day, dt.weekday()+1, dt.hour)
+
+def _row_to_flight(r):
+    return Flight(
+        r.start_year,
+        r.start_month,
+        r.start_day_month,
+        r.start_day_week,
+        r.start_hour,
+        r.arr_delay,
+        r.dep_delay,
+        r.cancelled,
+        r.tailnum,
+        r.plane_age
+    )
 
 class GetFlight(feed.ConnectionDB):
     """To access DB which stores flights data and retrieve flights."""
-    def __init__(self):
-        feed.ConnectionDB.__init__(self)
+    def __init__(self, concurrency=64, session=None):
+        """
+        Parameters
+        ----------
+        concurrency : integer
+                      Maximum number of partitions queried at once by the range getters.
+
+        session : Session
+                  Session used instead of a connection to the cluster, see feed_cassandra.ConnectionDB.
+        """
+        feed.ConnectionDB.__init__(self, session)
+        self.concurrency = concurrency
+        self._select = None
+        self._select_rollup = None
 
     def __del__( self ):
         feed.ConnectionDB.__del__(self)
 
+    def _prepare(self):
+        """Prepare the select query once."""
+        if self._select is None:
+            self._select = self._session.prepare(SELECT_FLIGHTS_ONE_DAY_HOUR)
+        return self._select
+
     def get_flight_one_day_hour(self, dt):
         """
         Get the flights of a given hour and day.
@@ -27,49 +114,78 @@ class GetFlight(feed.ConnectionDB):
         dt : object datetime
              Date of the flights to retrieve.
         """
-        query = textwrap.dedent(
-            f"""
-            SELECT
-                start_year,
-                start_month,
-                start_day_month,
-                start_day_week,
-                start_hour,
-                cancelled,
-                arr_delay,
-                dep_delay,
-                tailnum,
-                plane_age
-            FROM
-                flight_by_time
-            WHERE
-                    start_year={dt.year}
-                AND
-                    start_month={dt.month}
-                AND
-                    start_day_month={dt.day}
-                AND
-                    start_day_week={dt.weekday()+1}
-                AND
-                    start_hour={dt.hour}
-            ;
-            """
-        )
-        for r in self._session.execute(query):
-            yield feed.Flight(
-                r.start_year,
-                r.start_month,
-                r.start_day_month,
-                r.start_day_week,
-                r.start_hour,
-                r.arr_delay,
-                r.dep_delay,
-                r.cancelled,
-                r.tailnum,
-                r.plane_age
-            )
-
-    def get_hour_flights_between_dates(self, dt1, dt2, hour, includeCancelledFlights=False):
+        for r in self._execute(self._prepare(), _partition_key(dt), "flight_by_time"):
+            yield _row_to_flight(r)
+
+    def _execute(self, statement, params, table):
+        """Execute a query, its latency and its number of rows are measured when the metrics are enabled."""
+        if not metrics.ENABLED:
+            return self._session.execute(statement, params)
+        start = time.perf_counter()
+        rows = list(self._session.execute(statement, params))
+        metrics.observe("cassandra_query_seconds", time.perf_counter() - start, table=table)
+        metrics.count("rows_fetched", len(rows), table=table)
+        return rows
+
+    def get_flights_of_hours(self, dates, concurrency=None):
+        """
+        Get the flights of several hours and days, the partitions are queried concurrently.
+
+        Flights are given as the queries complete, not in the order of the dates. At most concurrency
+        partitions are queried or waiting to be consumed at once. The next page of a partition is
+        requested only once its current page is taken by the consumer, so a slow consumer holds
+        back the queries: at most one page per partition is fetched and not consumed yet.
+
+        Parameters
+        ----------
+        dates : iterable
+                Datetimes of the hours of the flights to retrieve.
+
+        concurrency : integer
+                      Maximum number of partitions queried at once, the concurrency of the getter if not given.
+        """
+        if concurrency is None:
+            concurrency = self.concurrency
+        select = self._prepare()
+        pages = queue.Queue()
+        dates = iter(dates)
+        in_flight = 0
+
+        def query(dt):
+            # Time of the request of the page, only when the metrics are enabled
+            sent = [time.perf_counter()] if metrics.ENABLED else None
+            future = self._session.execute_async(select, _partition_key(dt))
+            def next_page():
+                if sent is not None:
+                    sent[0] = time.perf_counter()
+                future.start_fetching_next_page()
+            def on_page(rows):
+                if sent is not None:
+                    metrics.observe("cassandra_query_seconds", time.perf_counter() - sent[0], table="flight_by_time")
+                    metrics.count("rows_fetched", len(rows), table="flight_by_time")
+                # The next page is requested by the consumer, see below
+                pages.put((rows, None, next_page if future.has_more_pages else None))
+            future.add_callbacks(on_page, lambda exception: pages.put((None, exception, None)))
+
+        while True:
+            for dt in dates:
+                query(dt)
+                in_flight += 1
+                if in_flight >= concurrency:
+                    break
+            if not in_flight:
+                return
+            rows, exception, next_page = pages.get()
+            if exception is not None:
+                raise exception
+            if next_page is None:
+                in_flight -= 1
+            else:
+                next_page()
+            for r in rows:
+                yield _row_to_flight(r)
+
+    def get_hour_flights_between_dates(self, dt1, dt2, hour, includeCancelledFlights=False, concurrency=None):
         """
         Get flights of a given hour between two dates.
 
@@ -86,16 +202,17 @@ class GetFlight(feed.ConnectionDB):
 
         includeCancelledFlights : boolean
                                   Include cancelled flights or not.
+
+        concurrency : integer
+                      Maximum number of partitions queried at once, the concurrency of the getter if not given.
         """
         duration = dt2-dt1
-        for day in range(duration.days):
-            date = dt1 + datetime.timedelta(days=day)
-            date = date.replace(hour=hour)
-            for flight in self.get_flight_one_day_hour(date):
-                if (flight.cancelled and includeCancelledFlights) or (not flight.cancelled):
-                    yield flight
-
-    def get_day_flights_between_dates(self, dt1, dt2, week_day, includeCancelledFlights=False):
+        dates = ((dt1 + datetime.timedelta(days=day)).replace(hour=hour) for day in range(duration.days))
+        for flight in self.get_flights_of_hours(dates, concurrency):
+            if (flight.cancelled and includeCancelledFlights) or (not flight.cancelled):
+                yield flight
+
+    def get_day_flights_between_dates(self, dt1, dt2, week_day, includeCancelledFlights=False, concurrency=None):
         """
         Get flights of a given day of week between two dates.
 
@@ -112,20 +229,20 @@ class GetFlight(feed.ConnectionDB):
 
         includeCancelledFlights : boolean
                                   Include cancelled flights or not.
+
+        concurrency : integer
+                      Maximum number of partitions queried at once, the concurrency of the getter if not given.
         """
         duration = dt2-dt1
         if duration.days < 7:
             raise NotEnoughTime
-        for day in range(duration.days):
-            date = dt1 + datetime.timedelta(days=day)
-            if date.weekday() == week_day:
-                for hour in range(24):
-                    date = date.replace(hour=hour)
-                    for flight in self.get_flight_one_day_hour(date):
-                        if (flight.cancelled and includeCancelledFlights) or (not flight.cancelled):
-                            yield flight
-
-    def get_season_flights_between_dates(self, dt1, dt2, season, includeCancelledFlights=False):
+        days = (dt1 + datetime.timedelta(days=day) for day in range(duration.days))
+        dates = (date.replace(hour=hour) for date in days if date.weekday() == week_day for hour in range(24))
+        for flight in self.get_flights_of_hours(dates, concurrency):
+            if (flight.cancelled and includeCancelledFlights) or (not flight.cancelled):
+                yield flight
+
+    def get_season_flights_between_dates(self, dt1, dt2, season, includeCancelledFlights=False, concurrency=None):
         """
         Get flights of a given day of week between two dates.
 
@@ -142,16 +259,42 @@ class GetFlight(feed.ConnectionDB):
 
         includeCancelledFlights : boolean
                                   Include cancelled flights or not.
+
+        concurrency : integer
+                      Maximum number of partitions queried at once, the concurrency of the getter if not given.
         """
         duration = dt2-dt1
-        for day in range(duration.days):
-            date = dt1 + datetime.timedelta(days=day)
-            if get_season(date) == season:
-                for hour in range(24):
-                    date = date.replace(hour=hour)
-                    for flight in self.get_flight_one_day_hour(date):
-                        if (flight.cancelled and includeCancelledFlights) or (not flight.cancelled):
-                            yield flight
+        days = (dt1 + datetime.timedelta(days=day) for day in range(duration.days))
+        dates = (date.replace(hour=hour) for date in days if get_season(date) == season for hour in range(24))
+        for flight in self.get_flights_of_hours(dates, concurrency):
+            if (flight.cancelled and includeCancelledFlights) or (not flight.cancelled):
+                yield flight
+
+    def get_rollups_between_dates(self, dt1, dt2):
+        """
+        Get the rows of delay_rollup_by_hour between two dates.
+
+        Parameters
+        ----------
+        dt1 : object datetime
+              1rst date of the interval.
+
+        dt2 : object datetime
+              2nd date of the interval.
+        """
+        if self._select_rollup is None:
+            self._select_rollup = self._session.prepare(SELECT_ROLLUP_ONE_MONTH)
+        first, last = dt1.date(), (dt1 + datetime.timedelta(days=(dt2-dt1).days)).date()
+        month = datetime.date(first.year, first.month, 1)
+        while month < last:
+            for r in self._execute(self._select_rollup, (month.year, month.month), "delay_rollup_by_hour"):
+                if first <= datetime.date(r.start_year, r.start_month, r.start_day_month) < last:
+                    yield r
+            month = datetime.date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+# Quantiles of the delays given by default, and accuracy of their sketches (see accumulators.KLL)
+QUANTILES = (0.5, 0.9, 0.99)
+SKETCH_K = 200
 
 class NotEnoughTime(Exception):
     pass
@@ -159,148 +302,506 @@ class NotEnoughTime(Exception):
 #
 # Shared methods
 #
+class DelayStats:
+    """Mergeable statistics of a stream of flights: number of flights, number of cancelled flights
+    and count, mean and M2 of arrival and departure delays of the flights not cancelled."""
+    def __init__(self, k=None):
+        """
+        Parameters
+        ----------
+        k : integer
+            Accuracy of the quantile sketches of the delays (see accumulators.KLL), no sketch if None.
+        """
+        self.nb_flights = 0
+        self.nb_cancelled = 0
+        self.delays = Moments(2)
+        self.sketches = None if k is None else Quantiles(2, k)
+
+    def add_flights(self, stream, chunk_size=65536):
+        """Add a stream of flights, pulled by chunks of chunk_size flights into preallocated buffers."""
+        cancelled = np.empty(chunk_size, dtype=np.bool_)
+        delays = np.zeros((chunk_size, 2))
+        i = 0
+        for f in stream:
+            cancelled[i] = f.cancelled
+            if not f.cancelled:
+                delays[i] = (f.ArrDelay, f.DepDelay)
+            i += 1
+            if i == chunk_size:
+                self._add(cancelled, delays)
+                i = 0
+        if i:
+            self._add(cancelled[:i], delays[:i])
+        return self
+
+    def _add(self, cancelled, delays):
+        nb_cancelled = int(cancelled.sum())
+        self.nb_flights += len(cancelled)
+        self.nb_cancelled += nb_cancelled
+        if nb_cancelled:
+            delays = delays[~cancelled]
+        keys = np.zeros(len(delays), dtype=np.int64)
+        self.delays.add(keys, delays)
+        if self.sketches is not None:
+            self.sketches.add(keys, delays)
+
+    def merge(self, other):
+        """Merge the statistics of another stream into these ones and return these ones."""
+        self.nb_flights += other.nb_flights
+        self.nb_cancelled += other.nb_cancelled
+        self.delays.merge(other.delays)
+        if self.sketches is not None and other.sketches is not None:
+            self.sketches.merge(other.sketches)
+        return self
+
+    def quantiles(self, q=QUANTILES):
+        """Give approximate quantiles of arrival and departure delays, an array (len(q), 2), NaN if no flight is not cancelled."""
+        for key, quantiles in self.sketches.quantiles(q):
+            return quantiles
+        return np.full((len(q), 2), np.nan)
+
+    def mean_std(self):
+        """Give mean and standard deviation of arrival and departure delays, zeros if no flight is not cancelled."""
+        for key, (count, mean, M2) in self.delays.items():
+            std = np.sqrt(M2 / count)
+            return (mean[0], mean[1], std[0], std[1])
+        return 0, 0, 0, 0
+
+    def cancelled_proportion(self):
+        """Give the proportion (in percentage) of cancelled flights."""
+        # Percentage of cancelled flights, remove outliers
+        if self.nb_flights in (0, 1):
+            return 0
+        return self.nb_cancelled/self.nb_flights*100
+
 def _comp_mean_std_delay(stream):
     """Compute mean and standard deviation of arrival and departure delays a stream of flights."""
-    prepared_data =  map(lambda f: np.array([1, f.ArrDelay, f.ArrDelay**2, f.DepDelay, f.DepDelay**2]), stream)
-    results = functools.reduce(lambda x, y: x+y, prepared_data, 0)
-    if isinstance(results, int) and results == 0:
-        return 0, 0, 0, 0
-    else:
-        sum_1, sum_ArrDelay, sum_ArrDelay2, sum_DepDelay, sum_DepDelay2 = results
-        mean_ArrDelay = sum_ArrDelay/sum_1
-        mean_DepDelay = sum_DepDelay/sum_1
-        std_ArrDelay = np.sqrt(sum_ArrDelay2/sum_1 - (mean_ArrDelay)**2)
-        std_DepDelay = np.sqrt(sum_DepDelay2/sum_1 - (mean_DepDelay)**2)
-        return (mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay)
+    return DelayStats().add_flights(stream).mean_std()
 
 def _comp_cancelled_proportion(stream):
     """Compute proportion (in percentage) of number of cancelled flights over number of flights of a stream."""
-    prepared_data =  map(lambda f: np.array([1, 1 if f.cancelled else 0]), stream)
-    results = functools.reduce(lambda x, y: x+y, prepared_data, 0)
-    if isinstance(results, int) and results == 0:
-        return 0
-    else:
-        sum_1, sum_nb_cancelled = results
+    return DelayStats().add_flights(stream).cancelled_proportion()
+
+#
+# Statistics per month, day of week, season and hour with one scan
+#
+class TimeCube:
+    """Count of flights, count of cancelled flights and moments of the delays of the flights not cancelled,
+    per month, day of week, season and hour.
+
+    Days out of every season (see get_season) are in the season of index 4.
+
+    Quantile sketches of the delays are kept per value of every axis, not per cell, so that
+    their memory stays bounded. They need the flights: partial aggregates of days (add_days)
+    have no sketch.
+    """
+    AXES = ("month", "day", "season", "hour")
+    SHAPE = (12, 7, 5, 24)
+
+    def __init__(self, k=None):
+        """
+        Parameters
+        ----------
+        k : integer
+            Accuracy of the quantile sketches of the delays (see accumulators.KLL), no sketch if None.
+        """
+        self.count = np.zeros(self.SHAPE)
+        self.cancelled = np.zeros(self.SHAPE)
+        # Flat cell index -> moments of arrival and departure delays
+        self.delays = Moments(2)
+        # (axis index, value) -> sketches of arrival and departure delays
+        self.sketches = None if k is None else Quantiles(2, k)
+
+    def add_flights(self, flights, buffer_size=65536):
+        """Add a stream of flights, cancelled ones included, by chunks of buffer_size flights."""
+        cells = np.empty(buffer_size, dtype=np.int64)
+        cancelled = np.empty(buffer_size, dtype=np.bool_)
+        delays = np.zeros((buffer_size, 2))
+        seasons = {}
+        i = 0
+        for f in flights:
+            day = (f.year, f.month, f.day_month)
+            season = seasons.get(day)
+            if season is None:
+                season = seasons[day] = get_season(datetime.datetime(*day))
+                if season is None:
+                    season = seasons[day] = 4
+            cells[i] = (((f.month - 1) * 7 + f.day_week - 1) * 5 + season) * 24 + f.hour
+            cancelled[i] = f.cancelled
+            if not f.cancelled:
+                delays[i] = (f.ArrDelay, f.DepDelay)
+            i += 1
+            if i == buffer_size:
+                self._add(cells, cancelled, delays)
+                i = 0
+        if i:
+            self._add(cells[:i], cancelled[:i], delays[:i])
+        return self
+
+    def add_rollups(self, rows):
+        """Add rows of delay_rollup_by_hour."""
+        return self.add_days(day_partials_of_rollups(rows))
+
+    def add_days(self, partials):
+        """Add partial aggregates of days.
+
+        Parameters
+        ----------
+        partials : dict
+                   Links dates to arrays of shape day_cache.PARTIAL_SHAPE, see day_partials_of_flights.
+        """
+        for day, partial in partials.items():
+            cells = _first_cell(day) + np.arange(24)
+            self.count.flat[cells] += partial[:, 0]
+            self.cancelled.flat[cells] += partial[:, 1]
+            self.delays.add_moments(cells.tolist(), partial[:, 2], partial[:, 3:5], partial[:, 5:7])
+        return self
+
+    def _add(self, cells, cancelled, delays):
+        size = self.count.size
+        self.count += np.bincount(cells, minlength=size).reshape(self.SHAPE)
+        self.cancelled += np.bincount(cells[cancelled], minlength=size).reshape(self.SHAPE)
+        kept = ~cancelled
+        self.delays.add(cells[kept], delays[kept])
+        if self.sketches is not None:
+            values = np.unravel_index(cells[kept], self.SHAPE)
+            keys = np.column_stack((np.repeat(np.arange(len(self.AXES)), len(values[0])), np.concatenate(values)))
+            self.sketches.add(keys, np.tile(delays[kept], (len(self.AXES), 1)))
+
+    def merge(self, other):
+        """Merge another cube into this one and return this one."""
+        self.count += other.count
+        self.cancelled += other.cancelled
+        self.delays.merge(other.delays)
+        if self.sketches is not None and other.sketches is not None:
+            self.sketches.merge(other.sketches)
+        return self
+
+    def quantiles(self, axis, q=QUANTILES):
+        """Give approximate quantiles of arrival and departure delays per value of an axis.
+
+        Parameters
+        ----------
+        axis : string
+               One of AXES.
+
+        q : array-like
+            Quantiles between 0 and 1.
+
+        Return
+        ------
+        quantiles_ArrDelay, quantiles_DepDelay : arrays (nb_values, len(q))
+                                                 NaN for the values without flight not cancelled.
+        """
+        a = self.AXES.index(axis)
+        # The season of index 4 is not a season
+        size = 4 if axis == "season" else self.SHAPE[a]
+        quantiles_ArrDelay, quantiles_DepDelay = (np.full((size, len(q)), np.nan) for _ in range(2))
+        for (key_axis, value), quantiles in self.sketches.quantiles(q):
+            if key_axis == a and value < size:
+                quantiles_ArrDelay[value], quantiles_DepDelay[value] = quantiles.T
+        return quantiles_ArrDelay, quantiles_DepDelay
+
+    def slice(self, axis):
+        """Give mean and standard deviation of arrival and departure delays and percentage of cancelled flights per value of an axis.
+
+        Parameters
+        ----------
+        axis : string
+               One of AXES.
+
+        Return
+        ------
+        mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled : arrays
+        """
+        a = self.AXES.index(axis)
+        # The season of index 4 is not a season
+        size = 4 if axis == "season" else self.SHAPE[a]
+        others = tuple(i for i in range(len(self.SHAPE)) if i != a)
+        count = self.count.sum(axis=others)[:size]
+        cancelled = self.cancelled.sum(axis=others)[:size]
         # Percentage of cancelled flights, remove outliers
-        return sum_nb_cancelled/sum_1*100 if sum_1 != 1 else 0
+        prop_cancelled = np.where((count != 0) & (count != 1), cancelled / np.where(count == 0, 1, count) * 100, 0)
+
+        mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay = (np.zeros(size) for _ in range(4))
+        by_value = self.delays.regroup(lambda cell: np.unravel_index(cell, self.SHAPE)[a])
+        for value, (n, mean, M2) in by_value.items():
+            if value < size:
+                mean_ArrDelay[value], mean_DepDelay[value] = mean
+                std_ArrDelay[value], std_DepDelay[value] = np.sqrt(M2 / n)
+        return mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled
+
+def _first_cell(day):
+    """Give the flat index in a TimeCube of hour 0 of a date, the 24 hours of the day follow."""
+    season = get_season(datetime.datetime(day.year, day.month, day.day))
+    season = 4 if season is None else season
+    return (((day.month - 1) * 7 + day.weekday()) * 5 + season) * 24
+
+def day_partials_of_flights(flights, buffer_size=65536):
+    """Compute the partial aggregate of every day of a stream of flights, cancelled ones included.
+
+    Return
+    ------
+    partials : dict
+               Links dates to arrays of shape day_cache.PARTIAL_SHAPE, one row per hour.
+    """
+    # date -> index, the key of a flight is index*24 + hour
+    index = {}
+    counts = []
+    delays = Moments(2)
+    keys = np.empty(buffer_size, dtype=np.int64)
+    cancelled = np.empty(buffer_size, dtype=np.bool_)
+    values = np.zeros((buffer_size, 2))
+
+    def add(keys, cancelled, values):
+        size = len(index) * 24
+        nb = np.bincount(keys, minlength=size)
+        nb_cancelled = np.bincount(keys[cancelled], minlength=size)
+        counts.append((nb, nb_cancelled))
+        kept = ~cancelled
+        delays.add(keys[kept], values[kept])
+
+    i = 0
+    for f in flights:
+        day = datetime.date(f.year, f.month, f.day_month)
+        d = index.get(day)
+        if d is None:
+            d = index[day] = len(index)
+        keys[i] = d * 24 + f.hour
+        cancelled[i] = f.cancelled
+        if not f.cancelled:
+            values[i] = (f.ArrDelay, f.DepDelay)
+        i += 1
+        if i == buffer_size:
+            add(keys, cancelled, values)
+            i = 0
+    if i:
+        add(keys[:i], cancelled[:i], values[:i])
+
+    partials = np.zeros((len(index),) + PARTIAL_SHAPE)
+    flat = partials.reshape(-1, PARTIAL_SHAPE[1])
+    for nb, nb_cancelled in counts:
+        flat[:len(nb), 0] += nb
+        flat[:len(nb_cancelled), 1] += nb_cancelled
+    for key, (n, mean, M2) in delays.items():
+        flat[key, 2] = n
+        flat[key, 3:5] = mean
+        flat[key, 5:7] = M2
+    return {day: partials[d] for day, d in index.items()}
+
+def day_partials_of_rollups(rows):
+    """Compute the partial aggregate of every day of rows of delay_rollup_by_hour, see day_partials_of_flights."""
+    partials = {}
+    for r in rows:
+        day = datetime.date(r.start_year, r.start_month, r.start_day_month)
+        partial = partials.get(day)
+        if partial is None:
+            partial = partials[day] = np.zeros(PARTIAL_SHAPE)
+        partial[r.start_hour, :3] += [getattr(r, counter) or 0 for counter in feed.ROLLUP_COUNTERS[:3]]
+        sums = np.array([getattr(r, counter) or 0 for counter in feed.ROLLUP_COUNTERS[3:]], dtype=np.float64)
+        # sums are sum_arr_delay, sum2_arr_delay, sum_dep_delay, sum2_dep_delay
+        n = partial[r.start_hour, 2]
+        if n:
+            mean = sums[[0, 2]] / n
+            partial[r.start_hour, 3:5] = mean
+            partial[r.start_hour, 5:7] = np.maximum(sums[[1, 3]] - sums[[0, 2]] * mean, 0)
+    return partials
+
+@metrics.timed("time_cube_between_dates")
+def time_cube_between_dates(dt1, dt2, getter=None, rollup=False, cache=None, k=None):
+    """Read every flight between two dates once and fill a TimeCube.
+
+    Parameters
+    ----------
+    dt1, dt2 : object datetime
+               Dates to select data.
+
+    getter : GetFlight
+             Connection used to read the flights, a new one if not given.
+
+    rollup : boolean
+             Read the counts and sums per hour of delay_rollup_by_hour instead of the flights.
+
+    cache : day_cache.DayCache
+            Cache of the partial aggregates of days, only the days missing from the cache are read.
+
+    k : integer
+        Accuracy of the quantile sketches of the cube, see TimeCube. The sketches need the flights,
+        rollup and cache are not used when k is given.
+    """
+    if getter is None:
+        getter = GetFlight()
+    if k is not None:
+        days = (dt1 + datetime.timedelta(days=day) for day in range((dt2-dt1).days))
+        dates = (date.replace(hour=hour) for date in days for hour in range(24))
+        return TimeCube(k).add_flights(getter.get_flights_of_hours(dates))
+    days = [(dt1 + datetime.timedelta(days=day)).date() for day in range((dt2-dt1).days)]
+    source = "rollup" if rollup else "flights"
+    partials = cache.get_many(days, source) if cache is not None else {}
+    missing = [day for day in days if day not in partials]
+    if cache is not None:
+        metrics.count("day_cache_hits", len(days) - len(missing), source=source)
+        metrics.count("day_cache_misses", len(missing), source=source)
+    if missing:
+        if rollup:
+            first = datetime.datetime(missing[0].year, missing[0].month, missing[0].day)
+            rows = getter.get_rollups_between_dates(first, first + datetime.timedelta(days=(missing[-1] - missing[0]).days + 1))
+            read = day_partials_of_rollups(rows)
+        else:
+            dates = (datetime.datetime(day.year, day.month, day.day, hour) for day in missing for hour in range(24))
+            read = day_partials_of_flights(getter.get_flights_of_hours(dates))
+        # Days without flight are cached too
+        read = {day: read.get(day, np.zeros(PARTIAL_SHAPE)) for day in missing}
+        if cache is not None:
+            cache.put_many(read, source)
+        partials.update(read)
+    return TimeCube().add_days(partials)
+
+@metrics.timed("delay_quantiles_between_dates")
+def delay_quantiles_between_dates(dt1, dt2, axis, q=QUANTILES, k=SKETCH_K, cube=None):
+    """Calculate approximate quantiles of the arrival and departure delays per value of an axis, between two given dates.
+
+    Parameters
+    ----------
+    dt1, dt2 : object datetime
+               Dates to select data.
+
+    axis : string
+           One of TimeCube.AXES.
+
+    q : array-like
+        Quantiles between 0 and 1.
+
+    k : integer
+        Accuracy of the sketches, see accumulators.KLL: the rank error is about 1.7/k for at most about 3*k values kept per axis value.
+
+    cube : TimeCube
+           Statistics of the flights between dt1 and dt2 with sketches, read from the DB if not given.
+    """
+    if cube is None:
+        cube = time_cube_between_dates(dt1, dt2, k=k)
+    return cube.quantiles(axis, q)
 
 #
 # Average delays and average count of cancelled flights per hour of day
 #
-def avg_std_per_hour_between_dates(dt1, dt2):
+@metrics.timed("avg_std_per_hour_between_dates")
+def avg_std_per_hour_between_dates(dt1, dt2, cube=None, rollup=False, cache=None):
     """Calculate the average delay per hour at the departure and at the arrival, between two given dates.
 
     Parameters
     ----------
     dt1, dt2 : object datetime
                Dates to select data.
+
+    cube : TimeCube
+           Statistics of the flights between dt1 and dt2, read from the DB if not given.
+
+    rollup : boolean
+             Answer from delay_rollup_by_hour instead of the flights when the cube is read from the DB.
+
+    cache : day_cache.DayCache
+            Cache of the partial aggregates of days used when the cube is read from the DB.
+    """
+    if cube is None:
+        cube = time_cube_between_dates(dt1, dt2, rollup=rollup, cache=cache)
+    return cube.slice("hour")
+
+def _draw_delays_cancelled(figure, x, labels, xlabel, per, mean_ArrDelay, mean_DepDelay, prop_cancelled):
+    """Draw the barplots of the means of arrival and departure delays and of the proportion of cancelled flights.
+
+    labels are the tick labels of x, x itself if None. per ends the titles: "hour", "day of week"...
     """
-    getter = GetFlight()
-    mean_ArrDelay = np.zeros(24)
-    mean_DepDelay = np.zeros(24)
-    std_ArrDelay = np.zeros(24)
-    std_DepDelay = np.zeros(24)
-    prop_cancelled = np.zeros(24)
-    for h in range(24):
-        mean_ArrDelay[h], mean_DepDelay[h], std_ArrDelay[h], std_DepDelay[h] = _comp_mean_std_delay(getter.get_hour_flights_between_dates(dt1, dt2, h))
-        prop_cancelled[h] = _comp_cancelled_proportion(getter.get_hour_flights_between_dates(dt1, dt2, h, True))
-    del getter
-    return mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled
-
-def view_results_hour(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled):
+    width = 0.35
+    for position, draw in ((121, "delays"), (122, "cancelled")):
+        ax = figure.add_subplot(position)
+        ax.set_xticks(x)
+        if labels is not None:
+            ax.set_xticklabels(labels)
+        ax.set_xlabel(xlabel, fontsize=12)
+        if draw == "delays":
+            ax.bar(x - width/2, mean_ArrDelay, width, label='Arrival')
+            ax.bar(x + width/2, mean_DepDelay, width, label='Departure')
+            ax.set_ylabel('Average delay (minutes)', fontsize=12)
+            ax.set_title(f'Average arrival and departure delays per {per}')
+            ax.legend()
+        else:
+            ax.bar(x, prop_cancelled)
+            ax.set_ylabel('Percentage of cancelled flights', fontsize=12)
+            ax.set_title(f'Percentage of cancelled flights per {per}')
+
+def _draw_std_delays(figure, x, labels, xlabel, per, mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay):
+    """Draw the errorbar plots of arrival and departure delays, see _draw_delays_cancelled."""
+    for position, delay, mean, std in ((121, 'arrival', mean_ArrDelay, std_ArrDelay), (122, 'departure', mean_DepDelay, std_DepDelay)):
+        ax = figure.add_subplot(position)
+        ax.errorbar(x, mean, yerr=std)
+        if labels is not None:
+            ax.set_xticks(x)
+            ax.set_xticklabels(labels)
+        ax.set_xlabel(xlabel, fontsize=12)
+        ax.set_ylabel(f'Average {delay} delay', fontsize=12)
+        ax.set_title(f'Average {delay} delays and standard deviation per {per}')
+
+def _charts(filenames, x, labels, xlabel, per, figsize, mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled):
+    """Give the two charts of the statistics of the flights per hour, day of week or season, see report.render."""
+    mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled = (
+        np.asarray(values, dtype=float) for values in (mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled)
+    )
+    return [
+        Chart(filenames[0], _draw_delays_cancelled, (x, labels, xlabel, per, mean_ArrDelay, mean_DepDelay, prop_cancelled), figsize),
+        Chart(filenames[1], _draw_std_delays, (x, labels, xlabel, per, mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay), (15, 5)),
+    ]
+
+def charts_hour(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled):
+    """Give the charts of view_results_hour."""
+    return _charts(('avg_delay_cancelled.png', 'avg_std_delay_hour.png'), np.arange(24), None, 'Hours', 'hour', (15, 5),
+                   mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled)
+
+@metrics.timed("view_results_hour")
+def view_results_hour(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled, directory="."):
     """Save barplots and errorbar plots to display means and standard deviations of arrival
        and departure delays and proportion of cancelled flights for every hour of a day."""
-    hours = np.arange(24)
-    width = 0.35
-    plt.figure(figsize=(15,5))
-    plt.subplot(121)
-    plt.xticks(hours)
-    plt.bar(hours - width/2, mean_ArrDelay, width, label='Arrival')
-    plt.bar(hours + width/2, mean_DepDelay, width, label='Departure')
-    plt.xlabel('Hours', fontsize=12)
-    plt.ylabel('Average delay (minutes)', fontsize=12)
-    plt.title('Average arrival and departure delays per hour')
-    plt.legend()
-    plt.subplot(122)
-    plt.bar(hours, prop_cancelled)
-    plt.title('Percentage of cancelled flights per hour')
-    plt.xlabel('Hours', fontsize=12)
-    plt.ylabel('Percentage of cancelled flights', fontsize=12)
-    plt.savefig('avg_delay_cancelled.png')
-
-    plt.clf()
-
-    plt.figure(figsize=(15,5))
-    plt.subplot(121)
-    plt.errorbar(hours, mean_ArrDelay, yerr=std_ArrDelay)
-    plt.xlabel('Hours', fontsize=12)
-    plt.ylabel('Average arrival delay', fontsize=12)
-    plt.title('Average arrival delays and standard deviation per hour')
-    plt.subplot(122)
-    plt.errorbar(hours, mean_DepDelay, yerr=std_DepDelay)
-    plt.xlabel('Hours', fontsize=12)
-    plt.ylabel('Average departure delay', fontsize=12)
-    plt.title('Average departure delays and standard deviation per hour')
-    plt.savefig('avg_std_delay_hour.png')
+    return render(charts_hour(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled), directory)
 
 #
 # Average delays and average count of cancelled flights per day of week
 #
-def avg_std_per_day_between_dates(dt1, dt2):
-    """Calculate the average delay per day of week at the departure and at the arrival, between two given dates."""
-    getter = GetFlight()
-    mean_ArrDelay = np.zeros(7)
-    mean_DepDelay = np.zeros(7)
-    prop_cancelled = np.zeros(7)
-    std_ArrDelay = np.zeros(7)
-    std_DepDelay = np.zeros(7)
-    try:
-        for d in range(7):
-            mean_ArrDelay[d], mean_DepDelay[d], std_ArrDelay[d], std_DepDelay[d] = _comp_mean_std_delay(getter.get_day_flights_between_dates(dt1, dt2, d))
-            prop_cancelled[d] = _comp_cancelled_proportion(getter.get_day_flights_between_dates(dt1, dt2, d, True))
-    except NotEnoughTime:
-        print("Exception : 7 days or more are needed between dt1 and dt2")
-    del getter
-    return mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled
+@metrics.timed("avg_std_per_day_between_dates")
+def avg_std_per_day_between_dates(dt1, dt2, cube=None, rollup=False, cache=None):
+    """Calculate the average delay per day of week at the departure and at the arrival, between two given dates.
 
-def view_results_day(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled):
+    Parameters
+    ----------
+    dt1, dt2 : object datetime
+               Dates to select data.
+
+    cube : TimeCube
+           Statistics of the flights between dt1 and dt2, read from the DB if not given.
+
+    rollup : boolean
+             Answer from delay_rollup_by_hour instead of the flights when the cube is read from the DB.
+
+    cache : day_cache.DayCache
+            Cache of the partial aggregates of days used when the cube is read from the DB.
+    """
+    if (dt2-dt1).days < 7:
+        print("Exception : 7 days or more are needed between dt1 and dt2")
+        return tuple(np.zeros(7) for _ in range(5))
+    if cube is None:
+        cube = time_cube_between_dates(dt1, dt2, rollup=rollup, cache=cache)
+    return cube.slice("day")
+
+def charts_day(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled):
+    """Give the charts of view_results_day."""
+    days = ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday')
+    return _charts(('avg_delay_cancelled_day_week.png', 'avg_std_delay_day.png'), np.arange(1,8), days, 'Days', 'day of week', (18, 5),
+                   mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled)
+
+@metrics.timed("view_results_day")
+def view_results_day(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled, directory="."):
     """Save barplots and errorbar plots to display means and standard deviations of arrival
        and departure delays and proportion of cancelled flights for every day of a week."""
-    days = np.arange(1,8)
-    width = 0.35
-    plt.figure(figsize=(18,5))
-    plt.subplot(121)
-    plt.xticks(days, ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'))
-    plt.bar(days - width/2, mean_ArrDelay, width, label='Arrival')
-    plt.bar(days + width/2, mean_DepDelay, width, label='Departure')
-    plt.xlabel('Days', fontsize=12)
-    plt.ylabel('Average delay (minutes)', fontsize=12)
-    plt.title('Average arrival and departure delays per day of week')
-    plt.legend()
-    plt.subplot(122)
-    plt.xticks(days, ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'))
-    plt.bar(days, prop_cancelled)
-    plt.title('Percentage of cancelled flights per day of week')
-    plt.xlabel('Days', fontsize=12)
-    plt.ylabel('Percentage of cancelled flights', fontsize=12)
-    plt.savefig('avg_delay_cancelled_day_week.png')
-
-    plt.clf()
-
-    plt.figure(figsize=(15,5))
-    plt.subplot(121)
-    plt.errorbar(days, mean_ArrDelay, yerr=std_ArrDelay)
-    plt.xticks(days, ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'))
-    plt.xlabel('Days', fontsize=12)
-    plt.ylabel('Average arrival delay', fontsize=12)
-    plt.title('Average arrival delays and standard deviation per day of week')
-    plt.subplot(122)
-    plt.errorbar(days, mean_DepDelay, yerr=std_DepDelay)
-    plt.xticks(days, ('Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday'))
-    plt.xlabel('Days', fontsize=12)
-    plt.ylabel('Average departure delay', fontsize=12)
-    plt.title('Average departure delays and standard deviation per day of week')
-    plt.savefig('avg_std_delay_day.png')
+    return render(charts_day(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled), directory)
 
 #
 # Average delays and average count of cancelled flights per season
@@ -316,66 +817,47 @@ def get_season(dt):
     if datetime.datetime(dt.year, 9, 22) <= dt <= datetime.datetime(dt.year, 12, 20):
         return 3
 
-def avg_std_per_season_between_dates(dt1, dt2):
-    """Calculate the average delay per season at the departure and at the arrival, between two given dates."""
-    getter = GetFlight()
-    mean_ArrDelay = np.zeros(4)
-    mean_DepDelay = np.zeros(4)
-    prop_cancelled = np.zeros(4)
-    std_ArrDelay = np.zeros(4)
-    std_DepDelay = np.zeros(4)
-    for s in range(4):
-        mean_ArrDelay[s], mean_DepDelay[s], std_ArrDelay[s], std_DepDelay[s] = _comp_mean_std_delay(getter.get_season_flights_between_dates(dt1, dt2, s))
-        prop_cancelled[s] = _comp_cancelled_proportion(getter.get_season_flights_between_dates(dt1, dt2, s, True))
-    del getter
-    return mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled
-
-
-def view_results_season(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled):
+@metrics.timed("avg_std_per_season_between_dates")
+def avg_std_per_season_between_dates(dt1, dt2, cube=None, rollup=False, cache=None):
+    """Calculate the average delay per season at the departure and at the arrival, between two given dates.
+
+    Parameters
+    ----------
+    dt1, dt2 : object datetime
+               Dates to select data.
+
+    cube : TimeCube
+           Statistics of the flights between dt1 and dt2, read from the DB if not given.
+
+    rollup : boolean
+             Answer from delay_rollup_by_hour instead of the flights when the cube is read from the DB.
+
+    cache : day_cache.DayCache
+            Cache of the partial aggregates of days used when the cube is read from the DB.
+    """
+    if cube is None:
+        cube = time_cube_between_dates(dt1, dt2, rollup=rollup, cache=cache)
+    return cube.slice("season")
+
+
+def charts_season(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled):
+    """Give the charts of view_results_season."""
+    seasons = ('Winter', 'Spring', 'Summer', 'Autumn')
+    return _charts(('avg_delay_cancelled_season.png', 'avg_std_delay_season.png'), np.arange(4), seasons, 'Season', 'season', (18, 5),
+                   mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled)
+
+@metrics.timed("view_results_season")
+def view_results_season(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled, directory="."):
     """Save barplots and errorbar plots to display means and standard deviations of arrival
        and departure delays and proportion of cancelled flights for every season of a year."""
-    season = np.arange(4)
-    width = 0.35
-    plt.figure(figsize=(18,5))
-    plt.subplot(121)
-    plt.xticks(season, ('Winter', 'Spring', 'Summer', 'Automumn'))
-    plt.bar(season - width/2, mean_ArrDelay, width, label='Arrival')
-    plt.bar(season + width/2, mean_DepDelay, width, label='Departure')
-    plt.xlabel('Season', fontsize=12)
-    plt.ylabel('Average delay (minutes)', fontsize=12)
-    plt.title('Average arrival and departure delays per season')
-    plt.legend()
-    plt.subplot(122)
-    plt.xticks(season, ('Winter', 'Spring', 'Summer', 'Automumn'))
-    plt.bar(season, prop_cancelled)
-    plt.title('Percentage of cancelled flights per season')
-    plt.xlabel('Season', fontsize=12)
-    plt.ylabel('Percentage of cancelled flights', fontsize=12)
-    plt.savefig('avg_delay_cancelled_season.png')
-
-    plt.clf()
-
-    plt.figure(figsize=(15,5))
-    plt.subplot(121)
-    plt.errorbar(season, mean_ArrDelay, yerr=std_ArrDelay)
-    plt.xticks(season, ('Winter', 'Spring', 'Summer', 'Automumn'))
-    plt.xlabel('Seson', fontsize=12)
-    plt.ylabel('Average arrival delay', fontsize=12)
-    plt.title('Average arrival delays and standard deviation per season')
-    plt.subplot(122)
-    plt.errorbar(season, mean_DepDelay, yerr=std_DepDelay)
-    plt.xticks(season, ('Winter', 'Spring', 'Summer', 'Automumn'))
-    plt.xlabel('Season', fontsize=12)
-    plt.ylabel('Average departure delay', fontsize=12)
-    plt.title('Average departure delays and standard deviation per season')
-    plt.savefig('avg_std_delay_season.png')
-
-# Calculate means and standard deviations per hour in 2007
-avg_ArrDelay, avg_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled = avg_std_per_hour_between_dates(datetime.datetime(2007,1,1),datetime.datetime(2008,1,1))
-view_results_hour(avg_ArrDelay, avg_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled)
-# Calculate means and standard deviations per day of week in 2007
-avg_ArrDelay, avg_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled = avg_std_per_day_between_dates(datetime.datetime(2007,1,1),datetime.datetime(2008,1,1))
-view_results_day(avg_ArrDelay, avg_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled)
-# Calculate means and standard deviations per season in 2007
-avg_ArrDelay, avg_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled = avg_std_per_season_between_dates(datetime.datetime(2007,1,1),datetime.datetime(2008,1,1))
-view_results_season(avg_ArrDelay, avg_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled)
+    return render(charts_season(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, prop_cancelled), directory)
+
+if __name__ == "__main__":
+    # Read 2007 flights once
+    cube = time_cube_between_dates(datetime.datetime(2007,1,1),datetime.datetime(2008,1,1))
+    # Calculate means and standard deviations per hour, day of week and season in 2007
+    charts = charts_hour(*avg_std_per_hour_between_dates(datetime.datetime(2007,1,1),datetime.datetime(2008,1,1),cube))
+    charts += charts_day(*avg_std_per_day_between_dates(datetime.datetime(2007,1,1),datetime.datetime(2008,1,1),cube))
+    charts += charts_season(*avg_std_per_season_between_dates(datetime.datetime(2007,1,1),datetime.datetime(2008,1,1),cube))
+    # The charts are rendered together by a pool of processes
+    render(charts)
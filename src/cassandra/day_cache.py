@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import sqlite3
+import datetime
+
+import numpy as np
+
+DAY_CACHE = os.path.expanduser("~/.cache/flights_analysis/day_cache.sqlite")
+
+# A partial aggregate of a day has one row per hour with the number of flights, the number
+# of cancelled flights, and the count, means and M2 of arrival and departure delays
+PARTIAL_COLUMNS = ("nb_flights", "nb_cancelled", "nb_delays", "mean_arr_delay", "mean_dep_delay", "M2_arr_delay", "M2_dep_delay")
+PARTIAL_SHAPE = (24, len(PARTIAL_COLUMNS))
+
+class DayCache:
+    """Persistent cache of the partial aggregates of days, stored in a SQLite file.
+
+    The least recently used days are evicted when the partial aggregates take more than max_bytes.
+    """
+    def __init__(self, path=DAY_CACHE, max_bytes=64*2**20, timeout=30.0):
+        """
+        Parameters
+        ----------
+        path : string
+               Path of the SQLite file, created if needed.
+
+        max_bytes : integer
+                    Maximum size of the stored partial aggregates.
+
+        timeout : float
+                  Seconds waited for a lock held by another process on the file.
+        """
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.max_bytes = max_bytes
+        self._db = sqlite3.connect(path, timeout=timeout)
+        self._db.execute(
+            """
+            CREATE TABLE IF NOT EXISTS partials
+            (
+                day TEXT,
+                source TEXT,
+                data BLOB,
+                used REAL,
+                PRIMARY KEY (day, source)
+            )
+            """
+        )
+        self._db.commit()
+
+    def close(self):
+        self._db.close()
+
+    def get_many(self, days, source):
+        """Give the partial aggregates of the days found in the cache.
+
+        Parameters
+        ----------
+        days : iterable
+               Dates of the days.
+
+        source : string
+                 What the partial aggregates were computed from, "flights" or "rollup".
+
+        Return
+        ------
+        partials : dict
+                   Links the days found to their partial aggregate, an array of shape PARTIAL_SHAPE.
+        """
+        days = [day.isoformat() for day in days]
+        partials = {}
+        for i in range(0, len(days), 500):
+            chunk = days[i:i+500]
+            rows = self._db.execute(
+                f"SELECT day, data FROM partials WHERE source=? AND day IN ({','.join('?' * len(chunk))})",
+                [source] + chunk,
+            )
+            for day, data in rows:
+                partials[datetime.date.fromisoformat(day)] = np.frombuffer(data).reshape(PARTIAL_SHAPE)
+        if partials:
+            now = time.time()
+            self._db.executemany(
+                "UPDATE partials SET used=? WHERE day=? AND source=?",
+                [(now, day.isoformat(), source) for day in partials],
+            )
+            self._db.commit()
+        return partials
+
+    def put_many(self, partials, source):
+        """Store partial aggregates of days, see get_many."""
+        now = time.time()
+        self._db.executemany(
+            "INSERT OR REPLACE INTO partials (day, source, data, used) VALUES (?, ?, ?, ?)",
+            [(day.isoformat(), source, np.ascontiguousarray(partial, dtype=np.float64).tobytes(), now) for day, partial in partials.items()],
+        )
+        self._db.commit()
+        self._evict()
+
+    def invalidate(self, days):
+        """Remove the partial aggregates of days, of every source."""
+        self._db.executemany("DELETE FROM partials WHERE day=?", [(day.isoformat(),) for day in days])
+        self._db.commit()
+
+    def _evict(self):
+        """Remove the least recently used days while the cache is too big."""
+        size, = self._db.execute("SELECT COALESCE(SUM(LENGTH(data)), 0) FROM partials").fetchone()
+        if size <= self.max_bytes:
+            return
+        rows = self._db.execute("SELECT day, source, LENGTH(data) FROM partials ORDER BY used")
+        evicted = []
+        for day, source, length in rows:
+            if size <= self.max_bytes:
+                break
+            evicted.append((day, source))
+            size -= length
+        self._db.executemany("DELETE FROM partials WHERE day=? AND source=?", evicted)
+        self._db.commit()
+
+def invalidate_days(days, path=DAY_CACHE):
+    """Remove the partial aggregates of days from the cache, if there is a cache.
+
+    Parameters
+    ----------
+    days : iterable
+           Dates of the days, or (year, month, day) tuples.
+    """
+    if not os.path.exists(path):
+        return
+    days = [day if isinstance(day, datetime.date) else datetime.date(*day) for day in days]
+    cache = DayCache(path)
+    try:
+        cache.invalidate(days)
+    finally:
+        cache.close()
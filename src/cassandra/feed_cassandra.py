@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
 
+import os
+import json
+import time
+import datetime
 import textwrap
+import threading
 import collections
+import concurrent.futures
 
-import numpy as np
-import cassandra.cluster
-
-from flight_data import Flight
+import metrics
+import flight_data
+from flight_data import Manifest, file_splits, get_plane_registry
+from day_cache import DAY_CACHE, invalidate_days
 
 def _insert_query_by_hour(flight):
     """Build the query to insert datas in the DB.
@@ -57,38 +63,838 @@ INSERTS_Q = (
     _insert_query_by_hour,
 )
 
-class ConnectionDB:
+# Insert queries prepared once, values are bound for every flight
+INSERT_FLIGHT_BY_TIME = textwrap.dedent(
+    """
+    INSERT INTO flight_by_time
+    (
+        start_year,
+        start_month,
+        start_day_month,
+        start_day_week,
+        start_hour,
+        cancelled,
+        arr_delay,
+        dep_delay,
+        tailnum,
+        plane_age
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+    """
+)
+
+def _insert_values_by_hour(flight):
+    """Give the values to bind to INSERT_FLIGHT_BY_TIME for a flight."""
+    return (
+        flight.year,
+        flight.month,
+        flight.day_month,
+        flight.day_week,
+        flight.hour,
+        flight.cancelled,
+        flight.ArrDelay if flight.ArrDelay != 'NA' else None,
+        flight.DepDelay if flight.DepDelay != 'NA' else None,
+        flight.tailnum if flight.tailnum != 'NA' else '',
+        flight.plane_age if flight.plane_age != 'NA' else None,
+    )
+
+# Number of values of the partition key at the beginning of the bound values
+PARTITION_KEY_SIZE = 5
+
+PREPARED_INSERTS_Q = (
+    (INSERT_FLIGHT_BY_TIME, _insert_values_by_hour),
+)
+
+# Counters of delay_rollup_by_hour, in the order of Rollup cells
+ROLLUP_COUNTERS = ("nb_flights", "nb_cancelled", "nb_delays", "sum_arr_delay", "sum2_arr_delay", "sum_dep_delay", "sum2_dep_delay")
+
+UPDATE_ROLLUP_BY_HOUR = textwrap.dedent(
+    f"""
+    UPDATE delay_rollup_by_hour
+    SET
+        {", ".join(f"{counter} = {counter} + ?" for counter in ROLLUP_COUNTERS)}
+    WHERE
+            start_year=?
+        AND
+            start_month=?
+        AND
+            start_day_month=?
+        AND
+            start_hour=?
+    ;
+    """
+)
+
+# Counters of delay_rollup_by_hour and the stored flights they are computed from, read per hour
+SELECT_ROLLUP_ONE_HOUR = textwrap.dedent(
+    f"""
+    SELECT
+        {", ".join(ROLLUP_COUNTERS)}
+    FROM
+        delay_rollup_by_hour
+    WHERE
+            start_year=?
+        AND
+            start_month=?
+        AND
+            start_day_month=?
+        AND
+            start_hour=?
+    ;
+    """
+)
+
+SELECT_DELAYS_ONE_DAY_HOUR = textwrap.dedent(
+    """
+    SELECT
+        cancelled,
+        arr_delay,
+        dep_delay
+    FROM
+        flight_by_time
+    WHERE
+            start_year=?
+        AND
+            start_month=?
+        AND
+            start_day_month=?
+        AND
+            start_day_week=?
+        AND
+            start_hour=?
+    ;
+    """
+)
+
+def _hour_partition_key(hour):
+    """Give the partition key of flight_by_time read for a (year, month, day_month, hour) by analyse_cassandra."""
+    year, month, day_month, start_hour = hour
+    return (year, month, day_month, datetime.date(year, month, day_month).isoweekday(), start_hour)
+
+def _stored_key(flight):
+    """Give the primary key of the row of a flight in flight_by_time."""
+    return (flight.year, flight.month, flight.day_month, flight.day_week, flight.hour, flight.tailnum if flight.tailnum != 'NA' else '')
+
+class Rollup:
+    """Counts and sums of the delays of flights per year, month, day and hour, as in delay_rollup_by_hour."""
     def __init__(self):
-        self._cluster = cassandra.cluster.Cluster()
-        self._session = self._cluster.connect("paroisem_final")
+        # (year, month, day_month, hour) -> values of ROLLUP_COUNTERS
+        self.cells = {}
+
+    @classmethod
+    def of_inserted(cls, flights):
+        """Give the rollup of the rows stored by inserting flights in order.
+
+        A flight overwritten by a later flight of the same plane and hour (see _stored_key) is not
+        counted, as in flight_by_time.
+        """
+        rollup = cls()
+        for flight in {_stored_key(flight): flight for flight in flights}.values():
+            rollup.add((flight.year, flight.month, flight.day_month, flight.hour), flight.cancelled, flight.ArrDelay, flight.DepDelay)
+        return rollup
+
+    def add(self, hour, cancelled, ArrDelay, DepDelay):
+        """Add a stored flight of an hour (year, month, day_month, hour)."""
+        cell = self.cells.get(hour)
+        if cell is None:
+            cell = self.cells[hour] = [0] * len(ROLLUP_COUNTERS)
+        cell[0] += 1
+        if cancelled:
+            cell[1] += 1
+        else:
+            cell[2] += 1
+            cell[3] += ArrDelay
+            cell[4] += ArrDelay**2
+            cell[5] += DepDelay
+            cell[6] += DepDelay**2
+
+    def updates(self, current):
+        """Give the values to bind to UPDATE_ROLLUP_BY_HOUR to bring counters to these cells.
+
+        current links hours to the values of their counters, the increments are the differences.
+        Cells whose counters are already right are skipped.
+        """
+        for hour, cell in self.cells.items():
+            increments = [value - old for value, old in zip(cell, current.get(hour, (0,) * len(ROLLUP_COUNTERS)))]
+            if any(increments):
+                yield tuple(increments) + hour
+
+def is_valid(flight):
+    """Tell if a flight can be inserted in the DB."""
+    # ArrDelay and DepDelay and TailNum can be 'NA' when cancelled is true
+    return (flight.year != 'NA'
+        and flight.month != 'NA'
+        and flight.day_month != 'NA'
+        and flight.day_week != 'NA'
+        and flight.hour != 'NA'
+        and ((flight.cancelled == False and flight.ArrDelay != 'NA' and flight.DepDelay != 'NA') or flight.cancelled == True))
+
+def valid_mask(batch):
+    """Give the boolean array of the flights of a FlightBatch which can be inserted in the DB, as is_valid."""
+    mask = batch.valid("cancelled")
+    for name in ("year", "month", "day_month", "day_week", "hour"):
+        mask &= batch.valid(name)
+    # ArrDelay and DepDelay can be missing when cancelled is true
+    mask &= batch.cancelled | (batch.valid("ArrDelay") & batch.valid("DepDelay"))
+    return mask
+
+class AsyncWindow:
+    """Execute statements asynchronously with a bounded number of statements in flight.
+
+    Failed statements are executed again up to max_retries times, counter updates must use
+    max_retries=0: an update which timed out may have been applied. Throughput and failures are
+    printed every report_every seconds if report_every is not None.
+    """
+    def __init__(self, session, concurrency=128, max_retries=3, report_every=None):
+        self._session = session
+        self._concurrency = concurrency
+        self._slots = threading.Semaphore(concurrency)
+        self._lock = threading.Lock()
+        self._retries = collections.deque()
+        self._max_retries = max_retries
+        self._report_every = report_every
+        self._start = self._last_report = time.monotonic()
+        self._last_rows = 0
+        self.rows = 0
+        self.retried = 0
+        self.failed = 0
+        self.errors = []
+
+    def submit(self, statement, params=None, nb_rows=1):
+        """Execute a statement which inserts nb_rows rows, wait first if the window is full."""
+        while self._retries:
+            self._submit(*self._retries.popleft())
+        self._submit(statement, params, nb_rows, 0)
+        if self._report_every is not None and time.monotonic() - self._last_report >= self._report_every:
+            self.report()
+
+    def _submit(self, statement, params, nb_rows, attempt):
+        self._slots.acquire()
+        # Time of the request, only when the metrics are enabled
+        sent = time.perf_counter() if metrics.ENABLED else None
+        future = self._session.execute_async(statement, params)
+        future.add_callbacks(
+            self._on_success, self._on_error,
+            callback_args=(nb_rows, sent), errback_args=(statement, params, nb_rows, attempt, sent),
+        )
+
+    def _on_success(self, result, nb_rows, sent):
+        if sent is not None:
+            metrics.observe("cassandra_write_seconds", time.perf_counter() - sent)
+        with self._lock:
+            self.rows += nb_rows
+        self._slots.release()
+
+    def _on_error(self, exception, statement, params, nb_rows, attempt, sent):
+        if sent is not None:
+            metrics.observe("cassandra_write_seconds", time.perf_counter() - sent)
+            metrics.count("cassandra_write_errors", error=type(exception).__name__)
+        with self._lock:
+            if attempt < self._max_retries:
+                self.retried += nb_rows
+                self._retries.append((statement, params, nb_rows, attempt + 1))
+            else:
+                self.failed += nb_rows
+                self.errors.append(exception)
+        self._slots.release()
+
+    def join(self):
+        """Wait until every statement, retries included, is done."""
+        while True:
+            for _ in range(self._concurrency):
+                self._slots.acquire()
+            for _ in range(self._concurrency):
+                self._slots.release()
+            if not self._retries:
+                break
+            while self._retries:
+                self._submit(*self._retries.popleft())
+        if self._report_every is not None:
+            self.report()
+
+    def stats(self):
+        """Give the number of inserted, retried and failed rows and the average throughput."""
+        duration = time.monotonic() - self._start
+        return {
+            "rows": self.rows,
+            "retried": self.retried,
+            "failed": self.failed,
+            "seconds": duration,
+            "rows_per_second": self.rows / duration if duration > 0 else 0,
+        }
+
+    def report(self):
+        now = time.monotonic()
+        rate = (self.rows - self._last_rows) / (now - self._last_report) if now > self._last_report else 0
+        print(f"{self.rows} rows inserted ({rate:.0f} rows/s), {self.retried} retried, {self.failed} failed")
+        self._last_report = now
+        self._last_rows = self.rows
+
+class ConnectionDB:
+    def __init__(self, session=None):
+        """
+        Parameters
+        ----------
+        session : Session
+                  Session used instead of a connection to the cluster, bench.fake_cassandra.Session for instance.
+        """
+        self._cluster = None
+        if session is None:
+            # The driver is only needed to connect to the cluster
+            import cassandra.cluster
+            self._cluster = cassandra.cluster.Cluster()
+            session = self._cluster.connect("paroisem_final")
+        self._session = session
 
     def __del__(self):
-        self._cluster.shutdown()
+        if getattr(self, "_cluster", None) is not None:
+            self._cluster.shutdown()
 
 class InsertFlight(ConnectionDB):
     """To insert data into the DB which stores flights"""
-    def __init__(self):
-        ConnectionDB.__init__(self)
+    def __init__(self, day_cache=DAY_CACHE, session=None):
+        """
+        Parameters
+        ----------
+        day_cache : string
+                    Path of the cache of partial aggregates of days (see day_cache.DayCache) whose
+                    days are invalidated when flights are inserted, None to keep it.
+
+        session : Session
+                  Session used instead of a connection to the cluster, see ConnectionDB.
+        """
+        ConnectionDB.__init__(self, session)
+        self._prepared = None
+        self._prepared_rollup = None
+        self._prepared_selects = {}
+        self._day_cache = day_cache
 
     def __del__(self):
         ConnectionDB.__del__(self)
 
-    def insert_datastream(self, stream):
+    @metrics.timed("insert_datastream")
+    def insert_datastream(self, stream, rollup=True):
         """Insert datas into the DB.
 
         Parameters
         ----------
         stream : iterable
                  Iterable where values to insert are taken.
+
+        rollup : boolean
+                 Add the inserted flights to delay_rollup_by_hour too, see add_rollup.
         """
+        inserted = []
+        rows = rejected = 0
         for flight in stream:
-            # ArrDelay and DepDelay and TailNum can be 'NA' when cancelled is true
-            if (flight.year != 'NA'
-                and flight.month != 'NA'
-                and flight.day_month != 'NA'
-                and flight.day_week != 'NA'
-                and flight.hour != 'NA'
-                and ((flight.cancelled == False and flight.ArrDelay != 'NA' and flight.DepDelay != 'NA') or flight.cancelled == True)):
+            if is_valid(flight):
                 for q in INSERTS_Q:
                     query = q(flight)
-                    self._session.execute(query)
+                    self._execute(query)
+                rows += 1
+                inserted.append(flight)
+            else:
+                rejected += 1
+        inserted = Rollup.of_inserted(inserted)
+        if rollup:
+            self.add_rollup(inserted)
+        self._invalidate(inserted.cells)
+        metrics.count("rows_inserted", rows)
+        metrics.count("rows_rejected", rejected)
+
+    @metrics.timed("add_rollup")
+    def add_rollup(self, rollup, concurrency=64):
+        """Add the counts and sums of a Rollup of inserted flights to the counters of delay_rollup_by_hour.
+
+        Flights which overwrite rows stored by an earlier insert are counted again: the hours of such
+        flights, and of inserts which failed partway, are brought back to the stored rows by sync_rollup.
+        Counter updates are not retried, an update which failed is counted and sync_rollup corrects it.
+
+        Return
+        ------
+        stats : dict
+                Number of hours, of counter rows updated and of updates failed.
+        """
+        return self._update_rollup(rollup.updates({}), len(rollup.cells), concurrency)
+
+    def _update_rollup(self, updates, nb_hours, concurrency):
+        """Submit the values of UPDATE_ROLLUP_BY_HOUR once, see add_rollup."""
+        window = AsyncWindow(self._session, concurrency, max_retries=0)
+        update = self._prepare_rollup()
+        for params in updates:
+            window.submit(update, params)
+        window.join()
+        metrics.count("rollup_updates", window.rows)
+        metrics.count("rollup_updates_failed", window.failed)
+        return {"hours": nb_hours, "updated": window.rows, "failed": window.failed}
+
+    @metrics.timed("sync_rollup")
+    def sync_rollup(self, hours, concurrency=64):
+        """Bring the counters of delay_rollup_by_hour of hours to the flights stored in flight_by_time.
+
+        Every stored flight of the hours is read back: it is only used for the hours whose counters
+        add_rollup cannot give, where flights overwrote rows of an earlier insert or an insert failed
+        partway. Counters cannot be set, the difference with the stored rows is added, so a sync of
+        hours already up to date changes nothing. Two syncs of the same hours must not run at once.
+        Counter updates are not retried, an update which failed is counted and the next sync of its
+        hour corrects it.
+
+        Parameters
+        ----------
+        hours : iterable
+                (year, month, day_month, hour) tuples.
+
+        concurrency : integer
+                      Maximum number of statements in flight.
+
+        Return
+        ------
+        stats : dict
+                Number of hours read, of counter rows updated and of updates failed.
+        """
+        hours = sorted(set(hours))
+        select_flights = self._prepare_select(SELECT_DELAYS_ONE_DAY_HOUR)
+        select_rollup = self._prepare_select(SELECT_ROLLUP_ONE_HOUR)
+        stored = Rollup()
+        current = {}
+        for i in range(0, len(hours), concurrency):
+            chunk = hours[i:i+concurrency]
+            flights = [self._session.execute_async(select_flights, _hour_partition_key(hour)) for hour in chunk]
+            counters = [self._session.execute_async(select_rollup, hour) for hour in chunk]
+            for hour, rows, counter_rows in zip(chunk, flights, counters):
+                for r in rows.result():
+                    stored.add(hour, r.cancelled, r.arr_delay, r.dep_delay)
+                for r in counter_rows.result():
+                    current[hour] = tuple(getattr(r, counter) or 0 for counter in ROLLUP_COUNTERS)
+        # Hours whose flights are all gone keep their counters, they are brought to 0 too
+        for hour in current:
+            stored.cells.setdefault(hour, [0] * len(ROLLUP_COUNTERS))
+        return self._update_rollup(stored.updates(current), len(hours), concurrency)
+
+    def _execute(self, query, params=None):
+        """Execute a statement synchronously, its latency is measured when the metrics are enabled."""
+        if not metrics.ENABLED:
+            return self._session.execute(query, params)
+        start = time.perf_counter()
+        try:
+            return self._session.execute(query, params)
+        finally:
+            metrics.observe("cassandra_write_seconds", time.perf_counter() - start)
+
+    def _invalidate(self, hours):
+        """Remove the days where flights were inserted from the cache of partial aggregates."""
+        if hours and self._day_cache is not None:
+            invalidate_days({hour[:3] for hour in hours}, self._day_cache)
+
+    def _unlogged_batch(self, statements):
+        """Group bound statements in an unlogged batch, the stand-in session of bench.fake_cassandra builds its own."""
+        if hasattr(self._session, "unlogged_batch"):
+            return self._session.unlogged_batch(statements)
+        import cassandra.query
+        batch = cassandra.query.BatchStatement(batch_type=cassandra.query.BatchType.UNLOGGED)
+        for statement in statements:
+            batch.add(statement)
+        return batch
+
+    def _prepare(self):
+        """Prepare the insert queries once."""
+        if self._prepared is None:
+            self._prepared = [(self._session.prepare(query), values) for query, values in PREPARED_INSERTS_Q]
+        return self._prepared
+
+    def _prepare_rollup(self):
+        """Prepare the rollup update once."""
+        if self._prepared_rollup is None:
+            self._prepared_rollup = self._session.prepare(UPDATE_ROLLUP_BY_HOUR)
+        return self._prepared_rollup
+
+    def _prepare_select(self, query):
+        """Prepare a select query of sync_rollup once."""
+        if query not in self._prepared_selects:
+            self._prepared_selects[query] = self._session.prepare(query)
+        return self._prepared_selects[query]
+
+    @metrics.timed("bulk_insert_datastream")
+    def bulk_insert_datastream(self, stream, concurrency=128, batch_size=None, max_retries=3, report_every=1.0, check=True, rollup=True):
+        """Insert datas into the DB with prepared statements executed asynchronously.
+
+        Parameters
+        ----------
+        stream : iterable
+                 Iterable where values to insert are taken.
+
+        concurrency : integer
+                      Maximum number of statements in flight.
+
+        batch_size : integer
+                     Group rows of the same partition in unlogged batches of at most batch_size rows, no batch if not given.
+
+        max_retries : integer
+                      Number of times a failed statement is executed again.
+
+        report_every : float
+                       Print throughput and failures every report_every seconds, nothing is printed if None.
+
+        check : boolean
+                Skip the flights which are not valid, see is_valid. Use False for a stream already filtered.
+
+        rollup : boolean
+                 Add the inserted flights to delay_rollup_by_hour at the end of the stream, see add_rollup.
+                 The hours are synced from the stored rows instead when rows failed, see sync_rollup.
+
+        Return
+        ------
+        stats : dict
+                Number of inserted, retried and failed rows and throughput, see AsyncWindow.stats,
+                and with rollup the number of counter updates failed as rollup_failed.
+        """
+        prepared = self._prepare()
+        hours = set()
+        # Primary key in flight_by_time -> last flight inserted with it, for the rollup
+        inserted = {}
+        window = AsyncWindow(self._session, concurrency, max_retries, report_every)
+        # (statement, partition key) -> bound statements waiting for their batch
+        pending = collections.defaultdict(list)
+        rejected = 0
+        for flight in stream:
+            if check and not is_valid(flight):
+                rejected += 1
+                continue
+            hours.add((flight.year, flight.month, flight.day_month, flight.hour))
+            if rollup:
+                inserted[_stored_key(flight)] = flight
+            for statement, values in prepared:
+                params = values(flight)
+                if batch_size is None:
+                    window.submit(statement, params)
+                    continue
+                rows = pending[statement.query_id, params[:PARTITION_KEY_SIZE]]
+                rows.append(statement.bind(params))
+                if len(rows) == batch_size:
+                    window.submit(self._unlogged_batch(rows), nb_rows=len(rows))
+                    rows.clear()
+        for rows in pending.values():
+            if rows:
+                window.submit(self._unlogged_batch(rows), nb_rows=len(rows))
+        window.join()
+        stats = window.stats()
+        if rollup and stats["failed"]:
+            stats["rollup_failed"] = self.sync_rollup(hours, concurrency)["failed"]
+        elif rollup:
+            stats["rollup_failed"] = self.add_rollup(Rollup.of_inserted(inserted.values()), concurrency)["failed"]
+        self._invalidate(hours)
+        metrics.count("rows_inserted", stats["rows"])
+        metrics.count("rows_rejected", rejected)
+        metrics.count("rows_retried", stats["retried"])
+        metrics.count("rows_failed", stats["failed"])
+        return stats
+
+#
+# Resumable ingest of flights files with worker processes
+#
+# Files are cut into byte ranges, every range is parsed, filtered and inserted by a worker
+# process with its own session. The ranges fully inserted are appended to a checkpoint file
+# with the hours of their flights, an ingest started again with the same checkpoint skips them.
+#
+# Workers do not touch the counters of delay_rollup_by_hour nor the cache of partial aggregates
+# of days, they give the rollup of the rows they inserted. Once the pool is done, the calling
+# process updates the counters of the hours of the ranges of the checkpoint whose rollup is not
+# recorded yet and records it, then invalidates the days of these hours once:
+# - the rollup of a range inserted by this run is added (see InsertFlight.add_rollup) for the
+#   hours which no other range of the checkpoint has flights of,
+# - the other hours are synced from the stored rows (see InsertFlight.sync_rollup): hours shared
+#   with other ranges, whose rows may overwrite each other, hours of ranges inserted with failed
+#   rows, and every hour of a run stopped before its rollup was recorded, since the counters it
+#   added are unknown. The sync only adds the difference with the stored rows.
+#
+
+# InsertFlight of a worker process and its bulk insert options, set by _init_ingest_worker
+_WORKER_INSERT = None
+_WORKER_OPTIONS = None
+
+def _init_ingest_worker(Plane, options):
+    global _WORKER_INSERT, _WORKER_OPTIONS
+    flight_data._init_worker(Plane)
+    _WORKER_INSERT = InsertFlight(day_cache=None)
+    _WORKER_OPTIONS = options
+
+def _ingest_chunk(filename, start, stop, batch_size):
+    """Parse, filter and insert a byte range of a flights file in a worker process.
+
+    Return
+    ------
+    stats : dict
+            Number of inserted, retried, failed and rejected rows, the Rollup of the flights inserted
+            as rollup and its (year, month, day_month, hour) as hours.
+    """
+    stats = {"rows": 0, "retried": 0, "failed": 0, "rejected": 0}
+    # Primary key in flight_by_time -> last flight inserted with it
+    inserted = {}
+    for batch in flight_data._read_split(filename, start, stop, batch_size):
+        mask = valid_mask(batch)
+        stats["rejected"] += int(len(batch) - mask.sum())
+        flights = list(batch[mask].rows())
+        result = _WORKER_INSERT.bulk_insert_datastream(flights, report_every=None, check=False, rollup=False, **_WORKER_OPTIONS)
+        for key in ("rows", "retried", "failed"):
+            stats[key] += result[key]
+        inserted.update((_stored_key(flight), flight) for flight in flights)
+    stats["rollup"] = Rollup.of_inserted(inserted.values())
+    stats["hours"] = sorted(stats["rollup"].cells)
+    return stats
+
+def _chunk_id(filename, start, stop):
+    """Identify a byte range of a file by its path and offsets.
+
+    Lines appended to a file keep the byte ranges already inserted in the checkpoint, except the last
+    range which grows: it is inserted again, its rows overwrite the stored ones and the rollup is
+    synced from the stored rows, so nothing is counted twice. A file rewritten in place is not detected.
+    """
+    return f"{os.path.abspath(filename)}:{start}-{stop}"
+
+def _read_records(checkpoint):
+    """Give the records of a checkpoint file: a byte range inserted, with failed rows or not, or the byte ranges whose rollup was updated."""
+    if not os.path.exists(checkpoint):
+        return []
+    with open(checkpoint) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def read_checkpoint(checkpoint):
+    """Give the identifiers of the byte ranges recorded in a checkpoint file."""
+    return {record["chunk"] for record in _read_records(checkpoint) if "chunk" in record}
+
+def _pending_rollup(checkpoint):
+    """Give the byte ranges of a checkpoint file whose rollup is not updated yet with the hours of their flights."""
+    pending = {}
+    for record in _read_records(checkpoint):
+        if "chunk" in record:
+            pending[record["chunk"]] = record.get("hours", [])
+        elif "rollup" in record:
+            for chunk in record["rollup"]:
+                pending.pop(chunk, None)
+    return pending
+
+def _ranges_per_hour(checkpoint):
+    """Give the number of byte ranges of a checkpoint file, inserted or inserted with failed rows, with flights of every hour."""
+    ranges = collections.Counter()
+    for record in _read_records(checkpoint):
+        if "chunk" in record or "partial" in record:
+            ranges.update(map(tuple, record.get("hours", [])))
+    return ranges
+
+@metrics.timed("ingest_files")
+def ingest_files(fnames, checkpoint, processes=None, split_size=32*2**20, batch_size=100000,
+                 concurrency=64, insert_batch_size=None, max_retries=3, rollup=True, day_cache=DAY_CACHE):
+    """Insert flights files into the DB with a pool of worker processes, resuming from a checkpoint.
+
+    Parameters
+    ----------
+    fnames : iterable
+             Paths of the flights files.
+
+    checkpoint : string
+                 Path of the checkpoint file, created if needed. It goes with the DB: the rollup of the
+                 flights inserted again with another checkpoint is counted again.
+
+    processes : integer
+                Number of worker processes, the number of processors if not given.
+
+    split_size : integer
+                 Size in bytes of the byte ranges of the files, it must not change between runs sharing a checkpoint.
+
+    batch_size : integer
+                 Number of flights parsed and filtered at once.
+
+    concurrency, insert_batch_size, max_retries :
+        Options of InsertFlight.bulk_insert_datastream in every worker, insert_batch_size is its batch_size.
+
+    rollup : boolean
+             Update delay_rollup_by_hour for the hours of the byte ranges inserted once the workers are done.
+
+    day_cache : string
+                Path of the cache of partial aggregates of days whose days are invalidated once the
+                workers are done, None to keep it.
+
+    Return
+    ------
+    stats : dict
+            Number of inserted, retried, failed and rejected rows, number of byte ranges done, skipped
+            and failed, and number of hours updated, of hours synced from the stored rows and of counter
+            updates failed by the rollup.
+    """
+    chunks = [chunk for fname in fnames for chunk in file_splits(fname, split_size)]
+    options = {"concurrency": concurrency, "batch_size": insert_batch_size, "max_retries": max_retries, "rollup": rollup}
+    return _ingest_chunks(chunks, checkpoint, processes, batch_size, options, day_cache)[0]
+
+def _ingest_chunks(chunks, checkpoint, processes, batch_size, options, day_cache=DAY_CACHE):
+    """Insert byte ranges of flights files which are not in the checkpoint, see ingest_files.
+
+    Return
+    ------
+    stats : dict
+            See ingest_files.
+
+    failed : set
+             Byte ranges not fully inserted.
+    """
+    options = dict(options)
+    rollup = options.pop("rollup", True)
+    done = read_checkpoint(checkpoint)
+    todo = [chunk for chunk in chunks if _chunk_id(*chunk) not in done]
+    stats = {"rows": 0, "retried": 0, "failed": 0, "rejected": 0, "chunks": 0, "skipped": len(chunks) - len(todo), "failed_chunks": 0}
+    failed = set()
+    # Hours of the flights inserted, and of the byte ranges inserted with failed rows whose stored rows are synced too
+    hours, partial_hours = set(), set()
+    if todo:
+        with concurrent.futures.ProcessPoolExecutor(processes, initializer=_init_ingest_worker, initargs=(get_plane_registry(), options)) as pool:
+            hours, partial_hours, rollups = _run_chunks(pool, todo, checkpoint, batch_size, stats, failed)
+    else:
+        rollups = {}
+    if rollup:
+        synced, rollup_stats = _update_checkpoint_rollup(checkpoint, partial_hours, rollups, options.get("concurrency", 64))
+        stats.update(rollup_stats)
+        hours = hours | synced
+    if hours and day_cache is not None:
+        invalidate_days({hour[:3] for hour in hours}, day_cache)
+    return stats, failed
+
+def _run_chunks(pool, todo, checkpoint, batch_size, stats, failed):
+    """Insert byte ranges with the pool and record the ranges fully inserted in the checkpoint, see _ingest_chunks.
+
+    The hours of the ranges inserted with failed rows are recorded too, their counters are synced
+    from the stored rows from then on.
+
+    Return
+    ------
+    hours : set
+            Hours of the flights inserted.
+
+    partial_hours : set
+                    Hours of the flights of the byte ranges inserted with failed rows.
+
+    rollups : dict
+              Links the identifier of every byte range fully inserted to the Rollup of its flights.
+    """
+    inserted = set()
+    partial_hours = set()
+    rollups = {}
+    futures = {pool.submit(_ingest_chunk, *chunk, batch_size): chunk for chunk in todo}
+    with open(checkpoint, "a") as f:
+        for future in concurrent.futures.as_completed(futures):
+            chunk = futures[future]
+            try:
+                result = future.result()
+            except Exception as exception:
+                print(f"Exception : {chunk} not inserted, {exception!r}")
+                stats["failed_chunks"] += 1
+                failed.add(chunk)
+                continue
+            hours = result.pop("hours")
+            rollup = result.pop("rollup")
+            inserted.update(map(tuple, hours))
+            for key, value in result.items():
+                stats[key] += value
+                metrics.count("rows_inserted" if key == "rows" else f"rows_{key}", value)
+            metrics.count("bytes_read", chunk[2] - chunk[1], source="csv")
+            if result["failed"]:
+                stats["failed_chunks"] += 1
+                failed.add(chunk)
+                partial_hours.update(map(tuple, hours))
+                record = {"partial": _chunk_id(*chunk), "hours": hours}
+            else:
+                stats["chunks"] += 1
+                rollups[_chunk_id(*chunk)] = rollup
+                record = {"chunk": _chunk_id(*chunk), "rows": result["rows"], "hours": hours}
+            f.write(json.dumps(record) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    return inserted, partial_hours, rollups
+
+def _update_checkpoint_rollup(checkpoint, partial_hours, rollups, concurrency):
+    """Update delay_rollup_by_hour for the byte ranges of a checkpoint whose rollup is not recorded yet.
+
+    The rollup of the ranges inserted by this run is added for the hours which no other range
+    has flights of, the other hours are synced from the stored rows. The byte ranges are recorded
+    in the checkpoint when no counter update failed, the next run syncs them otherwise.
+
+    Parameters
+    ----------
+    partial_hours : set
+                    Hours of the byte ranges inserted with failed rows by this run.
+
+    rollups : dict
+              Links the byte ranges inserted by this run to the Rollup of their flights.
+
+    Return
+    ------
+    hours : set
+            Hours whose counters were updated.
+
+    stats : dict
+            Number of hours updated, of hours synced from the stored rows and of counter updates failed.
+    """
+    pending = _pending_rollup(checkpoint)
+    ranges = _ranges_per_hour(checkpoint)
+    added = Rollup()
+    synced = set(partial_hours)
+    for chunk, chunk_hours in pending.items():
+        rollup = rollups.get(chunk)
+        for hour in map(tuple, chunk_hours):
+            if rollup is not None and ranges[hour] == 1 and hour in rollup.cells:
+                added.cells[hour] = rollup.cells[hour]
+            else:
+                synced.add(hour)
+    hours = synced | set(added.cells)
+    if not hours:
+        return hours, {"rollup_hours": 0, "rollup_synced": 0, "rollup_failed": 0}
+    insert = InsertFlight(day_cache=None)
+    failed = insert.add_rollup(added, concurrency)["failed"] + insert.sync_rollup(synced, concurrency)["failed"]
+    if not failed and pending:
+        with open(checkpoint, "a") as f:
+            f.write(json.dumps({"rollup": sorted(pending)}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+    return hours, {"rollup_hours": len(hours), "rollup_synced": len(synced), "rollup_failed": failed}
+
+#
+# Incremental ingest of newly arriving flights files
+#
+# A manifest records up to which byte every file was inserted: a run inserts only the new files
+# and the lines appended to the known ones. delay_rollup_by_hour is updated in place and the
+# days of the new flights are removed from the cache of partial aggregates of days, so the
+# next statistics between two dates read again only these days.
+#
+@metrics.timed("ingest_new_files")
+def ingest_new_files(fnames, manifest, checkpoint, processes=None, split_size=32*2**20, batch_size=100000,
+                     concurrency=64, insert_batch_size=None, max_retries=3, rollup=True, day_cache=DAY_CACHE):
+    """Insert the flights of the files which are not in the manifest yet, then update the manifest.
+
+    Parameters
+    ----------
+    fnames : iterable
+             Paths of the flights files, new ones or known ones with appended lines.
+
+    manifest : string
+               Path of the manifest file, see flight_data.Manifest. It is created if needed.
+
+    checkpoint : string
+                 Path of the checkpoint file which makes a failed run resumable, see ingest_files.
+
+    processes, split_size, batch_size, concurrency, insert_batch_size, max_retries, rollup, day_cache :
+        See ingest_files.
+
+    Return
+    ------
+    stats : dict
+            See ingest_files. A file with a byte range not inserted is not marked in the manifest,
+            the next run inserts again the byte ranges which are not in the checkpoint.
+    """
+    processed = Manifest.load(manifest)
+    chunks = processed.new_splits(fnames, split_size)
+    options = {"concurrency": concurrency, "batch_size": insert_batch_size, "max_retries": max_retries, "rollup": rollup}
+    stats, failed = _ingest_chunks(chunks, checkpoint, processes, batch_size, options, day_cache)
+    failed_files = {filename for filename, start, stop in failed}
+    for filename, start, stop in chunks:
+        if filename not in failed_files:
+            processed.mark(filename, stop)
+    processed.save(manifest)
+    return stats
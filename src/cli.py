@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+"""Command-line entry point of the project.
+
+Usage, from any directory, the directories of the modules are added to the import path :
+    python src/cli.py ingest FILE... --checkpoint ingest.jsonl [--manifest manifest.json]
+    python src/cli.py analyse-spark FILE... [--years 2007] [--state state.npz] [--results results.json]
+    python src/cli.py analyse-spark 1987.csv ... 2008.csv --store partials/ [--recompute 2007]
+    python src/cli.py analyse-local FILE... [--years 2007] [--workers 4] [--parity]
+    python src/cli.py analyse-cassandra --from 2007-01-01 --to 2008-01-01 [--rollup] [--results results.json]
+    python src/cli.py report results.json [--output DIR]
+
+Only the standard library is imported at start, Spark, Cassandra, NumPy, pandas and matplotlib
+are imported by the subcommands which need them.
+"""
+
+import os
+import sys
+import json
+import argparse
+import datetime
+
+# The modules of the project are flat modules of src and of its spark, cassandra and bench directories,
+# the Python workers of Spark import them from the PYTHONPATH
+SRC = os.path.dirname(os.path.abspath(__file__))
+DIRECTORIES = [os.path.join(SRC, directory) for directory in ("", "spark", "cassandra", "bench")]
+sys.path[:0] = [directory for directory in DIRECTORIES if directory not in sys.path]
+os.environ["PYTHONPATH"] = os.pathsep.join(DIRECTORIES + [os.environ["PYTHONPATH"]] if os.environ.get("PYTHONPATH") else DIRECTORIES)
+
+#
+# Subcommands
+#
+def ingest(args):
+    """Insert flights files into the DB, see feed_cassandra.ingest_files and feed_cassandra.ingest_new_files."""
+    import feed_cassandra
+    options = {
+        "processes": args.processes,
+        "split_size": args.split_size,
+        "batch_size": args.batch_size,
+        "concurrency": args.concurrency,
+        "insert_batch_size": args.insert_batch_size,
+        "max_retries": args.max_retries,
+        "rollup": not args.no_rollup,
+    }
+    if args.cache:
+        options["day_cache"] = args.cache
+    if args.manifest:
+        stats = feed_cassandra.ingest_new_files(args.files, args.manifest, args.checkpoint, **options)
+    else:
+        stats = feed_cassandra.ingest_files(args.files, args.checkpoint, **options)
+    print(json.dumps(stats, indent=1))
+    return 1 if stats["failed_chunks"] else 0
+
+def analyse_spark(args):
+    """Run the analyses of analyse_spark on flights files, with a single scan of the data."""
+    import analyse_spark
+    import flight_data
+    Plane = flight_data.get_plane_registry(args.plane_data) if args.plane_data else None
+    if args.store:
+        results, updated = analyse_spark.run_years(args.files, args.store, Plane=Plane, recompute=args.recompute or ())
+        print(f"Years scanned : {sorted(updated)}")
+    elif args.state:
+        results, years = analyse_spark.update_analyses(args.files, args.state, Plane=Plane)
+        if not years:
+            print("No new flights")
+    else:
+        sc, D = analyse_spark.get_RDD_from_flight_data(args.files, Plane=Plane, batches=True)
+        results = analyse_spark.run_analyses(D)
+    return _save_results(args, {"engine": "spark", "charts": _age_charts(results, args.years)})
+
+def analyse_local(args):
+    """Run the analyses of analyse_spark on flights files with the local engine, see analyse_local."""
+    import analyse_local
+    import flight_data
+    Plane = flight_data.get_plane_registry(args.plane_data) if args.plane_data else None
+    options = {"Plane": Plane, "processes": args.workers, "use_cache": not args.no_cache}
+    if args.parity:
+        failed = False
+        for analysis, (difference, ok) in analyse_local.check_parity(args.files, **options).items():
+            print(f"{analysis:32} {difference:>12.3g} {'ok' if ok else 'DIFFERENT'}")
+            failed |= not ok
+        return 1 if failed else 0
+    results = analyse_local.run_analyses(args.files, **options)
+    return _save_results(args, {"engine": "local", "charts": _age_charts(results, args.years)})
+
+def _age_charts(results, years=None):
+    """Print the delays per age of plane and give the inputs of their charts per year."""
+    charts = {}
+    for analysis, chart in (("avg_delay_per_age_group", "one_year"), ("delay_over_avg_age_year", "delay_over_avg")):
+        if analysis not in results:
+            continue
+        df_ArrDelay, df_DepDelay = results[analysis]
+        print(f"{analysis} :\n{df_ArrDelay}\n{df_DepDelay}")
+        for column in df_ArrDelay.columns:
+            year = column.split("-")[-1]
+            if not column.startswith("mean-") or (years and int(year) not in years):
+                continue
+            values = (df_ArrDelay[f"mean-{year}"], df_DepDelay[f"mean-{year}"], df_ArrDelay[f"std-{year}"], df_DepDelay[f"std-{year}"])
+            charts.setdefault(year, {})[chart] = [[float(value) for value in column] for column in values]
+    return charts
+
+def analyse_cassandra(args):
+    """Compute the statistics of the flights of the DB per hour, day of week and season between two dates."""
+    import analyse_cassandra
+    from day_cache import DayCache
+    dt1, dt2 = args.dt1, args.dt2
+    cache = DayCache(args.cache) if args.cache else None
+    cube = analyse_cassandra.time_cube_between_dates(dt1, dt2, rollup=args.rollup, cache=cache)
+    charts = {}
+    for axis, statistics in (
+        ("hour", analyse_cassandra.avg_std_per_hour_between_dates),
+        ("day", analyse_cassandra.avg_std_per_day_between_dates),
+        ("season", analyse_cassandra.avg_std_per_season_between_dates),
+    ):
+        values = statistics(dt1, dt2, cube)
+        charts[axis] = [[float(value) for value in column] for column in values]
+        print(f"{axis:>6} {'mean_ArrDelay':>14} {'mean_DepDelay':>14} {'std_ArrDelay':>14} {'std_DepDelay':>14} {'prop_cancelled':>14}")
+        for i, row in enumerate(zip(*values)):
+            print(f"{i:>6}" + "".join(f"{value:>14.4g}" for value in row))
+    if args.quantiles:
+        arr_quantiles, dep_quantiles = analyse_cassandra.delay_quantiles_between_dates(dt1, dt2, args.quantiles_axis, args.quantiles)
+        print(f"Quantiles {args.quantiles} of arrival delays per {args.quantiles_axis} :\n{arr_quantiles}")
+        print(f"Quantiles {args.quantiles} of departure delays per {args.quantiles_axis} :\n{dep_quantiles}")
+    results = {"engine": "cassandra", "from": dt1.isoformat(), "to": dt2.isoformat(), "charts": charts}
+    return _save_results(args, results)
+
+def report(args):
+    """Render the charts of a results file written by analyse-spark or analyse-cassandra."""
+    with open(args.results) as f:
+        results = json.load(f)
+    return _render(results, args.output, args.processes, args.force)
+
+def _save_results(args, results):
+    if args.results:
+        os.makedirs(os.path.dirname(os.path.abspath(args.results)), exist_ok=True)
+        with open(args.results, "w") as f:
+            json.dump(results, f, indent=1)
+    if not args.no_report:
+        return _render(results, args.output, args.processes, False)
+    return 0
+
+def _render(results, output, processes=None, force=False):
+    """Render the charts of results, the charts of every year of the Spark or local analyses in a directory per year."""
+    from report import render
+    if results["engine"] in ("spark", "local"):
+        import analyses
+        for year, charts in sorted(results["charts"].items()):
+            todo = []
+            if "one_year" in charts:
+                todo += analyses.charts_one_year(*charts["one_year"])
+            if "delay_over_avg" in charts:
+                todo += analyses.charts_delay_over_avg_one_year(*charts["delay_over_avg"])
+            directory = os.path.join(output, year) if len(results["charts"]) > 1 else output
+            _print_rendered(render(todo, directory, processes, force), directory)
+    else:
+        import analyse_cassandra
+        charts = results["charts"]
+        todo = analyse_cassandra.charts_hour(*charts["hour"])
+        if (datetime.date.fromisoformat(results["to"][:10]) - datetime.date.fromisoformat(results["from"][:10])).days >= 7:
+            todo += analyse_cassandra.charts_day(*charts["day"])
+        todo += analyse_cassandra.charts_season(*charts["season"])
+        _print_rendered(render(todo, output, processes, force), output)
+    return 0
+
+def _print_rendered(rendered, directory):
+    for filename in rendered:
+        print(os.path.join(directory, filename))
+
+#
+# Arguments
+#
+def _date(text):
+    """Parse a YYYY-MM-DD date into a datetime at midnight."""
+    try:
+        return datetime.datetime.combine(datetime.date.fromisoformat(text), datetime.time())
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{text} is not a YYYY-MM-DD date")
+
+def _report_options(parser):
+    parser.add_argument("--output", default=".", help="directory of the charts")
+    parser.add_argument("--processes", type=int, help="number of processes which render the charts")
+
+def parser():
+    parser = argparse.ArgumentParser(prog="cli.py", description="Analysis of the delays of the flights of the dataexpo 2009 data.")
+    parser.add_argument("--metrics", help="enable the instrumentation and export its metrics in this file at the end")
+    parser.add_argument("--metrics-format", default="json", choices=("json", "prometheus"))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("ingest", help="insert flights files into Cassandra")
+    command.add_argument("files", nargs="+")
+    command.add_argument("--checkpoint", required=True, help="file of the byte ranges inserted, a run started again skips them")
+    command.add_argument("--manifest", help="insert only the files and lines which are not in this manifest yet, then update it")
+    command.add_argument("--processes", type=int)
+    command.add_argument("--split-size", type=int, default=32*2**20)
+    command.add_argument("--batch-size", type=int, default=100000)
+    command.add_argument("--concurrency", type=int, default=64)
+    command.add_argument("--insert-batch-size", type=int)
+    command.add_argument("--max-retries", type=int, default=3)
+    command.add_argument("--no-rollup", action="store_true", help="do not update delay_rollup_by_hour")
+    command.add_argument("--cache", help="SQLite cache of the partial aggregates of days whose days are invalidated, ~/.cache/flights_analysis/day_cache.sqlite if not given")
+    command.set_defaults(run=ingest)
+
+    command = commands.add_parser("analyse-spark", help="analyse the delays per age of plane with Spark")
+    command.add_argument("files", nargs="+")
+    command.add_argument("--years", type=int, nargs="+", help="years of the charts, every year if not given")
+    command.add_argument("--plane-data", help="plane data file, the shared one if not given")
+    command.add_argument("--state", help="file of partial results: only the flights not processed yet are read")
+    command.add_argument("--store", help="directory of partial results per year, the year of a file is in its name: only the years not processed yet are read")
+    command.add_argument("--recompute", type=int, nargs="+", help="years of --store whose flights are all read again")
+    command.add_argument("--results", help="write the results in this file, for the report subcommand")
+    command.add_argument("--no-report", action="store_true", help="do not render the charts")
+    _report_options(command)
+    command.set_defaults(run=analyse_spark)
+
+    command = commands.add_parser("analyse-local", help="analyse the delays per age of plane on this machine, without Spark")
+    command.add_argument("files", nargs="+")
+    command.add_argument("--years", type=int, nargs="+", help="years of the charts, every year if not given")
+    command.add_argument("--plane-data", help="plane data file, the shared one if not given")
+    command.add_argument("--workers", type=int, help="number of processes which read the files, one per processor if not given")
+    command.add_argument("--no-cache", action="store_true", help="read the files even when their columnar cache is fresh")
+    command.add_argument("--parity", action="store_true", help="compare the results with the ones of Spark instead of writing them")
+    command.add_argument("--results", help="write the results in this file, for the report subcommand")
+    command.add_argument("--no-report", action="store_true", help="do not render the charts")
+    _report_options(command)
+    command.set_defaults(run=analyse_local)
+
+    command = commands.add_parser("analyse-cassandra", help="analyse the delays per hour, day of week and season from Cassandra")
+    command.add_argument("--from", dest="dt1", type=_date, required=True, help="first day, YYYY-MM-DD")
+    command.add_argument("--to", dest="dt2", type=_date, required=True, help="day after the last one, YYYY-MM-DD")
+    command.add_argument("--rollup", action="store_true", help="read delay_rollup_by_hour instead of the flights")
+    command.add_argument("--cache", help="SQLite cache of the partial aggregates of days")
+    command.add_argument("--quantiles", type=float, nargs="+", help="also compute these quantiles of the delays")
+    command.add_argument("--quantiles-axis", default="hour", choices=("hour", "day", "season"))
+    command.add_argument("--results", help="write the results in this file, for the report subcommand")
+    command.add_argument("--no-report", action="store_true", help="do not render the charts")
+    _report_options(command)
+    command.set_defaults(run=analyse_cassandra)
+
+    command = commands.add_parser("report", help="render the charts of a results file")
+    command.add_argument("results")
+    command.add_argument("--force", action="store_true", help="render the charts whose inputs did not change too")
+    _report_options(command)
+    command.set_defaults(run=report)
+    return parser
+
+def main(argv=None):
+    args = parser().parse_args(argv)
+    if args.metrics:
+        import metrics
+        metrics.enable(args.metrics, args.metrics_format)
+    return args.run(args)
+
+if __name__ == "__main__":
+    sys.exit(main())
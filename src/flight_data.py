@@ -1,9 +1,24 @@
 # -*- coding: utf-8 -*-
 
+import io
+import os
 import csv
-import datetime
+import json
+import time
+import shutil
+import tempfile
+import bisect
+import array
 import itertools
 import collections
+import concurrent.futures
+
+import numpy as np
+
+import metrics
+
+# pandas is imported by the functions which parse the files only, so that the modules which
+# query the DB or read the columnar caches start fast
 
 limiteur = lambda generator, limit: (data for _, data in zip(range(limit), generator))
 
@@ -12,36 +27,645 @@ Flight = collections.namedtuple(
     ("year", "month", "day_month", "day_week", "hour", "ArrDelay", "DepDelay", "cancelled", "tailnum", "plane_age"),
 )
 
-def _read_one_csv(filename):
-    """Read a file which contains flights data and retrieve usefull information in a Flight tuple."""
-    Plane = read_plane_data()
-    with open(filename) as f:
-        for row in csv.DictReader(f):
-            year = int(row["Year"]) if row["Year"] != 'NA' else row["Year"]
-            month = int(row["Month"]) if row["Month"] != 'NA' else row["Month"]
-            day_month = int(row["DayofMonth"]) if row["DayofMonth"] != 'NA' else row["DayofMonth"]
-            day_week = int(row["DayOfWeek"]) if row["DayOfWeek"] != 'NA' else row["DayOfWeek"]
-            tailnum = row["TailNum"]
-            hh_mm = row["CRSDepTime"]
-            if len(hh_mm) < 4:
-                hh_mm = "0" + hh_mm
-            hour = int(hh_mm[:2])
-            ArrDelay = int(row["ArrDelay"]) if row["ArrDelay"] != 'NA' else row["ArrDelay"]
-            DepDelay = int(row["DepDelay"]) if row["DepDelay"] != 'NA' else row["DepDelay"]
-            cancelled = bool(int(row["Cancelled"])) if row["Cancelled"] != 'NA' else row["Cancelled"]
-            plane_age = year - Plane[tailnum] if tailnum in Plane and year != 'NA' else 'NA'
-            yield Flight(year, month, day_month, day_week, hour, ArrDelay, DepDelay,cancelled, tailnum, plane_age)
-
-def read_csvs(fnames, limit=None):
+PLANE_DATA = "/project_data/plane-data.csv"
+
+# Columns of the flights files used to build a Flight
+CSV_COLUMNS = ("Year", "Month", "DayofMonth", "DayOfWeek", "CRSDepTime", "TailNum", "ArrDelay", "DepDelay", "Cancelled")
+
+# Type of each Flight field in a FlightBatch
+BATCH_DTYPES = collections.OrderedDict((
+    ("year", np.int16),
+    ("month", np.int8),
+    ("day_month", np.int8),
+    ("day_week", np.int8),
+    ("hour", np.int8),
+    ("ArrDelay", np.int32),
+    ("DepDelay", np.int32),
+    ("cancelled", np.bool_),
+    ("tailnum", np.object_),
+    ("plane_age", np.int16),
+))
+
+# Compact row layout of a flight: fixed-width integers, the tail number is an index in a dictionary.
+# A missing value is stored as the smallest value of its type, see NA_SENTINELS.
+RECORD_DTYPE = np.dtype([
+    ("year", np.int16),
+    ("month", np.int8),
+    ("day_month", np.int8),
+    ("day_week", np.int8),
+    ("hour", np.int8),
+    ("ArrDelay", np.int32),
+    ("DepDelay", np.int32),
+    ("cancelled", np.int8),
+    ("tailnum", np.int32),
+    ("plane_age", np.int16),
+])
+
+# Value of a missing field in a record, it is never a valid value of the field
+NA_SENTINELS = {name: np.iinfo(RECORD_DTYPE[name]).min for name in Flight._fields if name != "tailnum"}
+
+class FlightBatch:
+    """Flights stored by columns: one NumPy array per Flight field.
+
+    Missing values are given by boolean masks in the na dictionnary, the value stored
+    under a mask is meaningless. Fields without mask never miss.
+
+    A batch is pickled as records of RECORD_DTYPE (21 bytes per flight) and the dictionary of
+    its tail numbers, so that sending it to a process or persisting it in Spark stays small.
+    """
+    __slots__ = Flight._fields + ("na",)
+
+    def __init__(self, columns, na=None):
+        """
+        Parameters
+        ----------
+        columns : dict
+                  Links every Flight field to an array of values.
+
+        na : dict
+             Links Flight fields to boolean arrays, True where the value is missing.
+        """
+        for name in Flight._fields:
+            setattr(self, name, columns[name])
+        self.na = na if na is not None else {}
+
+    def __len__(self):
+        return len(self.year)
+
+    def __getitem__(self, index):
+        """Select flights with a slice, an array of indices or a boolean array."""
+        columns = {name: getattr(self, name)[index] for name in Flight._fields}
+        na = {name: mask[index] for name, mask in self.na.items()}
+        return FlightBatch(columns, na)
+
+    def valid(self, name):
+        """Give the boolean array of the flights where the field is not missing."""
+        mask = self.na.get(name)
+        if mask is None:
+            return np.ones(len(self), dtype=np.bool_)
+        return ~mask
+
+    def __reduce__(self):
+        return (FlightBatch.from_records, self.to_records())
+
+    def to_records(self):
+        """Give the flights as records, missing values are replaced by NA_SENTINELS.
+
+        Return
+        ------
+        records : array of RECORD_DTYPE
+                  One record per flight, its tailnum is an index in dictionary.
+
+        dictionary : array of objects
+                     The distinct tail numbers.
+        """
+        records = np.empty(len(self), dtype=RECORD_DTYPE)
+        codes, dictionary = encode_tailnums(self.tailnum)
+        records["tailnum"] = codes
+        for name in NA_SENTINELS:
+            records[name] = getattr(self, name)
+            mask = self.na.get(name)
+            if mask is not None:
+                records[name][mask] = NA_SENTINELS[name]
+        return records, dictionary
+
+    @classmethod
+    def from_records(cls, records, dictionary):
+        """Build a FlightBatch from the records and dictionary given by to_records."""
+        columns = {"tailnum": dictionary[records["tailnum"]]}
+        na = {}
+        for name, sentinel in NA_SENTINELS.items():
+            values = records[name]
+            mask = values == sentinel
+            if mask.any():
+                na[name] = mask
+            columns[name] = values.astype(BATCH_DTYPES[name])
+        return cls(columns, na)
+
+    def rows(self):
+        """Iterate over the flights as Flight tuples, missing values are given as 'NA'."""
+        columns = []
+        for name in Flight._fields:
+            values = getattr(self, name).tolist()
+            mask = self.na.get(name)
+            if mask is not None and mask.any():
+                values = ['NA' if missing else value for value, missing in zip(values, mask.tolist())]
+            columns.append(values)
+        return map(Flight._make, zip(*columns))
+
+def batch_from_flights(flights):
+    """Build a FlightBatch from Flight tuples, 'NA' values are masked except for the tail number."""
+    flights = list(flights)
+    columns = {}
+    na = {}
+    for i, (name, dtype) in enumerate(BATCH_DTYPES.items()):
+        values = [flight[i] for flight in flights]
+        if name != "tailnum":
+            mask = np.fromiter((value == 'NA' for value in values), dtype=np.bool_, count=len(values))
+            if mask.any():
+                values = [0 if missing else value for value, missing in zip(values, mask.tolist())]
+                na[name] = mask
+        columns[name] = np.array(values, dtype=dtype)
+    codes, dictionary = encode_tailnums(columns["tailnum"])
+    columns["tailnum"] = dictionary[codes]
+    return FlightBatch(columns, na)
+
+def encode_tailnums(tailnums):
+    """Encode tail numbers as integers.
+
+    Return
+    ------
+    codes : array of int32
+            Index of every tail number in dictionary.
+
+    dictionary : array of objects
+                 The distinct tail numbers, in order of first appearance.
+    """
+    import pandas as pd
+    codes, dictionary = pd.factorize(np.asarray(tailnums, dtype=np.object_))
+    return codes.astype(np.int32), np.asarray(dictionary, dtype=np.object_)
+
+def _read_one_csv_batches(source, Plane, batch_size):
+    """Read a file which contains flights data by chunks and retrieve usefull information in FlightBatch.
+
+    Only the needed columns are parsed, the plane age is computed by joining the whole chunk on the plane registry.
+    The source is a path or a file object.
+    """
+    import pandas as pd
+    reader = pd.read_csv(
+        source,
+        usecols=CSV_COLUMNS,
+        dtype={"TailNum": str},
+        na_values={column: ["NA"] for column in CSV_COLUMNS if column != "TailNum"},
+        keep_default_na=False,
+        chunksize=batch_size,
+    )
+    for chunk in reader:
+        columns = {}
+        na = {}
+        for name, column in (
+            ("year", "Year"),
+            ("month", "Month"),
+            ("day_month", "DayofMonth"),
+            ("day_week", "DayOfWeek"),
+            ("hour", "CRSDepTime"),
+            ("ArrDelay", "ArrDelay"),
+            ("DepDelay", "DepDelay"),
+            ("cancelled", "Cancelled"),
+        ):
+            values = chunk[column]
+            mask = values.isna().to_numpy()
+            values = values.fillna(0).to_numpy()
+            if name == "hour":
+                # CRSDepTime is hhmm
+                values = values // 100
+            columns[name] = values.astype(BATCH_DTYPES[name])
+            if mask.any():
+                na[name] = mask
+        # Tail numbers are interned: equal ones are the same object, and the plane registry is joined on the distinct ones
+        codes, dictionary = encode_tailnums(chunk["TailNum"].to_numpy(dtype=np.object_))
+        columns["tailnum"] = dictionary[codes]
+        plane_year, known = Plane.lookup(dictionary)
+        columns["plane_age"] = (columns["year"] - plane_year[codes]).astype(BATCH_DTYPES["plane_age"])
+        unknown_age = ~known[codes]
+        if "year" in na:
+            unknown_age |= na["year"]
+        if unknown_age.any():
+            na["plane_age"] = unknown_age
+        yield FlightBatch(columns, na)
+
+def read_csvs_batches(fnames, batch_size=100000, limit=None, Plane=None, use_cache=True, cache_dir=None,
+                      processes=None, ordered=True, split_size=64*2**20, max_pending=None):
+    """Read files which contain flights data and retrieve FlightBatch of at most batch_size flights.
+
+    Parameters
+    ----------
+    fnames : iterable
+             Paths of the flights files.
+
+    batch_size : integer
+                 Maximum number of flights of a batch.
+
+    limit : integer
+            Maximum number of flights to read.
+
+    Plane : PlaneRegistry or dict
+            Links tail numbers to delivery years. The shared registry is used if not given.
+
+    use_cache : boolean
+                Read the columnar cache of a file instead of the file when the cache is fresh.
+
+    cache_dir : string
+                Directory of the columnar caches, see build_cache.
+
+    processes : integer
+                Number of worker processes which parse the files, the files are parsed by the calling process if not given.
+
+    ordered : boolean
+              Keep the order of the files and of the rows in the files, only used with worker processes.
+
+    split_size : integer
+                 Size in bytes of the parts of a file parsed by one worker process.
+
+    max_pending : integer
+                  Maximum number of parts parsed or waiting to be consumed at once, twice
+                  the number of processes if not given. It bounds the memory used by the workers results.
+    """
+    if Plane is None:
+        Plane = get_plane_registry()
+    elif not isinstance(Plane, PlaneRegistry):
+        Plane = PlaneRegistry(Plane)
+    if processes is not None and processes > 1:
+        if max_pending is None:
+            max_pending = 2 * processes
+        gen = _read_parallel(fnames, Plane, batch_size, use_cache, cache_dir, processes, ordered, split_size, max_pending)
+    else:
+        gen = itertools.chain.from_iterable(_read_one_file_batches(fname, Plane, batch_size, use_cache, cache_dir) for fname in fnames)
+    if metrics.ENABLED:
+        gen = _measured_batches(gen, "read_csvs_batches")
+    if limit is None:
+        return gen
+    return _limit_batches(gen, limit)
+
+def _read_one_file_batches(filename, Plane, batch_size, use_cache, cache_dir):
+    """Read the FlightBatch of a flights file from its columnar cache if it is fresh, from the file if not."""
+    if use_cache and is_cache_fresh(filename, cache_dir):
+        if metrics.ENABLED:
+            metrics.count("bytes_read", _cache_size(filename, cache_dir), source="cache")
+        return _read_cache_batches(filename, Plane, batch_size, cache_dir)
+    if metrics.ENABLED:
+        metrics.count("bytes_read", os.path.getsize(filename), source="csv")
+    return _read_one_csv_batches(filename, Plane, batch_size)
+
+def batch_counts(batch):
+    """Give the number of flights of a FlightBatch and the number of missing values of every field.
+
+    Return
+    ------
+    rows : integer
+           Number of flights.
+
+    na : dict
+         Links the fields with missing values to their number.
+    """
+    return len(batch), {name: int(np.count_nonzero(mask)) for name, mask in batch.na.items()}
+
+def _measured_batches(batches, stage):
+    """Count the flights and the missing values of a stream of FlightBatch, and the time spent to produce them.
+
+    The CPU time is the one of the calling process, worker processes are not included.
+    """
+    wall = cpu = 0.0
+    try:
+        batches = iter(batches)
+        while True:
+            start_wall, start_cpu = time.perf_counter(), time.process_time()
+            batch = next(batches, None)
+            wall += time.perf_counter() - start_wall
+            cpu += time.process_time() - start_cpu
+            if batch is None:
+                return
+            rows, na = batch_counts(batch)
+            metrics.count("rows_read", rows)
+            for name, count in na.items():
+                metrics.count("na_values", count, field=name)
+            yield batch
+    finally:
+        metrics.REGISTRY.add_stage(stage, wall, cpu)
+
+def _limit_batches(batches, limit):
+    """Stop a stream of FlightBatch after limit flights."""
+    for batch in batches:
+        if limit <= 0:
+            return
+        if len(batch) > limit:
+            batch = batch[:limit]
+        limit -= len(batch)
+        yield batch
+
+def _read_one_csv(filename, Plane=None):
+    """Read a file which contains flights data and retrieve usefull information in a Flight tuple.
+
+    Parameters
+    ----------
+    filename : string
+               Path of the flights file.
+
+    Plane : PlaneRegistry or dict
+            Links tail numbers to delivery years. The shared registry is used if not given.
+    """
+    for batch in read_csvs_batches([filename], Plane=Plane):
+        yield from batch.rows()
+
+def read_csvs(fnames, limit=None, Plane=None, use_cache=True, cache_dir=None, processes=None, ordered=True):
     """
     @author jbl
     """
-    gen = itertools.chain(*[_read_one_csv(fname) for fname in fnames])
+    batches = read_csvs_batches(fnames, Plane=Plane, use_cache=use_cache, cache_dir=cache_dir, processes=processes, ordered=ordered)
+    gen = itertools.chain.from_iterable(batch.rows() for batch in batches)
     if limit is None:
         return gen
     return limiteur(gen, limit)
 
-def read_plane_data(filename="/project_data/plane-data.csv"):
+#
+# Columnar cache of the flights files
+#
+# A cache is a directory which contains one .npy file per column of fixed-width integers,
+# the NA bitmaps of the columns with missing values, the tail numbers encoded as indices in
+# a dictionary, and a meta.json file which describes the source file the cache comes from.
+# The plane age is not stored, it is computed when reading so the cache does not depend on the plane data.
+#
+CACHE_VERSION = 1
+
+# Fields of a Flight stored as integer columns in the cache
+CACHE_COLUMNS = ("year", "month", "day_month", "day_week", "hour", "ArrDelay", "DepDelay", "cancelled")
+
+def cache_path(filename, cache_dir=None):
+    """Give the directory of the columnar cache of a flights file.
+
+    The cache is stored next to the file unless cache_dir is given.
+    """
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(filename))
+    return os.path.join(cache_dir, os.path.basename(filename) + ".cols")
+
+def _source_stat(filename):
+    stat = os.stat(filename)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+def _read_cache_meta(filename, cache_dir=None):
+    try:
+        with open(os.path.join(cache_path(filename, cache_dir), "meta.json")) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def _cache_size(filename, cache_dir=None):
+    """Size in bytes of the files of the columnar cache of a flights file."""
+    path = cache_path(filename, cache_dir)
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+def is_cache_fresh(filename, cache_dir=None):
+    """Tell if the columnar cache of a flights file exists and was built from the current version of the file."""
+    meta = _read_cache_meta(filename, cache_dir)
+    return (
+        meta is not None
+        and meta["version"] == CACHE_VERSION
+        and meta["source"] == _source_stat(filename)
+    )
+
+def build_cache(filename, cache_dir=None, batch_size=1000000):
+    """Convert a flights file into its columnar cache.
+
+    Parameters
+    ----------
+    filename : string
+               Path of the flights file.
+
+    cache_dir : string
+                Directory where the cache is written, next to the file if not given.
+
+    batch_size : integer
+                 Number of rows parsed at once.
+    """
+    source = _source_stat(filename)
+    batches = list(_read_one_csv_batches(filename, PlaneRegistry({}), batch_size))
+    columns = {}
+    na = {}
+    for name in CACHE_COLUMNS:
+        columns[name] = np.concatenate([getattr(batch, name) for batch in batches]) if batches else np.zeros(0, dtype=BATCH_DTYPES[name])
+        if any(name in batch.na for batch in batches):
+            na[name] = np.concatenate([batch.na[name] if name in batch.na else np.zeros(len(batch), dtype=np.bool_) for batch in batches])
+    tailnums = np.concatenate([batch.tailnum for batch in batches]) if batches else np.zeros(0, dtype=np.object_)
+    del batches
+    codes, dictionary = encode_tailnums(tailnums)
+    del tailnums
+
+    path = cache_path(filename, cache_dir)
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=".tmp-", dir=parent)
+    try:
+        for name, values in columns.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), values)
+        for name, mask in na.items():
+            np.save(os.path.join(tmp, f"na-{name}.npy"), np.packbits(mask))
+        np.save(os.path.join(tmp, "tailnum-codes.npy"), codes.astype(np.int32))
+        np.save(os.path.join(tmp, "tailnum-dictionary.npy"), np.asarray(dictionary, dtype=str))
+        with open(os.path.join(tmp, "meta.json"), "w") as f:
+            json.dump({"version": CACHE_VERSION, "source": source, "rows": len(codes), "na": sorted(na)}, f)
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.replace(tmp, path)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return path
+
+def build_caches(fnames, cache_dir=None):
+    """Convert flights files into columnar caches, files with a fresh cache are skipped."""
+    for fname in fnames:
+        if not is_cache_fresh(fname, cache_dir):
+            build_cache(fname, cache_dir)
+
+def _read_cache_batches(filename, Plane, batch_size, cache_dir=None):
+    """Read the columnar cache of a flights file by FlightBatch.
+
+    Columns are memory-mapped, integer columns of the batches are views on the mapped files.
+    """
+    path = cache_path(filename, cache_dir)
+    meta = _read_cache_meta(filename, cache_dir)
+    load = lambda name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+    columns = {name: load(name) for name in CACHE_COLUMNS}
+    na = {name: load(f"na-{name}") for name in meta["na"]}
+    codes = load("tailnum-codes")
+    dictionary = np.load(os.path.join(path, "tailnum-dictionary.npy"))
+    # The plane registry is joined once on the dictionary instead of on every flight
+    plane_year, known = Plane.lookup(dictionary)
+    dictionary = dictionary.astype(np.object_)
+    rows = meta["rows"]
+    for start in range(0, rows, batch_size):
+        stop = min(start + batch_size, rows)
+        batch_columns = {name: values[start:stop] for name, values in columns.items()}
+        batch_na = {}
+        for name, bits in na.items():
+            mask = np.unpackbits(bits[start // 8:(stop + 7) // 8])[start % 8:start % 8 + stop - start].astype(np.bool_)
+            if mask.any():
+                batch_na[name] = mask
+        batch_codes = codes[start:stop]
+        batch_columns["tailnum"] = dictionary[batch_codes]
+        batch_columns["plane_age"] = (batch_columns["year"] - plane_year[batch_codes]).astype(BATCH_DTYPES["plane_age"])
+        unknown_age = ~known[batch_codes]
+        if "year" in batch_na:
+            unknown_age |= batch_na["year"]
+        if unknown_age.any():
+            batch_na["plane_age"] = unknown_age
+        yield FlightBatch(batch_columns, batch_na)
+
+#
+# Parallel reading of the flights files
+#
+def file_splits(filename, split_size, start=None, stop=None):
+    """Cut a flights file into byte ranges of about split_size bytes which start and end on a line boundary.
+
+    Parameters
+    ----------
+    start, stop : integer
+                  Part of the file to cut, on line boundaries. The whole file after the header if not given.
+
+    Return
+    ------
+    splits : list
+             (filename, start, stop) tuples, the header line is never part of a range.
+    """
+    with open(filename, "rb") as f:
+        f.readline()
+        size = os.fstat(f.fileno()).st_size if stop is None else stop
+        starts = [f.tell() if start is None else max(start, f.tell())]
+        if start is not None and starts[0] >= size:
+            return []
+        while starts[-1] + split_size < size:
+            f.seek(starts[-1] + split_size)
+            f.readline()
+            if f.tell() >= size:
+                break
+            starts.append(f.tell())
+    return [(filename, start, stop) for start, stop in zip(starts, starts[1:] + [size])]
+
+#
+# Files already processed by an incremental pipeline
+#
+class Manifest:
+    """Byte offset up to which every flights file was processed.
+
+    Monthly extracts arrive as new files, or as lines appended to a file: only the lines after
+    the offset are processed by the next run. Lines are processed once they are complete.
+    """
+    def __init__(self, files=None):
+        """
+        Parameters
+        ----------
+        files : dict
+                Links absolute paths of the files to their processed offset.
+        """
+        self.files = dict(files or {})
+
+    @classmethod
+    def load(cls, path):
+        """Read a manifest written by save, an empty manifest if the file does not exist."""
+        if not os.path.exists(path):
+            return cls()
+        with open(path) as f:
+            return cls(json.load(f)["files"])
+
+    def save(self, path):
+        """Write the manifest in a JSON file, the previous file is replaced at once."""
+        parent = os.path.dirname(os.path.abspath(path))
+        os.makedirs(parent, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=parent)
+        with os.fdopen(fd, "w") as f:
+            json.dump({"files": self.files}, f, indent=1, sort_keys=True)
+        os.replace(tmp, path)
+
+    def new_splits(self, fnames, split_size):
+        """Cut the complete lines of the files which are not processed yet into byte ranges, see file_splits.
+
+        A file smaller than its processed offset was replaced, it is skipped with an exception message.
+        """
+        splits = []
+        for fname in fnames:
+            offset = self.files.get(os.path.abspath(fname))
+            stop = _complete_size(fname)
+            if offset is not None and stop < offset:
+                print(f"Exception : {fname} is smaller than when it was processed, it is skipped")
+                continue
+            splits.extend(file_splits(fname, split_size, 0 if offset is None else offset, stop))
+        return splits
+
+    def mark(self, filename, stop):
+        """Record that a file is processed up to the byte stop."""
+        filename = os.path.abspath(filename)
+        self.files[filename] = max(stop, self.files.get(filename, 0))
+
+def _complete_size(filename, block_size=2**16):
+    """Give the size of a file without its last line if this line does not end with a newline."""
+    with open(filename, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        stop = size
+        while stop > 0:
+            start = max(0, stop - block_size)
+            f.seek(start)
+            end = f.read(stop - start).rfind(b"\n")
+            if end >= 0:
+                return start + end + 1
+            stop = start
+    return 0
+
+# Plane registry of a worker process, sent once by _init_worker
+_WORKER_PLANE = None
+
+def _init_worker(Plane):
+    global _WORKER_PLANE
+    _WORKER_PLANE = Plane
+
+def _read_split(filename, start, stop, batch_size):
+    """Parse a byte range of a flights file in a worker process."""
+    return list(_split_batches(filename, start, stop, _WORKER_PLANE, batch_size))
+
+def _split_batches(filename, start, stop, Plane, batch_size):
+    """Parse a byte range of a flights file by FlightBatch, only the range is held in memory."""
+    with open(filename, "rb") as f:
+        header = f.readline()
+        f.seek(start)
+        data = f.read(stop - start)
+    if not data.strip():
+        return iter(())
+    return _read_one_csv_batches(io.BytesIO(header + data), Plane, batch_size)
+
+def _read_parallel(fnames, Plane, batch_size, use_cache, cache_dir, processes, ordered, split_size, max_pending):
+    """Read flights files with a pool of worker processes, each one parses a byte range of a file.
+
+    Files with a fresh columnar cache are memory-mapped by the calling process instead.
+    """
+    units = []
+    for fname in fnames:
+        if use_cache and is_cache_fresh(fname, cache_dir):
+            units.append((fname, None, None))
+        else:
+            units.extend(file_splits(fname, split_size))
+    units = iter(units)
+    pool = concurrent.futures.ProcessPoolExecutor(processes, initializer=_init_worker, initargs=(Plane,))
+    try:
+        pending = collections.deque()
+        while True:
+            for filename, start, stop in units:
+                if metrics.ENABLED:
+                    size = _cache_size(filename, cache_dir) if start is None else stop - start
+                    metrics.count("bytes_read", size, source="cache" if start is None else "csv")
+                if start is None and not ordered:
+                    yield from _read_cache_batches(filename, Plane, batch_size, cache_dir)
+                elif start is None:
+                    pending.append(filename)
+                else:
+                    pending.append(pool.submit(_read_split, filename, start, stop, batch_size))
+                if len(pending) >= max_pending:
+                    break
+            if not pending:
+                return
+            if ordered:
+                done = pending.popleft()
+            else:
+                concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                done = next(future for future in pending if future.done())
+                pending.remove(done)
+            if isinstance(done, str):
+                yield from _read_cache_batches(done, Plane, batch_size, cache_dir)
+            else:
+                yield from done.result()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+def read_plane_data(filename=PLANE_DATA):
     """Read the plane data file and retrieve a dictionnary which links the tail number and the delivery year of the plane."""
     Plane = dict()
     with open(filename) as f:
@@ -51,3 +675,76 @@ def read_plane_data(filename="/project_data/plane-data.csv"):
             if row["year"] is not None and row["year"] != 'None':
                 Plane[tailnum] = int(row["year"])
     return Plane
+
+class PlaneRegistry:
+    """Compact and read-only index which links the tail number and the delivery year of the plane.
+
+    Tail numbers are kept sorted so that a lookup is a binary search. The object is small
+    and picklable, it can be broadcast once to Spark executors.
+    """
+    __slots__ = ("tailnums", "years", "_keys", "_values")
+
+    def __init__(self, Plane):
+        """
+        Parameters
+        ----------
+        Plane : dict
+                Links the tail number and the delivery year of the plane, as returned by read_plane_data.
+        """
+        tailnums = sorted(Plane)
+        self.tailnums = tuple(tailnums)
+        self.years = array.array("h", (Plane[tailnum] for tailnum in tailnums))
+        self._keys = None
+        self._values = None
+
+    def _index(self, tailnum):
+        i = bisect.bisect_left(self.tailnums, tailnum)
+        if i != len(self.tailnums) and self.tailnums[i] == tailnum:
+            return i
+        return -1
+
+    def get(self, tailnum, default=None):
+        """Give the delivery year of the plane or default if the tail number is unknown."""
+        i = self._index(tailnum)
+        return self.years[i] if i >= 0 else default
+
+    def __getitem__(self, tailnum):
+        i = self._index(tailnum)
+        if i < 0:
+            raise KeyError(tailnum)
+        return self.years[i]
+
+    def lookup(self, tailnums):
+        """Give the delivery years of an array of tail numbers and the boolean array of the known ones."""
+        if self._keys is None:
+            self._keys = np.array(self.tailnums, dtype=str)
+            self._values = np.frombuffer(self.years, dtype=np.int16)
+        tailnums = np.asarray(tailnums, dtype=str)
+        if not len(self._keys):
+            return np.zeros(len(tailnums), dtype=np.int16), np.zeros(len(tailnums), dtype=np.bool_)
+        i = np.searchsorted(self._keys, tailnums)
+        i[i == len(self._keys)] = 0
+        known = self._keys[i] == tailnums
+        return np.where(known, self._values[i], 0), known
+
+    def __contains__(self, tailnum):
+        return self._index(tailnum) >= 0
+
+    def __len__(self):
+        return len(self.tailnums)
+
+# filename -> (mtime, PlaneRegistry)
+_PLANE_REGISTRIES = {}
+
+def get_plane_registry(filename=PLANE_DATA):
+    """Give the process-wide plane registry of a plane data file.
+
+    The file is read once, the registry is rebuilt only when the modification time of the file changes.
+    """
+    mtime = os.stat(filename).st_mtime_ns
+    cached = _PLANE_REGISTRIES.get(filename)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+    registry = PlaneRegistry(read_plane_data(filename))
+    _PLANE_REGISTRIES[filename] = (mtime, registry)
+    return registry
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+
+class Bins:
+    """Assign flights to groups given by bounds on one field.
+
+    A flight is in group i if bounds[i-1] < value <= bounds[i], there are len(bounds)+1 groups.
+    """
+    def __init__(self, field, bounds):
+        """
+        Parameters
+        ----------
+        field : string
+                Flight field to group on.
+
+        bounds : array-like
+                 Sorted upper bounds of the groups, the last group has no upper bound.
+        """
+        self.field = field
+        self.bounds = np.asarray(bounds)
+        self.nb_groups = len(self.bounds) + 1
+
+    def groups(self, batch):
+        """Give the group of every flight of a FlightBatch."""
+        return np.searchsorted(self.bounds, getattr(batch, self.field), side="left")
+
+class YearBins:
+    """Assign flights to groups given by bounds on one field which depend on the year of the flight.
+
+    Bounds are compiled into an array indexed by year so that a batch is grouped without lookup per flight.
+    """
+    def __init__(self, field, bounds):
+        """
+        Parameters
+        ----------
+        field : string
+                Flight field to group on.
+
+        bounds : dict
+                 Links every year to the sorted upper bounds of its groups, all years have the same number of bounds.
+        """
+        self.field = field
+        years = sorted(bounds)
+        self.first_year = years[0] if years else 0
+        nb_bounds = len(bounds[years[0]]) if years else 0
+        self.nb_groups = nb_bounds + 1
+        # Years without bounds put every flight in the last group
+        self.bounds = np.full((years[-1] - self.first_year + 1 if years else 0, nb_bounds), -np.inf)
+        for year in years:
+            self.bounds[year - self.first_year] = bounds[year]
+
+    @classmethod
+    def over_mean(cls, field, avg):
+        """Build the grouping of flights under or equal (0) and over (1) the mean of a year.
+
+        Parameters
+        ----------
+        avg : array-like (nb_year, 2)
+              Contains the mean of the field for different years, as given by avg_age_plane_year.
+        """
+        return cls(field, {int(row[0]): [row[1]] for row in avg})
+
+    @classmethod
+    def quantiles(cls, field, values, q):
+        """Build the grouping of flights between quantiles of a year.
+
+        Parameters
+        ----------
+        values : dict
+                 Links every year to the values the quantiles are computed from.
+
+        q : array-like
+            Quantiles between 0 and 1 which bound the groups.
+        """
+        return cls(field, {year: np.quantile(year_values, q) for year, year_values in values.items()})
+
+    def groups(self, batch):
+        """Give the group of every flight of a FlightBatch."""
+        values = getattr(batch, self.field)
+        rows = batch.year.astype(np.int64) - self.first_year
+        known = (rows >= 0) & (rows < len(self.bounds))
+        groups = np.full(len(values), self.nb_groups - 1)
+        bounds = self.bounds[rows[known]]
+        groups[known] = (values[known, np.newaxis] > bounds).sum(axis=1)
+        return groups
+
+# Age categories of the planes: 0-5, 5-10, 10-15, 15-20, 20-25 and over 25 years
+AGE_GROUPS = Bins("plane_age", (5, 10, 15, 20, 25))
@@ -0,0 +1,237 @@
+# -*- coding: utf-8 -*-
+"""Opt-in instrumentation of the pipeline: counters, latency histograms and stage wall and CPU times.
+
+Nothing is recorded until enable is called, or the FLIGHTS_METRICS environment variable is set to
+"json:PATH" or "prometheus:PATH". Hooks check ENABLED first so that they cost one test when disabled.
+The metrics are exported as JSON or Prometheus text at the end of the run.
+"""
+
+import os
+import json
+import time
+import atexit
+import bisect
+import functools
+import threading
+
+ENABLED = False
+
+# Upper bounds in seconds of the buckets of the latency histograms
+LATENCY_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, float("inf"))
+
+class Histogram:
+    """Count of observations per bucket, with their sum."""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q):
+        """Upper bound of the bucket of the quantile q."""
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return self.buckets[-1]
+
+class Metrics:
+    """Registry of the metrics of a process. Metrics are identified by a name and labels."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            # (name, labels) -> value
+            self.counters = {}
+            # (name, labels) -> Histogram
+            self.histograms = {}
+            # stage -> [calls, wall seconds, CPU seconds]
+            self.stages = {}
+            # Functions called at every export which give (name, value, labels) of counters computed
+            # elsewhere, Spark accumulators for instance. Their values are added to the counters.
+            self.collectors = []
+
+    def count(self, name, value=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def add_stage(self, stage, wall, cpu):
+        with self._lock:
+            times = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            times[0] += 1
+            times[1] += wall
+            times[2] += cpu
+
+    def _counters(self):
+        """Give the counters with the values of the collectors added."""
+        counters = dict(self.counters)
+        for collector in self.collectors:
+            for name, value, labels in collector():
+                key = (name, tuple(sorted(labels.items())))
+                counters[key] = counters.get(key, 0) + value
+        return counters
+
+    def to_dict(self):
+        """Give the metrics as a dictionary which can be written in JSON."""
+        labelled = lambda name, labels: {"name": name, "labels": dict(labels)}
+        with self._lock:
+            return {
+                "counters": [dict(labelled(*key), value=value) for key, value in sorted(self._counters().items())],
+                "histograms": [
+                    dict(
+                        labelled(*key),
+                        count=histogram.count,
+                        sum=histogram.sum,
+                        buckets=dict(zip(map(str, histogram.buckets), histogram.counts)),
+                        p50=histogram.quantile(0.5),
+                        p99=histogram.quantile(0.99),
+                    )
+                    for key, histogram in sorted(self.histograms.items())
+                ],
+                "stages": [
+                    {"stage": stage, "calls": calls, "wall_seconds": wall, "cpu_seconds": cpu}
+                    for stage, (calls, wall, cpu) in sorted(self.stages.items())
+                ],
+            }
+
+    def to_prometheus(self):
+        """Give the metrics in the text format of Prometheus, names are prefixed with flights_."""
+        def labels_text(labels, **extra):
+            labels = dict(labels, **extra)
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{label}="{value}"' for label, value in sorted(labels.items())) + "}"
+        lines = []
+        with self._lock:
+            counters = self._counters()
+            for name in sorted({name for name, labels in counters}):
+                lines.append(f"# TYPE flights_{name} counter")
+                for (other, labels), value in sorted(counters.items()):
+                    if other == name:
+                        lines.append(f"flights_{name}{labels_text(labels)} {value}")
+            for name in sorted({name for name, labels in self.histograms}):
+                lines.append(f"# TYPE flights_{name} histogram")
+                for (other, labels), histogram in sorted(self.histograms.items()):
+                    if other != name:
+                        continue
+                    cumulated = 0
+                    for bound, count in zip(histogram.buckets, histogram.counts):
+                        cumulated += count
+                        le = "+Inf" if bound == float("inf") else repr(bound)
+                        lines.append(f"flights_{name}_bucket{labels_text(labels, le=le)} {cumulated}")
+                    lines.append(f"flights_{name}_sum{labels_text(labels)} {histogram.sum}")
+                    lines.append(f"flights_{name}_count{labels_text(labels)} {histogram.count}")
+            for metric, column in (("stage_calls", 0), ("stage_wall_seconds", 1), ("stage_cpu_seconds", 2)):
+                if self.stages:
+                    lines.append(f"# TYPE flights_{metric} counter")
+                for stage, times in sorted(self.stages.items()):
+                    lines.append(f'flights_{metric}{{stage="{stage}"}} {times[column]}')
+        return "\n".join(lines) + "\n"
+
+    def export(self, path, output_format="json"):
+        """Write the metrics in a file, output_format is "json" or "prometheus"."""
+        text = json.dumps(self.to_dict(), indent=1) if output_format == "json" else self.to_prometheus()
+        with open(path, "w") as f:
+            f.write(text)
+
+REGISTRY = Metrics()
+
+def enable(path=None, output_format="json"):
+    """Start recording metrics.
+
+    Parameters
+    ----------
+    path : string
+           File where the metrics are exported when the process exits, no export if not given.
+
+    output_format : string
+                    "json" or "prometheus".
+    """
+    global ENABLED
+    ENABLED = True
+    if path is not None:
+        atexit.register(REGISTRY.export, path, output_format)
+
+def disable():
+    global ENABLED
+    ENABLED = False
+
+#
+# Hooks
+#
+def count(name, value=1, **labels):
+    """Add value to a counter."""
+    if ENABLED:
+        REGISTRY.count(name, value, **labels)
+
+def observe(name, value, **labels):
+    """Add an observation, a latency in seconds for instance, to a histogram."""
+    if ENABLED:
+        REGISTRY.observe(name, value, **labels)
+
+class _Stage:
+    __slots__ = ("stage", "wall", "cpu")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        REGISTRY.add_stage(self.stage, time.perf_counter() - self.wall, time.process_time() - self.cpu)
+
+class _NoStage:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+_NO_STAGE = _NoStage()
+
+def stage(name):
+    """Context manager which adds its wall and CPU time to a stage."""
+    return _Stage(name) if ENABLED else _NO_STAGE
+
+def timed(name):
+    """Decorator which adds the wall and CPU time of every call of a function to a stage.
+
+    The time of a generator function is the time of its creation, not of its iteration.
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not ENABLED:
+                return function(*args, **kwargs)
+            with _Stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# Opt-in from the environment: FLIGHTS_METRICS=json:metrics.json or FLIGHTS_METRICS=prometheus:metrics.prom
+if os.environ.get("FLIGHTS_METRICS"):
+    _output_format, _, _path = os.environ["FLIGHTS_METRICS"].partition(":")
+    enable(_path or None, _output_format)
@@ -0,0 +1,123 @@
+# -*- coding: utf-8 -*-
+"""Render the charts of the analyses into image files, headless and in parallel.
+
+A chart is drawn on its own matplotlib Figure with the Agg backend, outside of the pyplot state,
+and the figure is freed once saved. Charts are independent: they are rendered by a pool of worker
+processes. The hash of the inputs of every rendered chart is kept next to the images, a chart
+whose inputs did not change is not rendered again.
+"""
+
+import os
+import json
+import pickle
+import hashlib
+import tempfile
+import collections
+import concurrent.futures
+
+import metrics
+
+# Change it when the drawing of the charts changes, so that every chart is rendered again
+REPORT_VERSION = 1
+
+# File of the hashes of the rendered charts, in the directory of the images
+HASHES = ".report-hashes.json"
+
+# An image to render: draw(figure, *args) draws it on an empty figure of figsize inches.
+# draw must be a function of a module, so that worker processes can receive it.
+Chart = collections.namedtuple("Chart", ("filename", "draw", "args", "figsize"))
+
+def chart_hash(chart):
+    """Give the hash of the inputs of a chart: the drawing function, its arguments and the figure size."""
+    content = (REPORT_VERSION, chart.draw.__module__, chart.draw.__qualname__, chart.args, chart.figsize)
+    return hashlib.sha256(pickle.dumps(content, protocol=4)).hexdigest()
+
+def _render_one(chart, directory):
+    """Draw a chart on a new figure with the Agg backend and save it."""
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figure = Figure(figsize=chart.figsize)
+    FigureCanvasAgg(figure)
+    try:
+        chart.draw(figure, *chart.args)
+        figure.savefig(os.path.join(directory, chart.filename))
+    finally:
+        figure.clear()
+    return chart.filename
+
+def _read_hashes(directory):
+    path = os.path.join(directory, HASHES)
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+def _write_hashes(directory, hashes):
+    """Write the hashes of the charts, the previous file is replaced at once."""
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=directory)
+    with os.fdopen(fd, "w") as f:
+        json.dump(hashes, f, indent=1, sort_keys=True)
+    os.replace(tmp, os.path.join(directory, HASHES))
+
+def _collect(results, hashes):
+    """Wait for the rendering of charts and record the hashes of the charts rendered.
+
+    results gives (chart, hash, result) tuples, result() gives the file name or raises the exception of the rendering.
+    """
+    rendered = []
+    for chart, digest, result in results:
+        try:
+            rendered.append(result())
+        except Exception as exception:
+            print(f"Exception : {chart.filename} not rendered, {exception!r}")
+            continue
+        hashes[chart.filename] = digest
+    return rendered
+
+@metrics.timed("render")
+def render(charts, directory=".", processes=None, force=False):
+    """Render charts into image files, skipping those whose inputs did not change.
+
+    Parameters
+    ----------
+    charts : iterable
+             Chart to render, their file names must be distinct.
+
+    directory : string
+                Directory of the images, created if needed.
+
+    processes : integer
+                Number of worker processes, one per chart to render up to the number of processors if
+                not given. Charts are rendered by the calling process when it is 1.
+
+    force : boolean
+            Render every chart, even the ones whose image is up to date.
+
+    Return
+    ------
+    rendered : list
+               File names of the charts rendered, the skipped ones are not included.
+    """
+    os.makedirs(directory, exist_ok=True)
+    hashes = _read_hashes(directory)
+    todo = []
+    for chart in charts:
+        digest = chart_hash(chart)
+        if not force and hashes.get(chart.filename) == digest and os.path.exists(os.path.join(directory, chart.filename)):
+            metrics.count("charts_skipped")
+            continue
+        todo.append((chart, digest))
+    if processes is None:
+        processes = min(len(todo), os.cpu_count() or 1)
+    if processes <= 1:
+        results = ((chart, digest, lambda chart=chart: _render_one(chart, directory)) for chart, digest in todo)
+        rendered = _collect(results, hashes)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(processes) as pool:
+            futures = {pool.submit(_render_one, chart, directory): (chart, digest) for chart, digest in todo}
+            results = (futures[future] + (future.result,) for future in concurrent.futures.as_completed(futures))
+            rendered = _collect(results, hashes)
+    metrics.count("charts_rendered", len(rendered))
+    if rendered:
+        _write_hashes(directory, hashes)
+    return rendered
@@ -1,40 +1,132 @@
 # -*- coding: utf-8 -*-
 
+import os
+import re
+import glob
+import json
+import tempfile
 import itertools
-import datetime
-import textwrap
+import concurrent.futures
 
 import numpy as np
-import pandas as pd
-import matplotlib.pyplot as plt
 
-from get_rdd import get_RDD_from_flight_data, read_csvs
+import pyspark
+
+import metrics
+from get_rdd import get_RDD_from_flight_data, get_RDD_from_splits, PARTITION_BYTES
+from flight_data import FlightBatch, Manifest, batch_from_flights, get_plane_registry
+from accumulators import Moments, Quantiles
+from grouping import AGE_GROUPS, YearBins
+from analyses import (
+    QUANTILES, SKETCH_K, ANALYSES, clean_mask, _group_moments, _group_quantiles, _comp_mean_std,
+    _delay_dataframes, _quantile_dataframes, _scan_batches, _merge_partials, _analyses_of_partials,
+    charts_one_year, charts_delay_over_avg_one_year,
+)
+from report import render
 
 #
 # Average delay per group of age per year
 #
-def age_group(flight):
-    """Give the age category."""
-    if flight.plane_age <= 5:
-        return 0
-    if flight.plane_age <= 10:
-        return 1
-    if flight.plane_age <= 15:
-        return 2
-    if flight.plane_age <= 20:
-        return 3
-    if flight.plane_age <= 25:
-        return 4
-    return 5
-
-def _comp_mean_std(data):
-    """Compute mean and standard deviation."""
-    key, (sum_1, sum_ArrDelay, sum_DepDelay, sum_ArrDelay_2, sum_DepDelay_2) = data
-    mean_ArrDelay = sum_ArrDelay/sum_1
-    mean_DepDelay = sum_DepDelay/sum_1
-    std_ArrDelay = np.sqrt(sum_ArrDelay_2/sum_1 - mean_ArrDelay**2)
-    std_DepDelay = np.sqrt(sum_DepDelay_2/sum_1 - mean_DepDelay**2)
-    return key, (mean_ArrDelay, std_ArrDelay, mean_DepDelay, std_DepDelay, sum_1)
+def compact_RDD(D, batch_size=100000, persist=True):
+    """Clean a RDD of flights and store every partition as FlightBatch.
+
+    Parameters
+    ----------
+    D : Spark RDD
+        The flights, as Flight tuples or as FlightBatch (see get_RDD_from_flight_data). A compact RDD
+        can be given again, its batches are already clean and are kept as is.
+
+    batch_size : integer
+                 Maximum number of flights of a batch.
+
+    persist : boolean
+              Persist the compact RDD for the next scans.
+    """
+    D = D.mapPartitions(lambda flights: _clean_batches(flights, batch_size))
+    if persist:
+        D = D.persist(pyspark.StorageLevel.MEMORY_AND_DISK)
+    return D
+
+def _clean_batches(flights, batch_size):
+    """Give the clean FlightBatch of a partition of Flight tuples or of FlightBatch, see get_D_clean."""
+    flights = iter(flights)
+    first = next(flights, None)
+    if first is None:
+        return
+    flights = itertools.chain([first], flights)
+    if isinstance(first, FlightBatch):
+        for batch in flights:
+            mask = clean_mask(batch)
+            if mask.all():
+                yield batch
+            elif mask.any():
+                yield batch[mask]
+        return
+    flights = filter(_is_clean, flights)
+    while True:
+        batch = batch_from_flights(itertools.islice(flights, batch_size))
+        if not len(batch):
+            return
+        yield batch
+
+def _compact(D):
+    """Give the compact RDD of a RDD of flights, the batches of a compact RDD are kept as is."""
+    return compact_RDD(D, persist=False)
+
+@metrics.timed("delay_per_group")
+def delay_per_group(D, grouping):
+    """Compute mean and standard deviation of arrival and departure delay per group and year.
+
+    The grouping is broadcast once, every partition is grouped by batches and reduced into one
+    Moments, the few partial results are then merged with a tree aggregation.
+
+    Parameters
+    ----------
+    D : Spark RDD
+        The flights, as given by get_RDD_from_flight_data or compact_RDD.
+
+    grouping : object
+               Assign flights of a FlightBatch to groups, see grouping.Bins and grouping.YearBins.
+    """
+    D = _compact(D)
+    broadcast = D.context.broadcast(grouping)
+    moments = (
+        D.mapPartitions(lambda batches: [_group_moments(batches, broadcast.value)])
+        .treeAggregate(Moments(2), Moments.merge, Moments.merge)
+    )
+    broadcast.unpersist()
+    delay_group = [_comp_mean_std(data) for data in moments.items()]
+    return _delay_dataframes(delay_group, grouping.nb_groups)
+
+@metrics.timed("delay_quantiles_per_group")
+def delay_quantiles_per_group(D, grouping, q=QUANTILES, k=SKETCH_K):
+    """Compute approximate quantiles of arrival and departure delay per group and year.
+
+    Every partition is sketched in bounded memory (see accumulators.Quantiles), the sketches
+    are then merged with a tree aggregation, as delay_per_group does with the moments.
+
+    Parameters
+    ----------
+    D : Spark RDD
+        The flights, as given by get_RDD_from_flight_data or compact_RDD.
+
+    grouping : object
+               Assign flights of a FlightBatch to groups, see grouping.Bins and grouping.YearBins.
+
+    q : array-like
+        Quantiles between 0 and 1.
+
+    k : integer
+        Accuracy of the sketches, see accumulators.KLL: the rank error is about 1.7/k for at most about 3*k values kept per group.
+    """
+    D = _compact(D)
+    broadcast = D.context.broadcast(grouping)
+    sketches = (
+        D.mapPartitions(lambda batches: [_group_quantiles(batches, broadcast.value, k)])
+        .treeAggregate(Quantiles(2, k), Quantiles.merge, Quantiles.merge)
+    )
+    broadcast.unpersist()
+    return _quantile_dataframes(list(sketches.quantiles(q)), grouping.nb_groups, q)
 
 def get_D_clean(D, includeCancelledFlights=False):
     """Clean the RDD before using it for planes age analysis.
@@ -46,7 +138,12 @@ def get_D_clean(D, includeCancelledFlights=False):
     includeCancelledFlights : boolean
                               Precise if cancelled flights should be included or not.
     """
-    D = D.filter(lambda f: (
+    D = D.filter(lambda f: _is_clean(f, includeCancelledFlights))
+    return D
+
+def _is_clean(f, includeCancelledFlights=False):
+    """Tell if a flight is kept by get_D_clean."""
+    return (
         (f.cancelled and includeCancelledFlights) or (not f.cancelled)
         and f.year != 'NA'
         and f.month != 'NA'
@@ -54,47 +151,19 @@ def get_D_clean(D, includeCancelledFlights=False):
         and f.day_week != 'NA'
         and f.hour != 'NA'
         and f.plane_age != 'NA'
-        and ((f.cancelled == False and f.ArrDelay != 'NA' and f.DepDelay != 'NA') or f.cancelled == True))
+        and ((f.cancelled == False and f.ArrDelay != 'NA' and f.DepDelay != 'NA') or f.cancelled == True)
     )
-    return D
 
 def avg_delay_per_age_group(D):
     """Compute mean and standard deviation of arrival and departure delay for different age categories and years."""
-    D = get_D_clean(D)
-    delay_group = (
-        D.map(lambda f: ((age_group(f), f.year), np.array([1, f.ArrDelay, f.DepDelay, f.ArrDelay**2, f.DepDelay**2])))
-        .reduceByKey(lambda x, y: x + y)
-        .map(_comp_mean_std)
-        .collect()
-    )
+    return delay_per_group(D, AGE_GROUPS)
+
+def delay_quantiles_per_age_group(D, q=QUANTILES, k=SKETCH_K):
+    """Compute approximate quantiles of arrival and departure delay for different age categories and years."""
+    return delay_quantiles_per_group(D, AGE_GROUPS, q, k)
 
-    years = np.array([year for ((group, year), (mean_ArrDelay, std_ArrDelay, mean_DepDelay, std_DepDelay, count_group)) in delay_group])
-    years = np.unique(years)
-
-    dico_ArrDelay = {}
-    dico_DepDelay = {}
-    for year in years:
-        dico_ArrDelay[f"mean-{year}"] = np.zeros(6)
-        dico_DepDelay[f"mean-{year}"] = np.zeros(6)
-        dico_ArrDelay[f"count-{year}"] = np.zeros(6)
-        dico_DepDelay[f"count-{year}"] = np.zeros(6)
-        dico_ArrDelay[f"std-{year}"] = np.zeros(6)
-        dico_DepDelay[f"std-{year}"] = np.zeros(6)
-
-    df_ArrDelay = pd.DataFrame(data=dico_ArrDelay)
-    df_DepDelay = pd.DataFrame(data=dico_DepDelay)
-    for ((group, year), (mean_ArrDelay, std_ArrDelay, mean_DepDelay, std_DepDelay, count_group)) in delay_group:
-        df_ArrDelay.loc[group, f"mean-{year}"] = mean_ArrDelay
-        df_ArrDelay.loc[group, f"count-{year}"] = count_group
-        df_ArrDelay.loc[group, f"std-{year}"] = std_ArrDelay
-
-        df_DepDelay.loc[group, f"mean-{year}"] = mean_DepDelay
-        df_DepDelay.loc[group, f"count-{year}"] = count_group
-        df_DepDelay.loc[group, f"std-{year}"] = std_DepDelay
-
-    return df_ArrDelay, df_DepDelay
-
-def view_results_one_year(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay):
+@metrics.timed("view_results_one_year")
+def view_results_one_year(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, directory="."):
     """Save barplots which displays means and standard deviation of arrival and departure delays.
 
     Parameters
@@ -104,106 +173,30 @@ def view_results_one_year(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDel
 
     std_ArrDelay, std_DepDelay : Panda DataFrames
                                  Contains standard deviations of one year for the different age categories.
+
+    directory : string
+                Directory of the images.
     """
-    mean_ArrDelay = mean_ArrDelay.to_numpy()
-    mean_DepDelay = mean_DepDelay.to_numpy()
-    std_ArrDelay = std_ArrDelay.to_numpy()
-    std_DepDelay = std_DepDelay.to_numpy()
-    width = 0.35
-    x = np.arange(6)
-
-    plt.figure(figsize=(10,5))
-    plt.xticks(x, ('0-5 ans', '5-10 ans', '10-15 ans', '15-20 ans', '20-25 ans', '+25 ans'))
-    plt.bar(x - width/2, mean_ArrDelay, width, label='Arrival')
-    plt.bar(x + width/2, mean_DepDelay, width, label='Departure')
-    plt.legend()
-    plt.title('Average arrival and departure delay per age category')
-    plt.xlabel('Age categories', fontsize=12)
-    plt.ylabel('Average arrival and departure delay', fontsize=12)
-    plt.savefig('avg_delay.png')
-
-    plt.clf()
-
-    plt.figure(figsize=(15,5))
-    plt.subplot(121)
-    plt.errorbar(x, mean_ArrDelay, yerr=std_ArrDelay)
-    plt.xticks(x, ('0-5 ans', '5-10 ans', '10-15 ans', '15-20 ans', '20-25 ans', '+25 ans'))
-    plt.xlabel('Age categories', fontsize=12)
-    plt.ylabel('Average arrival delay', fontsize=12)
-    plt.title('Average arrival delays and standard deviation per category')
-    plt.subplot(122)
-    plt.errorbar(x, mean_DepDelay, yerr=std_DepDelay)
-    plt.xticks(x, ('0-5 ans', '5-10 ans', '10-15 ans', '15-20 ans', '20-25 ans', '+25 ans'))
-    plt.xlabel('Age categories', fontsize=12)
-    plt.ylabel('Average departure delay', fontsize=12)
-    plt.title('Average departure delays and standard deviation per category')
-    plt.savefig('avg_std_delay_categ.png')
+    return render(charts_one_year(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay), directory)
 
 #
 # Average age of plane per year
 #
+@metrics.timed("avg_age_plane_year")
 def avg_age_plane_year(D):
-    """Compute the middle age of planes which flew over a year per year."""
-    D = get_D_clean(D)
-    avg_age = (
-        D.map(lambda flight: ((flight.tailnum, flight.year), flight.plane_age))
-        .reduceByKey(lambda x, y: x)
-        .map(lambda flight: (flight[0][1], np.array([1, flight[1]])))
-        .reduceByKey(lambda x, y: x+y)
-        .map(lambda year: (year[0], year[1][1]/year[1][0], year[1][0]))
-        .collect()
-    )
-    return np.array(avg_age)
+    """Compute the middle age of planes which flew over a year per year.
 
-def group_over_avg(flight, avg_age):
-    """Give group 1 if the plane age is over the middle age for the year of the flight, 0 if not.
-
-    Parameters
-    ----------
-    flight : Flight tuple
-             The flight to get the group of.
-
-    avg_age : array-like (nb_year, 2)
-              Contains planes middle age for different years.
+    D is a RDD of Flight tuples or of FlightBatch, the planes of every partition are reduced by
+    batches as for run_analyses.
     """
-    avg_age_year = avg_age[avg_age[:,0]==flight.year, 1]
-    return 1 if flight.plane_age > avg_age_year else 0
+    return run_analyses(D, ("avg_age_plane_year",))["avg_age_plane_year"]
 
 def delay_over_avg_age_year(D, avg_age):
     """Compute means and standard deviations for two groups of planes : plane older than the middle age and younger for different years."""
-    D = get_D_clean(D)
-    delay_group = (
-        D.map(lambda f: ((group_over_avg(f, avg_age), f.year), np.array([1, f.ArrDelay, f.DepDelay, f.ArrDelay**2, f.DepDelay**2])))
-        .reduceByKey(lambda x, y: x + y)
-        .map(_comp_mean_std)
-        .collect()
-    )
-    years = np.array([year for ((group, year), (mean_ArrDelay, std_ArrDelay, mean_DepDelay, std_DepDelay, count_group)) in delay_group])
-    years = np.unique(years)
-
-    dico_ArrDelay = {}
-    dico_DepDelay = {}
-    for year in years:
-        dico_ArrDelay[f"mean-{year}"] = np.zeros(2)
-        dico_DepDelay[f"mean-{year}"] = np.zeros(2)
-        dico_ArrDelay[f"count-{year}"] = np.zeros(2)
-        dico_DepDelay[f"count-{year}"] = np.zeros(2)
-        dico_ArrDelay[f"std-{year}"] = np.zeros(2)
-        dico_DepDelay[f"std-{year}"] = np.zeros(2)
-
-    df_ArrDelay = pd.DataFrame(data=dico_ArrDelay)
-    df_DepDelay = pd.DataFrame(data=dico_DepDelay)
-    for ((group, year), (mean_ArrDelay, std_ArrDelay, mean_DepDelay, std_DepDelay, count_group)) in delay_group:
-        df_ArrDelay.loc[group, f"mean-{year}"] = mean_ArrDelay
-        df_ArrDelay.loc[group, f"count-{year}"] = count_group
-        df_ArrDelay.loc[group, f"std-{year}"] = std_ArrDelay
-
-        df_DepDelay.loc[group, f"mean-{year}"] = mean_DepDelay
-        df_DepDelay.loc[group, f"count-{year}"] = count_group
-        df_DepDelay.loc[group, f"std-{year}"] = std_DepDelay
-    return df_ArrDelay, df_DepDelay
-
-def view_delay_over_avg_one_year(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay):
+    return delay_per_group(D, YearBins.over_mean("plane_age", avg_age))
+
+@metrics.timed("view_delay_over_avg_one_year")
+def view_delay_over_avg_one_year(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay, directory="."):
     """Save barplots which displays means and standard deviation of arrival and departure delays.
 
     Parameters
@@ -213,30 +206,323 @@ def view_delay_over_avg_one_year(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std
 
     std_ArrDelay, std_DepDelay : Panda DataFrames
                                  Contains standard deviations of one year for the different age categories.
+
+    directory : string
+                Directory of the images.
+    """
+    return render(charts_delay_over_avg_one_year(mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay), directory)
+
+#
+# Several analyses in one scan, see analyses.ANALYSES
+#
+@metrics.timed("run_analyses")
+def run_analyses(D, analyses=tuple(ANALYSES), q=QUANTILES, k=SKETCH_K):
+    """Run several analyses with a single scan of the data.
+
+    Parameters
+    ----------
+    D : Spark RDD
+        The flights, as given by get_RDD_from_flight_data or compact_RDD.
+
+    analyses : iterable
+               Names of the analyses to run, keys of ANALYSES.
+
+    q, k :
+        Quantiles and accuracy of the sketches of the quantile analyses, see delay_quantiles_per_group.
+
+    Return
+    ------
+    results : dict
+              Links every analysis to what the function of the same name returns.
+    """
+    partials = {partial for analysis in analyses for partial in ANALYSES[analysis]}
+    delays, planes, quantiles = _scan(D, partials, k)
+    return _analyses_of_partials(delays, planes, quantiles, analyses, q)
+
+def _scan(D, partials, k=SKETCH_K):
+    """Compute the partial results of a RDD of flights."""
+    D = _compact(D)
+    return (
+        D.mapPartitions(lambda batches: [_scan_batches(batches, partials, k)])
+        .treeAggregate((Moments(2), {}, Quantiles(2, k)), _merge_partials, _merge_partials)
+    )
+
+#
+# Incremental analyses of newly arriving flights files
+#
+# The partial results of run_analyses are mergeable: they are stored with the manifest of the
+# processed files, a run scans only the new files or the lines appended to the known ones,
+# merges their partial results and derives again the analyses of the years they contain.
+#
+def save_partials(path, delays, planes, quantiles, manifest):
+    """Write the partial results and the manifest in one file, the previous file is replaced at once."""
+    keys = list(delays.index)
+    rows = np.fromiter(delays.index.values(), dtype=np.int64, count=len(keys))
+    parent = os.path.dirname(os.path.abspath(path))
+    os.makedirs(parent, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(prefix=".tmp-", dir=parent)
+    with os.fdopen(fd, "wb") as f:
+        np.savez(
+            f,
+            delay_keys=np.array(keys, dtype=np.int64).reshape(-1, 2),
+            delay_count=delays.count[rows],
+            delay_mean=delays.mean[rows],
+            delay_M2=delays.M2[rows],
+            plane_tailnum=np.array([tailnum for (tailnum, year) in planes], dtype=str),
+            plane_year=np.array([year for (tailnum, year) in planes], dtype=np.int64),
+            plane_age=np.array(list(planes.values()), dtype=np.int64),
+            manifest=np.array(json.dumps(manifest.files)),
+            quantile_k=np.array(quantiles.k),
+            **{f"quantile_{name}": values for name, values in quantiles.to_arrays().items()},
+        )
+    os.replace(tmp, path)
+
+def load_partials(path, k=SKETCH_K):
+    """Read the partial results and the manifest written by save_partials, empty ones if the file does not exist.
+
+    k is the accuracy of new sketches, stored sketches keep their own accuracy.
     """
-    mean_ArrDelay = mean_ArrDelay.to_numpy()
-    mean_DepDelay = mean_DepDelay.to_numpy()
-    std_ArrDelay = std_ArrDelay.to_numpy()
-    std_DepDelay = std_DepDelay.to_numpy()
-    width = 0.35
-    x = np.arange(2)
-    plt.figure(figsize=(10,5))
-    plt.xticks(x, ('Planes =< Average age', 'Planes > Average age'))
-    plt.bar(x - width/2, mean_ArrDelay, width, label='Arrival', yerr=std_ArrDelay)
-    plt.bar(x + width/2, mean_DepDelay, width, label='Departure', yerr=std_DepDelay)
-    plt.legend()
-    plt.title('Average arrival and departure delay')
-    plt.xlabel('Categories', fontsize=12)
-    plt.ylabel('Average arrival and departure delay', fontsize=12)
-    plt.savefig('avg_delay_over_avg.png')
-
-# Get RDD with 2007 data
-sc, D = get_RDD_from_flight_data(["/project_data/2007.csv"])
-# Calculate means and standard deviations of arrival and departure delays in 2007 for different age groups
-df_ArrDelay, df_DepDelay = avg_delay_per_age_group(D)
-view_results_one_year(df_ArrDelay.loc[:,"mean-2007"], df_DepDelay.loc[:,"mean-2007"], df_ArrDelay.loc[:,"std-2007"], df_DepDelay.loc[:,"std-2007"])
-# Calculate middle age of plane in 2007
-avg_age = avg_age_plane_year(D)
-# Calculate means and standard deviations of arrival and departure delays in 2007 for planes older and younger than the middle age
-df_ArrDelay, df_DepDelay = delay_over_avg_age_year(D, avg_age)
-view_delay_over_avg_one_year(df_ArrDelay.loc[:,"mean-2007"], df_DepDelay.loc[:,"mean-2007"], df_ArrDelay.loc[:,"std-2007"], df_DepDelay.loc[:,"std-2007"])
+    delays = Moments(2)
+    planes = {}
+    if not os.path.exists(path):
+        return delays, planes, Quantiles(2, k), Manifest()
+    with np.load(path) as data:
+        delays.add_moments([tuple(key) for key in data["delay_keys"].tolist()], data["delay_count"], data["delay_mean"], data["delay_M2"])
+        planes = dict(zip(zip(data["plane_tailnum"].tolist(), data["plane_year"].tolist()), data["plane_age"].tolist()))
+        quantiles = Quantiles.from_arrays(2, int(data["quantile_k"]), {
+            name: data[f"quantile_{name}"] for name in ("keys", "counts", "items", "owners", "levels")
+        })
+        manifest = Manifest(json.loads(str(data["manifest"])))
+    return delays, planes, quantiles, manifest
+
+@metrics.timed("update_analyses")
+def update_analyses(fnames, state, sc=None, Plane=None, analyses=tuple(ANALYSES), split_size=PARTITION_BYTES, q=QUANTILES, k=SKETCH_K):
+    """Run the analyses on the flights not processed yet and update the stored partial results.
+
+    Parameters
+    ----------
+    fnames : iterable
+             Paths of the flights files, new ones or known ones with appended lines.
+
+    state : string
+            Path of the file of partial results and manifest, created if needed.
+
+    sc : SparkContext
+         Context used to read the files, a new one if not given.
+
+    Plane : PlaneRegistry
+            Links tail numbers to delivery years. The shared registry is used if not given.
+
+    split_size : integer
+                 Size in bytes of the input read by one partition.
+
+    q, k :
+        Quantiles and accuracy of the sketches of a new state, see delay_quantiles_per_group.
+
+    Return
+    ------
+    results : dict
+              Links every analysis to what the function of the same name returns, for the years
+              with new flights only. Results of the other years did not change.
+
+    years : set
+            Years with new flights.
+    """
+    delays, planes, quantiles, manifest = load_partials(state, k)
+    splits = manifest.new_splits(fnames, split_size)
+    if not splits:
+        return {}, set()
+    sc, D = get_RDD_from_splits(splits, sc, Plane, batches=True)
+    new_delays, new_planes, new_quantiles = _scan(D, set(itertools.chain(*ANALYSES.values())), quantiles.k)
+    years = {year for (year, age) in new_delays.index} | {year for (tailnum, year) in new_planes}
+    delays.merge(new_delays)
+    planes.update(new_planes)
+    quantiles.merge(new_quantiles)
+    for filename, start, stop in splits:
+        manifest.mark(filename, stop)
+    save_partials(state, delays, planes, quantiles, manifest)
+    return _analyses_of_partials(delays, planes, quantiles, analyses, q, years), years
+
+#
+# Multi-year runs partitioned by year
+#
+# Every year is an independent unit: the flights files of a year are scanned by a Spark job of
+# their own and the partial results of the year are stored in a file of its own, with the manifest
+# of its files. Updating or computing again a year does not read or write the other years.
+# The jobs of the years to update are submitted together from threads so that they share the
+# cluster, none needs a shuffle. The tables of several years, the mean-{year} columns for instance,
+# are derived from the merge of the stored partial results, which are small: they are indexed by
+# (year, plane age) and (tailnum, year), not by flight.
+#
+def year_of_file(fname):
+    """Give the year of a flights file, the first number of 4 digits of its name as in 2007.csv, None if there is none."""
+    match = re.search(r"(?<!\d)(\d{4})(?!\d)", os.path.basename(fname))
+    return int(match.group(1)) if match else None
+
+def files_per_year(fnames):
+    """Group flights files per year, see year_of_file. A file without year is skipped with an exception message."""
+    per_year = {}
+    for fname in fnames:
+        year = year_of_file(fname)
+        if year is None:
+            print(f"Exception : no year in the name of {fname}, it is skipped")
+            continue
+        per_year.setdefault(year, []).append(fname)
+    return per_year
+
+def year_partials_path(directory, year):
+    """Path of the partial results of a year in a directory of per-year partial results."""
+    return os.path.join(directory, f"{year}.npz")
+
+def stored_years(directory):
+    """Years whose partial results are stored in a directory."""
+    paths = glob.glob(os.path.join(directory, "[0-9][0-9][0-9][0-9].npz"))
+    return sorted(int(os.path.basename(path)[:4]) for path in paths)
+
+@metrics.timed("update_years")
+def update_years(fnames, directory, sc=None, Plane=None, years=None, recompute=(), split_size=PARTITION_BYTES, k=SKETCH_K, max_jobs=None):
+    """Scan the flights not processed yet of every year and store the partial results per year.
+
+    Parameters
+    ----------
+    fnames : iterable
+             Paths of the flights files, the year of a file is in its name, see year_of_file.
+
+    directory : string
+                Directory of the partial results, one file per year, created if needed.
+
+    sc : SparkContext
+         Context used to read the files, a new one if not given.
+
+    Plane : PlaneRegistry
+            Links tail numbers to delivery years. The shared registry is used if not given.
+
+    years : iterable
+            Years to update, every year of the files if not given.
+
+    recompute : iterable
+                Years whose stored partial results are dropped: all their flights are scanned again.
+
+    split_size : integer
+                 Size in bytes of the input read by one partition.
+
+    k : integer
+        Accuracy of the sketches of a new year, see delay_quantiles_per_group.
+
+    max_jobs : integer
+               Maximum number of years scanned at the same time, all of them if not given.
+
+    Return
+    ------
+    updated : set
+              Years whose partial results were updated. A year whose job failed is reported and
+              keeps its previous partial results.
+    """
+    per_year = files_per_year(fnames)
+    if years is not None:
+        per_year = {year: files for year, files in per_year.items() if year in set(years)}
+    recompute = set(recompute)
+    todo = {}
+    for year, files in sorted(per_year.items()):
+        path = year_partials_path(directory, year)
+        if year in recompute:
+            state = Moments(2), {}, Quantiles(2, k), Manifest()
+        else:
+            state = load_partials(path, k)
+        splits = state[3].new_splits(files, split_size)
+        if splits:
+            todo[year] = (splits, state)
+    if not todo:
+        return set()
+    if sc is None:
+        sparkconf = pyspark.SparkConf()
+        sparkconf.set('spark.port.maxRetries', 128)
+        sc = pyspark.SparkContext(conf=sparkconf)
+    Plane = get_plane_registry() if Plane is None else Plane
+
+    def update_year(year):
+        splits, (delays, planes, quantiles, manifest) = todo[year]
+        D = get_RDD_from_splits(splits, sc, Plane, batches=True)[1]
+        new_delays, new_planes, new_quantiles = _scan(D, set(itertools.chain(*ANALYSES.values())), quantiles.k)
+        delays.merge(new_delays)
+        planes.update(new_planes)
+        quantiles.merge(new_quantiles)
+        for filename, start, stop in splits:
+            manifest.mark(filename, stop)
+        save_partials(year_partials_path(directory, year), delays, planes, quantiles, manifest)
+
+    updated = set()
+    with concurrent.futures.ThreadPoolExecutor(max_jobs or len(todo)) as pool:
+        futures = {pool.submit(update_year, year): year for year in todo}
+        for future in concurrent.futures.as_completed(futures):
+            year = futures[future]
+            try:
+                future.result()
+            except Exception as exception:
+                print(f"Exception : year {year} not updated, {exception!r}")
+                continue
+            updated.add(year)
+    return updated
+
+def load_years(directory, years=None):
+    """Merge the partial results stored per year, of every stored year if years is not given."""
+    delays = Moments(2)
+    planes = {}
+    quantiles = None
+    for year in stored_years(directory) if years is None else sorted(years):
+        year_delays, year_planes, year_quantiles, manifest = load_partials(year_partials_path(directory, year))
+        delays.merge(year_delays)
+        planes.update(year_planes)
+        quantiles = year_quantiles if quantiles is None else quantiles.merge(year_quantiles)
+    return delays, planes, Quantiles(2, SKETCH_K) if quantiles is None else quantiles
+
+def analyses_of_years(directory, years=None, analyses=tuple(ANALYSES), q=QUANTILES):
+    """Derive analyses from the partial results stored per year, no flight is read.
+
+    Parameters
+    ----------
+    directory : string
+                Directory of the partial results written by update_years.
+
+    years : iterable
+            Years of the results, every stored year if not given.
+
+    Return
+    ------
+    results : dict
+              Links every analysis to what the function of the same name returns, with the columns of every year.
+    """
+    delays, planes, quantiles = load_years(directory, years)
+    return _analyses_of_partials(delays, planes, quantiles, analyses, q)
+
+def run_years(fnames, directory, sc=None, Plane=None, years=None, recompute=(), analyses=tuple(ANALYSES), split_size=PARTITION_BYTES, q=QUANTILES, k=SKETCH_K, max_jobs=None):
+    """Update the partial results of the years of the flights files and derive the analyses of all of them.
+
+    See update_years and analyses_of_years for the parameters.
+
+    Return
+    ------
+    results : dict
+              Links every analysis to what the function of the same name returns, for the years
+              of the files, or the given years.
+
+    updated : set
+              Years whose flights were scanned.
+    """
+    updated = update_years(fnames, directory, sc, Plane, years, recompute, split_size, k, max_jobs)
+    if years is None:
+        years = files_per_year(fnames)
+    return analyses_of_years(directory, [year for year in years if os.path.exists(year_partials_path(directory, year))], analyses, q), updated
+
+if __name__ == "__main__":
+    # Get RDD with 2007 data
+    sc, D = get_RDD_from_flight_data(["/project_data/2007.csv"], batches=True)
+    # Calculate, in one scan, means and standard deviations of arrival and departure delays in 2007 for different age groups,
+    # middle age of plane in 2007 and means and standard deviations for planes older and younger than the middle age
+    results = run_analyses(D)
+    df_ArrDelay, df_DepDelay = results["avg_delay_per_age_group"]
+    charts = charts_one_year(df_ArrDelay.loc[:,"mean-2007"], df_DepDelay.loc[:,"mean-2007"], df_ArrDelay.loc[:,"std-2007"], df_DepDelay.loc[:,"std-2007"])
+    df_ArrDelay, df_DepDelay = results["delay_over_avg_age_year"]
+    charts += charts_delay_over_avg_one_year(df_ArrDelay.loc[:,"mean-2007"], df_DepDelay.loc[:,"mean-2007"], df_ArrDelay.loc[:,"std-2007"], df_DepDelay.loc[:,"std-2007"])
+    # The charts are rendered together by a pool of processes
+    render(charts)
@@ -0,0 +1,218 @@
+# -*- coding: utf-8 -*-
+
+import time
+
+import numpy as np
+import pyspark.sql
+from pyspark.sql import functions as F
+from pyspark.sql import types as T
+
+from flight_data import get_plane_registry
+from grouping import AGE_GROUPS
+import analyse_spark
+
+#
+# Flights as a Spark DataFrame
+#
+# Same analyses as analyse_spark, expressed as native Spark SQL aggregations so that they run
+# in the JVM (Catalyst, Tungsten) instead of on Python tuples. Missing values are nulls.
+#
+FLIGHT_SCHEMA = T.StructType([
+    T.StructField("year", T.IntegerType()),
+    T.StructField("month", T.IntegerType()),
+    T.StructField("day_month", T.IntegerType()),
+    T.StructField("day_week", T.IntegerType()),
+    T.StructField("hour", T.IntegerType()),
+    T.StructField("ArrDelay", T.IntegerType()),
+    T.StructField("DepDelay", T.IntegerType()),
+    T.StructField("cancelled", T.BooleanType()),
+    T.StructField("tailnum", T.StringType()),
+    T.StructField("plane_age", T.IntegerType()),
+])
+
+def get_spark_session():
+    """Give the Spark session, it is created if needed."""
+    return (
+        pyspark.sql.SparkSession.builder
+        .config('spark.port.maxRetries', 128)
+        .getOrCreate()
+    )
+
+def _int(name):
+    """Integer column of a column of the flights files, null where it is 'NA'."""
+    return F.when(F.col(name) != "NA", F.col(name)).cast("int")
+
+def get_DataFrame_from_flight_data(fnames, spark=None, Plane=None):
+    """Load flights files into a DataFrame with the FLIGHT_SCHEMA schema.
+
+    Parameters
+    ----------
+    fnames : iterable
+             Paths of the flights files.
+
+    spark : SparkSession
+            Session used to read the files, the default session if not given.
+
+    Plane : PlaneRegistry
+            Links tail numbers to delivery years. The shared registry is used if not given.
+    """
+    if spark is None:
+        spark = get_spark_session()
+    if Plane is None:
+        Plane = get_plane_registry()
+    planes = spark.createDataFrame(
+        [(tailnum, int(year)) for tailnum, year in zip(Plane.tailnums, Plane.years)],
+        "tailnum string, plane_year int",
+    )
+    # Every column is read as a string, 'NA' is only missing in the numeric ones: it is a tail number too
+    raw = spark.read.csv(list(fnames), header=True)
+    df = raw.select(
+        _int("Year").alias("year"),
+        _int("Month").alias("month"),
+        _int("DayofMonth").alias("day_month"),
+        _int("DayOfWeek").alias("day_week"),
+        # CRSDepTime is hhmm
+        F.floor(_int("CRSDepTime") / 100).cast("int").alias("hour"),
+        _int("ArrDelay").alias("ArrDelay"),
+        _int("DepDelay").alias("DepDelay"),
+        (_int("Cancelled") == 1).alias("cancelled"),
+        F.col("TailNum").alias("tailnum"),
+    )
+    df = df.join(F.broadcast(planes), on="tailnum", how="left")
+    df = df.withColumn("plane_age", (F.col("year") - F.col("plane_year")).cast("int"))
+    return df.select(*FLIGHT_SCHEMA.fieldNames())
+
+def get_df_clean(df, includeCancelledFlights=False):
+    """Clean the DataFrame before using it for planes age analysis, same rules as analyse_spark.get_D_clean.
+
+    Parameters
+    ----------
+    df : Spark DataFrame
+         The flights.
+
+    includeCancelledFlights : boolean
+                              Precise if cancelled flights should be included or not.
+    """
+    # A missing cancelled is true, as in analyse_spark.get_D_clean
+    cancelled = F.coalesce(F.col("cancelled"), F.lit(True))
+    complete = (
+        F.col("year").isNotNull()
+        & F.col("month").isNotNull()
+        & F.col("day_month").isNotNull()
+        & F.col("day_week").isNotNull()
+        & F.col("hour").isNotNull()
+        & F.col("plane_age").isNotNull()
+        & (cancelled | (F.col("ArrDelay").isNotNull() & F.col("DepDelay").isNotNull()))
+    )
+    kept = ~cancelled & complete
+    if includeCancelledFlights:
+        kept = cancelled | kept
+    return df.filter(kept)
+
+def _age_group_column():
+    """Age category of the plane, as grouping.AGE_GROUPS."""
+    column = F.lit(len(AGE_GROUPS.bounds))
+    for group, bound in reversed(list(enumerate(AGE_GROUPS.bounds.tolist()))):
+        column = F.when(F.col("plane_age") <= bound, group).otherwise(column)
+    return column
+
+def _delay_per_group(df, group):
+    """Compute mean and standard deviation of delays per group and year, as analyse_spark.delay_per_group."""
+    rows = (
+        df.groupBy(group.alias("group"), "year")
+        .agg(
+            F.avg("ArrDelay").alias("mean_ArrDelay"),
+            F.stddev_pop("ArrDelay").alias("std_ArrDelay"),
+            F.avg("DepDelay").alias("mean_DepDelay"),
+            F.stddev_pop("DepDelay").alias("std_DepDelay"),
+            F.count(F.lit(1)).alias("count"),
+        )
+        .collect()
+    )
+    return [
+        ((r["group"], r["year"]), (r["mean_ArrDelay"], r["std_ArrDelay"], r["mean_DepDelay"], r["std_DepDelay"], float(r["count"])))
+        for r in rows
+    ]
+
+def avg_delay_per_age_group(df):
+    """Compute mean and standard deviation of arrival and departure delay for different age categories and years."""
+    delay_group = _delay_per_group(get_df_clean(df), _age_group_column())
+    return analyse_spark._delay_dataframes(delay_group, AGE_GROUPS.nb_groups)
+
+def _avg_age_DataFrame(df):
+    return (
+        get_df_clean(df)
+        .select("tailnum", "year", "plane_age")
+        .dropDuplicates(["tailnum", "year"])
+        .groupBy("year")
+        .agg(F.avg("plane_age").alias("avg_age"), F.count(F.lit(1)).alias("count"))
+    )
+
+def avg_age_plane_year(df):
+    """Compute the middle age of planes which flew over a year per year."""
+    return np.array([(r["year"], r["avg_age"], r["count"]) for r in _avg_age_DataFrame(df).collect()])
+
+def delay_over_avg_age_year(df, avg_age=None):
+    """Compute means and standard deviations for two groups of planes : plane older than the middle age and younger for different years.
+
+    Parameters
+    ----------
+    avg_age : array-like (nb_year, 2)
+              Contains planes middle age for different years. It is computed in the same Spark plan if not given.
+    """
+    df = get_df_clean(df)
+    if avg_age is None:
+        ages = _avg_age_DataFrame(df).select("year", "avg_age")
+    else:
+        ages = df.sparkSession.createDataFrame([(int(row[0]), float(row[1])) for row in avg_age], "year int, avg_age double")
+    df = df.join(F.broadcast(ages), on="year", how="left")
+    group = F.when(F.col("plane_age") > F.col("avg_age"), 1).otherwise(0)
+    return analyse_spark._delay_dataframes(_delay_per_group(df, group), 2)
+
+#
+# Comparison with the RDD engine
+#
+def compare_engines(fnames, sc=None, spark=None, Plane=None):
+    """Run the analyses with the RDD engine of analyse_spark and with this engine on the same files.
+
+    Plane links tail numbers to delivery years for both engines, the shared registry is used if not given.
+
+    Return
+    ------
+    results : dict
+              Links every analysis to True if both engines give the same results, and "time-rdd"
+              and "time-df" to the duration in seconds of each engine.
+    """
+    if spark is None:
+        spark = get_spark_session()
+    if sc is None:
+        sc = spark.sparkContext
+    start = time.perf_counter()
+    sc, D = analyse_spark.get_RDD_from_flight_data(fnames, sc=sc, Plane=Plane)
+    rdd = analyse_spark.run_analyses(D)
+    time_rdd = time.perf_counter() - start
+
+    start = time.perf_counter()
+    df = get_DataFrame_from_flight_data(fnames, spark, Plane).cache()
+    avg_age = avg_age_plane_year(df)
+    frames = {
+        "avg_delay_per_age_group": avg_delay_per_age_group(df),
+        "avg_age_plane_year": avg_age,
+        "delay_over_avg_age_year": delay_over_avg_age_year(df, avg_age),
+    }
+    time_df = time.perf_counter() - start
+    df.unpersist()
+
+    results = {"time-rdd": time_rdd, "time-df": time_df}
+    for analysis, result in frames.items():
+        if analysis == "avg_age_plane_year":
+            expected = rdd[analysis][np.argsort(rdd[analysis][:, 0])] if len(rdd[analysis]) else rdd[analysis]
+            result = result[np.argsort(result[:, 0])] if len(result) else result
+            results[analysis] = expected.shape == result.shape and np.allclose(expected, result)
+        else:
+            results[analysis] = len(rdd[analysis]) == len(result) and all(
+                expected.columns.sort_values().equals(frame.columns.sort_values())
+                and np.allclose(expected[frame.columns].to_numpy(float), frame.to_numpy(float))
+                for expected, frame in zip(rdd[analysis], result)
+            )
+    return results
@@ -1,18 +1,154 @@
 # -*- coding: utf-8 -*-
 
+import io
+import os
+import math
+
 import pyspark
 
-from flight_data import read_csvs, read_plane_data
+import metrics
+from flight_data import Flight, get_plane_registry, batch_counts, _read_one_csv_batches, _limit_batches
+
+# Size in bytes of the input read by one partition
+PARTITION_BYTES = 64 * 2**20
+
+# Number of lines parsed at once by an executor
+PARSE_BATCH_SIZE = 100000
+
+def _parse_partition(lines, header, Plane, counters=None, batches=False):
+    """Parse lines of flights files into Flight tuples, or FlightBatch, on an executor.
+
+    Parameters
+    ----------
+    lines : iterable
+            Lines of the partition, header lines of the files are skipped.
+
+    header : string
+             Header line of the flights files.
+
+    Plane : Spark Broadcast
+            Broadcast of the plane registry.
+
+    counters : dict
+               Accumulators given by _spark_counters, nothing is counted if None.
+
+    batches : boolean
+              Give FlightBatch of at most PARSE_BATCH_SIZE flights instead of Flight tuples.
+    """
+    chunk = []
+    for line in lines:
+        if line == header:
+            continue
+        chunk.append(line)
+        if len(chunk) == PARSE_BATCH_SIZE:
+            yield from _parse_lines(chunk, header, Plane.value, counters, batches)
+            chunk = []
+    if chunk:
+        yield from _parse_lines(chunk, header, Plane.value, counters, batches)
+
+def _parse_lines(lines, header, Plane, counters=None, batches=False):
+    source = io.StringIO(header + "\n" + "\n".join(lines))
+    for batch in _read_one_csv_batches(source, Plane, PARSE_BATCH_SIZE):
+        if counters is not None:
+            rows, na = batch_counts(batch)
+            counters["rows"].add(rows)
+            for name, count in na.items():
+                counters[name].add(count)
+        if batches:
+            yield batch
+        else:
+            yield from batch.rows()
+    if counters is not None:
+        counters["bytes"].add(sum(map(len, lines)) + len(lines))
+
+def _spark_counters(sc):
+    """Accumulators which count the flights, the missing values and the bytes parsed by the executors.
+
+    They are added to the metrics at the export, a partition computed again is counted again.
+    None is given when the metrics are disabled.
+    """
+    if not metrics.ENABLED:
+        return None
+    counters = {name: sc.accumulator(0) for name in ("rows", "bytes") + Flight._fields}
+    def collect():
+        yield "rows_read", counters["rows"].value, {"engine": "spark"}
+        yield "bytes_read", counters["bytes"].value, {"source": "csv", "engine": "spark"}
+        for name in Flight._fields:
+            if counters[name].value:
+                yield "na_values", counters[name].value, {"field": name, "engine": "spark"}
+    metrics.REGISTRY.collectors.append(collect)
+    return counters
 
-def get_RDD_from_flight_data(fnames, limit=None, sc=None, numSlices=None):
+def get_RDD_from_flight_data(fnames, limit=None, sc=None, numSlices=None, Plane=None, batches=False):
     """
     @author jbl
+
+    The files are read and parsed by the executors, the driver only reads their header and size.
+    Files must be reachable from every executor at the same path.
+
+    numSlices is the minimum number of partitions, it is computed from the size of the files if not given.
+    Plane is the plane registry, the shared one if not given.
+    With batches, the RDD holds FlightBatch instead of Flight tuples: about 21 bytes per flight
+    once pickled by Spark, see flight_data.RECORD_DTYPE. analyse_spark.compact_RDD cleans it.
+    limit is always a number of flights.
     """
     if sc is None:
         sparkconf = pyspark.SparkConf()
         sparkconf.set('spark.port.maxRetries', 128)
         sc = pyspark.SparkContext(conf=sparkconf)
+    fnames = list(fnames)
     if numSlices is None:
-        numSlices = 1000
-    D = sc.parallelize(read_csvs(fnames, limit), numSlices=numSlices)
+        size = sum(os.path.getsize(fname) for fname in fnames)
+        numSlices = max(sc.defaultParallelism, math.ceil(size / PARTITION_BYTES))
+    with open(fnames[0]) as f:
+        header = f.readline().rstrip("\r\n")
+    Plane = sc.broadcast(get_plane_registry() if Plane is None else Plane)
+    counters = _spark_counters(sc)
+    D = (
+        sc.textFile(",".join(fnames), minPartitions=numSlices)
+        .mapPartitions(lambda lines: _parse_partition(lines, header, Plane, counters, batches))
+    )
+    if limit is not None and batches:
+        D = sc.parallelize(list(_limit_batches(D.toLocalIterator(), limit)))
+    elif limit is not None:
+        D = sc.parallelize(D.take(limit))
+    return sc, D
+
+def _read_splits(splits, Plane, counters=None, batches=False):
+    """Parse byte ranges of flights files into Flight tuples, or FlightBatch, on an executor."""
+    for filename, start, stop in splits:
+        with open(filename, "rb") as f:
+            header = f.readline().decode().rstrip("\r\n")
+            f.seek(start)
+            lines = f.read(stop - start).decode().splitlines()
+        yield from _parse_partition(lines, header, Plane, counters, batches)
+
+def get_RDD_from_splits(splits, sc=None, Plane=None, batches=False):
+    """Load byte ranges of flights files, one partition per range.
+
+    Parameters
+    ----------
+    splits : list
+             (filename, start, stop) tuples on line boundaries, see flight_data.file_splits and flight_data.Manifest.
+             Files must be reachable from every executor at the same path.
+
+    sc : SparkContext
+         Context used to read the files, a new one if not given.
+
+    Plane : PlaneRegistry
+            Links tail numbers to delivery years. The shared registry is used if not given.
+
+    batches : boolean
+              Give a RDD of FlightBatch instead of Flight tuples, see get_RDD_from_flight_data.
+    """
+    if sc is None:
+        sparkconf = pyspark.SparkConf()
+        sparkconf.set('spark.port.maxRetries', 128)
+        sc = pyspark.SparkContext(conf=sparkconf)
+    Plane = sc.broadcast(get_plane_registry() if Plane is None else Plane)
+    counters = _spark_counters(sc)
+    D = (
+        sc.parallelize(splits, max(1, len(splits)))
+        .mapPartitions(lambda splits: _read_splits(splits, Plane, counters, batches))
+    )
     return sc, D
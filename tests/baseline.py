@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Row-wise code of the first version of the project, the tests compare the optimized code with it."""
+
+import csv
+import datetime
+import functools
+
+import numpy as np
+
+from flight_data import Flight
+
+def read_plane_data(filename):
+    """Read the plane data file and retrieve a dictionnary which links the tail number and the delivery year of the plane."""
+    Plane = dict()
+    with open(filename) as f:
+        for row in csv.DictReader(f):
+            # Some weird cases are not None but a string 'None'
+            if row["year"] is not None and row["year"] != 'None':
+                Plane[row["tailnum"]] = int(row["year"])
+    return Plane
+
+def read_csvs(fnames, plane_data):
+    """Read files which contain flights data row by row and give the Flight tuples."""
+    Plane = read_plane_data(plane_data)
+    for filename in fnames:
+        with open(filename) as f:
+            for row in csv.DictReader(f):
+                year = int(row["Year"]) if row["Year"] != 'NA' else row["Year"]
+                month = int(row["Month"]) if row["Month"] != 'NA' else row["Month"]
+                day_month = int(row["DayofMonth"]) if row["DayofMonth"] != 'NA' else row["DayofMonth"]
+                day_week = int(row["DayOfWeek"]) if row["DayOfWeek"] != 'NA' else row["DayOfWeek"]
+                tailnum = row["TailNum"]
+                hh_mm = row["CRSDepTime"]
+                if len(hh_mm) < 4:
+                    hh_mm = "0" + hh_mm
+                hour = int(hh_mm[:2])
+                ArrDelay = int(row["ArrDelay"]) if row["ArrDelay"] != 'NA' else row["ArrDelay"]
+                DepDelay = int(row["DepDelay"]) if row["DepDelay"] != 'NA' else row["DepDelay"]
+                cancelled = bool(int(row["Cancelled"])) if row["Cancelled"] != 'NA' else row["Cancelled"]
+                plane_age = year - Plane[tailnum] if tailnum in Plane and year != 'NA' else 'NA'
+                yield Flight(year, month, day_month, day_week, hour, ArrDelay, DepDelay, cancelled, tailnum, plane_age)
+
+def mean_std_delay(stream):
+    """Compute mean and standard deviation of arrival and departure delays a stream of flights."""
+    prepared_data = map(lambda f: np.array([1, f.ArrDelay, f.ArrDelay**2, f.DepDelay, f.DepDelay**2]), stream)
+    results = functools.reduce(lambda x, y: x+y, prepared_data, 0)
+    if isinstance(results, int) and results == 0:
+        return 0, 0, 0, 0
+    sum_1, sum_ArrDelay, sum_ArrDelay2, sum_DepDelay, sum_DepDelay2 = results
+    mean_ArrDelay = sum_ArrDelay/sum_1
+    mean_DepDelay = sum_DepDelay/sum_1
+    std_ArrDelay = np.sqrt(sum_ArrDelay2/sum_1 - (mean_ArrDelay)**2)
+    std_DepDelay = np.sqrt(sum_DepDelay2/sum_1 - (mean_DepDelay)**2)
+    return (mean_ArrDelay, mean_DepDelay, std_ArrDelay, std_DepDelay)
+
+def cancelled_proportion(stream):
+    """Compute proportion (in percentage) of number of cancelled flights over number of flights of a stream."""
+    prepared_data = map(lambda f: np.array([1, 1 if f.cancelled else 0]), stream)
+    results = functools.reduce(lambda x, y: x+y, prepared_data, 0)
+    if isinstance(results, int) and results == 0:
+        return 0
+    sum_1, sum_nb_cancelled = results
+    # Percentage of cancelled flights, remove outliers
+    return sum_nb_cancelled/sum_1*100 if sum_1 != 1 else 0
+
+def stats_per_value(getter, dt1, dt2, value, size):
+    """Compute the statistics of TimeCube.slice by reading every hour between two dates with get_flight_one_day_hour.
+
+    value gives the index of the datetime of an hour on the axis, or None to leave the hour out.
+    """
+    flights = [[] for _ in range(size)]
+    for day in range((dt2-dt1).days):
+        date = dt1 + datetime.timedelta(days=day)
+        for hour in range(24):
+            date = date.replace(hour=hour)
+            index = value(date)
+            if index is not None:
+                flights[index].extend(getter.get_flight_one_day_hour(date))
+    stats = np.zeros((5, size))
+    for index, stream in enumerate(flights):
+        stats[:4, index] = mean_std_delay(f for f in stream if not f.cancelled)
+        stats[4, index] = cancelled_proportion(stream)
+    return stats
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+
+import os
+import sys
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src")
+DIRECTORIES = [os.path.join(SRC, directory) for directory in ("", "spark", "cassandra", "bench")]
+sys.path[:0] = DIRECTORIES
+# The Python workers of Spark import the modules of the tasks from the PYTHONPATH
+os.environ["PYTHONPATH"] = os.pathsep.join(DIRECTORIES + [os.environ["PYTHONPATH"]] if os.environ.get("PYTHONPATH") else DIRECTORIES)
+
+@pytest.fixture(scope="session")
+def flights_files(tmp_path_factory):
+    """Small synthetic flights files of two years and their plane data file, see generate_data."""
+    from generate_data import generate_dataset
+    return generate_dataset(str(tmp_path_factory.mktemp("flights")), years=(2006, 2007), flights_per_year=5000, nb_planes=200)
+
+@pytest.fixture(scope="session")
+def spark_context():
+    """Local SparkContext shared by the tests, they are skipped without pyspark."""
+    pyspark = pytest.importorskip("pyspark")
+    sc = pyspark.SparkContext.getOrCreate(pyspark.SparkConf().setMaster("local[2]").setAppName("tests"))
+    yield sc
+    sc.stop()
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+import random
+
+import numpy as np
+import pytest
+
+from accumulators import KLL, Quantiles
+
+Q = np.linspace(0.01, 0.99, 99)
+
+@pytest.fixture(autouse=True)
+def seeded():
+    """Fix the starts of the items promoted by the compactions, so that the sketches are reproducible."""
+    state = random.getstate()
+    random.seed(0)
+    yield
+    random.setstate(state)
+
+def assert_rank_error(estimates, data, k):
+    """Every estimate lies between the exact quantiles at q - 1.7/k and q + 1.7/k, the bound documented by KLL."""
+    tolerance = 1.7 / k
+    lower = np.quantile(data, np.maximum(Q - tolerance, 0), method="inverted_cdf")
+    upper = np.quantile(data, np.minimum(Q + tolerance, 1), method="inverted_cdf")
+    assert np.all((lower <= estimates) & (estimates <= upper))
+
+@pytest.mark.parametrize("k", [50, 200])
+@pytest.mark.parametrize("distribution", ["normal", "delays"])
+def test_kll_merged(k, distribution):
+    rng = np.random.default_rng(k)
+    if distribution == "normal":
+        data = rng.normal(size=100000)
+    else:
+        # Delays in minutes, with many ties
+        data = np.round(rng.exponential(20, size=100000) - 10)
+    # Partitions sketched by small updates, then merged one after the other as by treeAggregate
+    sketches = [KLL(k) for _ in range(20)]
+    for sketch, part in zip(sketches, np.array_split(data, 20)):
+        for values in np.array_split(part, 50):
+            sketch.update(values)
+    merged = KLL(k)
+    for sketch in sketches:
+        merged.merge(sketch)
+    assert merged.n == len(data)
+    assert len(merged) <= 3 * k + KLL.MIN_CAPACITY * len(merged.levels)
+    assert_rank_error(merged.quantiles(Q), data, k)
+
+def test_quantiles_merged_and_regrouped():
+    k = 100
+    rng = np.random.default_rng(0)
+    keys = rng.integers(0, 4, size=60000)
+    values = np.column_stack((rng.normal(keys, 1), rng.exponential(keys + 1)))
+    accs = []
+    for rows in np.array_split(np.arange(len(keys)), 12):
+        accs.append(Quantiles(2, k).add(keys[rows], values[rows]))
+    acc = Quantiles(2, k)
+    for other in accs:
+        acc.merge(other)
+    for key, quantiles in acc.quantiles(Q):
+        for var in range(2):
+            assert_rank_error(quantiles[:, var], values[keys == key, var], k)
+    # Keys 0, 1 and 2, 3 merged
+    regrouped = acc.regroup(lambda key: key // 2)
+    for key, quantiles in regrouped.quantiles(Q):
+        for var in range(2):
+            assert_rank_error(quantiles[:, var], values[keys // 2 == key, var], k)
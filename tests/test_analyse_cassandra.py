@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+
+import numpy as np
+import pytest
+
+import baseline
+import fake_cassandra
+from flight_data import Flight
+from feed_cassandra import InsertFlight
+from analyse_cassandra import GetFlight, get_season, time_cube_between_dates
+from day_cache import DayCache
+
+# 2007-01-01 is a Monday
+FIRST_DAY = datetime.datetime(2007, 1, 1)
+NB_DAYS = 3
+PLANES_PER_HOUR = 7
+
+def flights():
+    """Flights of several planes every hour of NB_DAYS days, some cancelled."""
+    for day in range(NB_DAYS):
+        date = FIRST_DAY + datetime.timedelta(days=day)
+        for hour in range(24):
+            for plane in range(PLANES_PER_HOUR):
+                cancelled = (day + hour + plane) % 11 == 0
+                delay = 'NA' if cancelled else (hour * 7 + plane * 3 + day) % 50 - 10
+                yield Flight(date.year, date.month, date.day, date.isoweekday(), hour, delay, delay // 2 if delay != 'NA' else 'NA', cancelled, f"N{plane}", plane)
+
+@pytest.fixture
+def session():
+    session = fake_cassandra.Session(fetch_size=2)
+    InsertFlight(day_cache=None, session=session).bulk_insert_datastream(flights(), report_every=None)
+    session.futures.clear()
+    return session
+
+def test_get_flights_of_hours_pages_on_demand(session):
+    hours = [FIRST_DAY + datetime.timedelta(hours=hour) for hour in range(NB_DAYS * 24)]
+    concurrency = 4
+    reader = GetFlight(session=session, concurrency=concurrency).get_flights_of_hours(hours)
+    first = next(reader)
+    # The first page of every partition queried, and the next page of the partition being read
+    assert sum(future.pages_fetched for future in session.futures) <= concurrency + 1
+    read = [first] + list(reader)
+    key = lambda flight: (flight.day_month, flight.hour, flight.tailnum)
+    assert sorted(map(key, read)) == sorted(map(key, flights()))
+    # Every partition was read through several pages
+    assert all(future.pages_fetched == 4 for future in session.futures)
+
+# Index of the datetime of an hour on every axis of a TimeCube, and number of values of the axis
+AXES = {
+    "month": (lambda date: date.month - 1, 12),
+    "day": (lambda date: date.weekday(), 7),
+    "season": (lambda date: get_season(date.replace(hour=0)), 4),
+    "hour": (lambda date: date.hour, 24),
+}
+
+@pytest.fixture(scope="module")
+def stored(flights_files):
+    """Stand-in session with the flights of 2007 of the generated files and their rollup."""
+    fnames, plane_data = flights_files
+    session = fake_cassandra.Session()
+    InsertFlight(day_cache=None, session=session).bulk_insert_datastream(baseline.read_csvs(fnames[1:], plane_data), report_every=None)
+    return session
+
+def test_time_cube(stored, tmp_path):
+    dt1, dt2 = datetime.datetime(2007, 1, 1), datetime.datetime(2008, 1, 1)
+    getter = GetFlight(session=stored)
+    cache = DayCache(str(tmp_path / "day_cache.sqlite"))
+    cubes = [
+        time_cube_between_dates(dt1, dt2, getter=getter),
+        time_cube_between_dates(dt1, dt2, getter=getter, rollup=True),
+        time_cube_between_dates(dt1, dt2, getter=getter, cache=cache),
+        # Every day from the cache
+        time_cube_between_dates(dt1, dt2, getter=GetFlight(session=fake_cassandra.Session()), cache=cache),
+    ]
+    cache.close()
+    for axis, (value, size) in AXES.items():
+        expected = baseline.stats_per_value(getter, dt1, dt2, value, size)
+        for cube in cubes:
+            assert np.allclose(cube.slice(axis), expected), axis
+    assert cubes[0].count.sum() == sum(len(partition) for partition in stored.data["flight_by_time"].values())
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+
+import analyse_local
+from analyses import ANALYSES
+
+def test_parity_with_spark(flights_files, spark_context):
+    import flight_data
+    fnames, plane_data = flights_files
+    differences = analyse_local.check_parity(fnames, sc=spark_context, Plane=flight_data.get_plane_registry(plane_data), processes=2)
+    assert set(differences) == set(ANALYSES)
+    for analysis, (difference, ok) in differences.items():
+        assert ok, f"{analysis} differs by {difference}"
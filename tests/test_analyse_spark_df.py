@@ -0,0 +1,17 @@
+# -*- coding: utf-8 -*-
+
+import pytest
+
+def test_compare_engines(flights_files, spark_context, record_property):
+    pytest.importorskip("pyspark.sql")
+    import flight_data
+    import analyse_spark_df
+    fnames, plane_data = flights_files
+    spark = analyse_spark_df.pyspark.sql.SparkSession(spark_context)
+    results = analyse_spark_df.compare_engines(fnames, sc=spark_context, spark=spark, Plane=flight_data.get_plane_registry(plane_data))
+    for analysis in ("avg_delay_per_age_group", "avg_age_plane_year", "delay_over_avg_age_year"):
+        assert results[analysis], analysis
+    # Durations of both engines, in the JUnit report with --junitxml
+    for engine in ("time-rdd", "time-df"):
+        assert results[engine] > 0, engine
+        record_property(engine, results[engine])
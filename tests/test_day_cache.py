@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import itertools
+
+import numpy as np
+
+import baseline
+import day_cache
+import fake_cassandra
+from day_cache import DayCache, PARTIAL_SHAPE, invalidate_days
+from feed_cassandra import InsertFlight
+from analyse_cassandra import GetFlight, time_cube_between_dates
+
+FIRST_DAY = datetime.date(2007, 1, 1)
+
+def days(start, stop):
+    return [FIRST_DAY + datetime.timedelta(days=day) for day in range(start, stop)]
+
+def partials(days):
+    return {day: np.full(PARTIAL_SHAPE, float(day.day)) for day in days}
+
+def test_eviction(tmp_path, monkeypatch):
+    # A clock which moves at every call, so that the days used last are known
+    clock = itertools.count()
+    monkeypatch.setattr(day_cache.time, "time", lambda: float(next(clock)))
+    size = np.zeros(PARTIAL_SHAPE).nbytes
+    cache = DayCache(str(tmp_path / "cache.sqlite"), max_bytes=4 * size)
+    for day, partial in partials(days(0, 4)).items():
+        cache.put_many({day: partial}, "flights")
+    cache.get_many(days(0, 1), "flights")
+    cache.put_many(partials(days(4, 6)), "flights")
+    # The days used least recently are evicted first
+    found = cache.get_many(days(0, 6), "flights")
+    assert sorted(found) == days(0, 1) + days(3, 6)
+    assert all(np.array_equal(partial, partials([day])[day]) for day, partial in found.items())
+    cache.close()
+
+def test_invalidate(tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache = DayCache(path)
+    cache.put_many(partials(days(0, 5)), "flights")
+    cache.put_many(partials(days(0, 5)), "rollup")
+    cache.invalidate(days(1, 2))
+    invalidate_days([(day.year, day.month, day.day) for day in days(3, 4)], path)
+    # Every source of the days is removed
+    for source in ("flights", "rollup"):
+        assert sorted(cache.get_many(days(0, 5), source)) == days(0, 1) + days(2, 3) + days(4, 5)
+    cache.close()
+    invalidate_days(days(0, 5), str(tmp_path / "missing.sqlite"))
+    assert not (tmp_path / "missing.sqlite").exists()
+
+def test_insert_invalidates_days(flights_files, tmp_path):
+    fnames, plane_data = flights_files
+    flights = [flight for flight in baseline.read_csvs(fnames[1:], plane_data) if flight.month == 1]
+    dt1, dt2 = datetime.datetime(2007, 1, 1), datetime.datetime(2007, 2, 1)
+    path = str(tmp_path / "cache.sqlite")
+    session = fake_cassandra.Session()
+    getter = GetFlight(session=session)
+    late = [flight for flight in flights if 10 <= flight.day_month < 13]
+    InsertFlight(day_cache=path, session=session).bulk_insert_datastream([flight for flight in flights if flight not in late], report_every=None)
+    cache = DayCache(path)
+    time_cube_between_dates(dt1, dt2, getter=getter, cache=cache)
+    InsertFlight(day_cache=path, session=session).bulk_insert_datastream(late, report_every=None)
+    # Only the days of the flights inserted are read again, the cube is the one of the stored flights
+    assert sorted(cache.get_many(days(0, 31), "flights")) == days(0, 9) + days(12, 31)
+    cube = time_cube_between_dates(dt1, dt2, getter=getter, cache=cache)
+    cache.close()
+    expected = baseline.stats_per_value(getter, dt1, dt2, lambda date: date.hour, 24)
+    assert np.allclose(cube.slice("hour"), expected)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+import concurrent.futures
+import copy
+import functools
+
+import pytest
+
+import fake_cassandra
+import flight_data
+import feed_cassandra
+from feed_cassandra import InsertFlight
+
+@pytest.fixture
+def session(flights_files, monkeypatch):
+    """Stand-in session shared by the workers of ingest_files, run as threads, which records the tables read."""
+    session = fake_cassandra.Session()
+    session.selected = []
+    execute = session._execute
+    def recorded(statement, parameters):
+        query = statement.prepared_statement if isinstance(statement, fake_cassandra.BoundStatement) else statement
+        if isinstance(query, fake_cassandra.PreparedStatement) and query.parsed[0] == "select":
+            session.selected.append(query.parsed[1])
+        return execute(statement, parameters)
+    monkeypatch.setattr(session, "_execute", recorded)
+    monkeypatch.setattr(feed_cassandra, "InsertFlight", functools.partial(InsertFlight, session=session))
+    monkeypatch.setattr(feed_cassandra.concurrent.futures, "ProcessPoolExecutor", concurrent.futures.ThreadPoolExecutor)
+    monkeypatch.setattr(feed_cassandra, "get_plane_registry", functools.partial(flight_data.get_plane_registry, flights_files[1]))
+    return session
+
+def synced_rollup(session):
+    """Give the rollup counters synced from the stored rows of a copy of the session, as before any increment."""
+    copied = fake_cassandra.Session(session.tables)
+    copied.data = copy.deepcopy(session.data)
+    copied.data["delay_rollup_by_hour"] = {}
+    hours = {key[:3] + key[4:] for key in session.data["flight_by_time"]}
+    InsertFlight(day_cache=None, session=copied).sync_rollup(hours)
+    return copied.data["delay_rollup_by_hour"]
+
+def test_ingest_files_increments_rollup(flights_files, session, tmp_path):
+    fnames, plane_data = flights_files
+    stats = feed_cassandra.ingest_files(fnames, str(tmp_path / "checkpoint.jsonl"), processes=2, split_size=100000, day_cache=None)
+    assert stats["failed"] == 0 and stats["chunks"] > 2
+    # Only the hours cut between two byte ranges are read back, the others are counted from the rows inserted
+    assert 0 < stats["rollup_synced"] <= 2 * stats["chunks"] < stats["rollup_hours"]
+    assert session.selected.count("flight_by_time") == stats["rollup_synced"]
+    assert session.data["delay_rollup_by_hour"] == synced_rollup(session)
+
+def test_ingest_files_syncs_pending_rollup(flights_files, session, tmp_path):
+    fnames, plane_data = flights_files
+    checkpoint = str(tmp_path / "checkpoint.jsonl")
+    feed_cassandra.ingest_files(fnames, checkpoint, processes=2, split_size=100000, rollup=False, day_cache=None)
+    assert session.data["delay_rollup_by_hour"] == {}
+    # The next run has nothing to insert, the rollup of the byte ranges of the previous run is synced from the stored rows
+    stats = feed_cassandra.ingest_files(fnames, checkpoint, processes=2, split_size=100000, day_cache=None)
+    assert stats["rows"] == 0 and stats["rollup_synced"] == stats["rollup_hours"] > 0
+    assert session.data["delay_rollup_by_hour"] == synced_rollup(session)
+    assert feed_cassandra.ingest_files(fnames, checkpoint, processes=2, split_size=100000, day_cache=None)["rollup_hours"] == 0
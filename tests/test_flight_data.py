@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pytest
+
+import flight_data
+import baseline
+
+def rows(batches):
+    return [flight for batch in batches for flight in batch.rows()]
+
+@pytest.fixture(scope="module")
+def expected(flights_files):
+    fnames, plane_data = flights_files
+    return list(baseline.read_csvs(fnames, plane_data))
+
+@pytest.fixture(scope="module")
+def Plane(flights_files):
+    return flight_data.get_plane_registry(flights_files[1])
+
+def test_read_csvs_batches(flights_files, Plane, expected):
+    fnames, plane_data = flights_files
+    batches = list(flight_data.read_csvs_batches(fnames, batch_size=999, Plane=Plane, use_cache=False))
+    assert all(0 < len(batch) <= 999 for batch in batches)
+    assert rows(batches) == expected
+    # Missing values are read as 'NA' as by the row-wise reader
+    assert any('NA' in flight for flight in expected)
+
+def test_read_csvs_parallel(flights_files, Plane, expected):
+    fnames, plane_data = flights_files
+    read = flight_data.read_csvs_batches(fnames, Plane=Plane, use_cache=False, processes=2, split_size=50000)
+    assert rows(read) == expected
+    read = flight_data.read_csvs_batches(fnames, Plane=Plane, use_cache=False, processes=2, ordered=False, split_size=50000)
+    assert sorted(rows(read), key=repr) == sorted(expected, key=repr)
+    assert list(flight_data.read_csvs(fnames, limit=1234, Plane=Plane, use_cache=False)) == expected[:1234]
+
+def test_columnar_cache(flights_files, Plane, expected, tmp_path):
+    fnames, plane_data = flights_files
+    cache_dir = str(tmp_path)
+    flight_data.build_caches(fnames, cache_dir)
+    assert all(flight_data.is_cache_fresh(fname, cache_dir) for fname in fnames)
+    batches = list(flight_data.read_csvs_batches(fnames, batch_size=777, Plane=Plane, cache_dir=cache_dir))
+    # Integer columns are views on the memory-mapped files
+    assert all(isinstance(batch.ArrDelay.base, np.memmap) for batch in batches)
+    assert rows(batches) == expected
+    read = flight_data.read_csvs_batches(fnames, Plane=Plane, cache_dir=cache_dir, processes=2, split_size=50000)
+    assert rows(read) == expected
+
+def test_columnar_cache_stale(flights_files, Plane, tmp_path):
+    fnames, plane_data = flights_files
+    fname = str(tmp_path / "flights.csv")
+    with open(fnames[0]) as f:
+        lines = f.readlines()
+    with open(fname, "w") as f:
+        f.writelines(lines[:1000])
+    flight_data.build_cache(fname)
+    with open(fname, "a") as f:
+        f.writelines(lines[1000:2000])
+    # The cache of a modified file is not read anymore
+    assert not flight_data.is_cache_fresh(fname)
+    expected = list(baseline.read_csvs([fname], plane_data))
+    assert len(expected) == 1999
+    assert list(flight_data.read_csvs([fname], Plane=Plane)) == expected
+
+def read_splits(splits, Plane):
+    return rows(batch for fname, start, stop in splits for batch in flight_data._split_batches(fname, start, stop, Plane, 1000))
+
+def test_file_splits(flights_files, Plane, expected):
+    fnames, plane_data = flights_files
+    splits = [split for fname in fnames for split in flight_data.file_splits(fname, 30000)]
+    assert len(splits) > len(fnames)
+    # The byte ranges of a file follow each other, from the end of the header to the end of the file
+    for fname in fnames:
+        ranges = [(start, stop) for name, start, stop in splits if name == fname]
+        with open(fname, "rb") as f:
+            assert ranges[0][0] == len(f.readline()) and ranges[-1][1] == len(f.read()) + ranges[0][0]
+        assert all(stop == start for (_, stop), (start, _) in zip(ranges, ranges[1:]))
+    assert read_splits(splits, Plane) == expected
+
+def test_manifest_new_splits(flights_files, Plane, tmp_path):
+    fnames, plane_data = flights_files
+    fname = str(tmp_path / "flights.csv")
+    with open(fnames[0]) as f:
+        lines = f.readlines()
+    with open(fname, "w") as f:
+        f.writelines(lines[:1000])
+    manifest = flight_data.Manifest()
+    read = []
+    for appended in (lines[1000:2000], lines[2000:3000] + [lines[3000][:10]], [lines[3000][10:]] + lines[3001:]):
+        splits = manifest.new_splits([fname], 20000)
+        read.extend(read_splits(splits, Plane))
+        for name, start, stop in splits:
+            manifest.mark(name, stop)
+        manifest.save(str(tmp_path / "manifest.json"))
+        manifest = flight_data.Manifest.load(str(tmp_path / "manifest.json"))
+        with open(fname, "a") as f:
+            f.writelines(appended)
+    read.extend(read_splits(manifest.new_splits([fname], 20000), Plane))
+    # Every line is read once, the incomplete last line is read once it is complete
+    assert read == list(baseline.read_csvs([fname], plane_data))
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import datetime
+import collections
+
+import pytest
+
+import baseline
+import metrics
+import flight_data
+import fake_cassandra
+from flight_data import Flight
+from feed_cassandra import InsertFlight, is_valid
+from analyse_cassandra import GetFlight, time_cube_between_dates
+
+@pytest.fixture
+def registry():
+    metrics.REGISTRY.reset()
+    metrics.enable()
+    yield metrics.REGISTRY
+    metrics.disable()
+    metrics.REGISTRY.reset()
+
+def counters(registry):
+    """Give the counters of the JSON export as {(name, labels): value}."""
+    exported = json.loads(json.dumps(registry.to_dict()))
+    return {(counter["name"], tuple(sorted(counter["labels"].items()))): counter["value"] for counter in exported["counters"]}
+
+def test_read_metrics(flights_files, registry):
+    fnames, plane_data = flights_files
+    expected = list(baseline.read_csvs(fnames, plane_data))
+    read = list(flight_data.read_csvs(fnames, Plane=flight_data.get_plane_registry(plane_data), use_cache=False))
+    assert read == expected
+    na = collections.Counter(field for flight in expected for field, value in zip(Flight._fields, flight) if value == 'NA' and field != "tailnum")
+    expected_counters = {("rows_read", ()): len(expected), ("bytes_read", (("source", "csv"),)): sum(map(os.path.getsize, fnames))}
+    expected_counters.update({("na_values", (("field", field),)): count for field, count in na.items()})
+    assert counters(registry) == expected_counters
+    stages = {stage["stage"]: stage for stage in registry.to_dict()["stages"]}
+    assert stages["read_csvs_batches"]["calls"] == 1 and stages["read_csvs_batches"]["wall_seconds"] > 0
+
+def test_cassandra_metrics(flights_files, registry, tmp_path):
+    fnames, plane_data = flights_files
+    flights = list(baseline.read_csvs(fnames[1:], plane_data))
+    session = fake_cassandra.Session()
+    InsertFlight(day_cache=None, session=session).bulk_insert_datastream(flights, report_every=None)
+    dt1, dt2 = datetime.datetime(2007, 1, 1), datetime.datetime(2007, 1, 8)
+    time_cube_between_dates(dt1, dt2, getter=GetFlight(session=session))
+    stored = [flight for flight in flights if is_valid(flight) and (flight.year, flight.month, flight.day_month) < (2007, 1, 8)]
+    exported = counters(registry)
+    assert exported[("rows_inserted", ())] == sum(map(is_valid, flights))
+    assert exported[("rows_rejected", ())] == len(flights) - sum(map(is_valid, flights))
+    # Flights of a plane at the same hour are stored once
+    assert exported[("rows_fetched", (("table", "flight_by_time"),))] == len({(f.day_month, f.hour, f.tailnum) for f in stored})
+    histograms = {histogram["name"]: histogram for histogram in registry.to_dict()["histograms"]}
+    assert histograms["cassandra_query_seconds"]["count"] == 7 * 24
+    # The Prometheus export has the same values
+    path = str(tmp_path / "metrics.prom")
+    registry.export(path, "prometheus")
+    with open(path) as f:
+        lines = f.read().splitlines()
+    assert f'flights_rows_inserted {exported[("rows_inserted", ())]}' in lines
+    assert 'flights_cassandra_query_seconds_count{table="flight_by_time"} 168' in lines
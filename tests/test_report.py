@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+
+import os
+import datetime
+
+import numpy as np
+
+import report
+import baseline
+import fake_cassandra
+from feed_cassandra import InsertFlight
+from analyse_cassandra import GetFlight, charts_hour, time_cube_between_dates
+
+def test_render(flights_files, tmp_path):
+    fnames, plane_data = flights_files
+    session = fake_cassandra.Session()
+    InsertFlight(day_cache=None, session=session).bulk_insert_datastream(baseline.read_csvs(fnames[1:], plane_data), report_every=None)
+    dt1, dt2 = datetime.datetime(2007, 1, 1), datetime.datetime(2007, 2, 1)
+    getter = GetFlight(session=session)
+    stats = time_cube_between_dates(dt1, dt2, getter=getter).slice("hour")
+    # The charts draw the statistics of the first version
+    assert np.allclose(stats, baseline.stats_per_value(getter, dt1, dt2, lambda date: date.hour, 24))
+
+    directory = str(tmp_path)
+    charts = charts_hour(*stats)
+    filenames = [chart.filename for chart in charts]
+    assert sorted(report.render(charts, directory, processes=2)) == sorted(filenames)
+    assert all(os.path.getsize(os.path.join(directory, filename)) > 0 for filename in filenames)
+    # A chart is rendered again only when its inputs change, or when its image is removed
+    assert report.render(charts_hour(*stats), directory) == []
+    changed = list(stats)
+    changed[2] = changed[2] + 1
+    assert report.render(charts_hour(*changed), directory, processes=1) == ['avg_std_delay_hour.png']
+    os.remove(os.path.join(directory, 'avg_delay_cancelled.png'))
+    assert report.render(charts_hour(*changed), directory) == ['avg_delay_cancelled.png']
+    assert sorted(report.render(charts_hour(*changed), directory, force=True)) == sorted(filenames)